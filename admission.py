@@ -0,0 +1,281 @@
+"""
+Admission control for LLM generations.
+
+LM Studio only serves a few generations at once, so requests are admitted
+through a bounded number of slots. Waiting requests are ordered by priority
+class (admin and dosen before user, background work last) and, within a
+class, round-robin across users so one user's burst cannot starve the rest.
+Each user has a cap on generations in flight and on requests waiting; when
+the queue is full new requests are shed right away with a Retry-After
+estimate instead of timing out after a long wait.
+
+Tickets can be waited on from threads (Flask) or coroutines (FastAPI).
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from llm_client import LLMError
+from metrics import metrics
+
+# Lower runs first; unknown roles are treated like 'user'
+PRIORITIES = {'admin': 0, 'dosen': 0, 'user': 1, 'background': 2}
+
+# Initial guess of how long one generation holds a slot (seconds)
+INITIAL_HOLD_TIME = 10.0
+HOLD_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(LLMError):
+    """The request was shed (queue full, per-user limit) or waited too long"""
+
+    def __init__(self, message, status_code=503, retry_after=None):
+        super().__init__(message, retry_after)
+        self.status_code = status_code
+
+
+class Ticket:
+    """A request's place in the admission queue"""
+
+    def __init__(self, user_id, priority, loop=None):
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+        self._event = threading.Event()
+        self._loop = loop
+        self._future = loop.create_future() if loop is not None else None
+
+    @property
+    def admitted(self):
+        return self.admitted_at is not None
+
+    def wait(self, timeout=None):
+        """Block until admitted; returns False on timeout"""
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """Wait in a coroutine until admitted; returns False on timeout"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.admitted
+
+    def _admit(self):
+        self.admitted_at = time.monotonic()
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AdmissionController:
+    """Bounded, prioritized, per-user fair admission of LLM requests"""
+
+    def __init__(self, max_concurrent=2, max_queue=50, user_max_in_flight=1, user_max_queued=3,
+                 queue_timeout=60.0, priorities=PRIORITIES):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.user_max_in_flight = user_max_in_flight
+        self.user_max_queued = user_max_queued
+        self.queue_timeout = queue_timeout
+        self.priorities = priorities
+        self.hold_time = INITIAL_HOLD_TIME
+        self.in_flight = 0
+        self.queued = 0
+        self._queues = {}  # priority -> OrderedDict(user_id -> deque of tickets), in round-robin order
+        self._user_in_flight = Counter()
+        self._lock = threading.Lock()
+
+    def enqueue(self, user_id, role='user', loop=None):
+        """
+        Queue a request and admit it right away if a slot is free
+
+        Args:
+            user_id: Requesting user (None for background work)
+            role (str): User role, selects the priority class
+            loop: Event loop to notify, for tickets awaited with ``wait_async``
+
+        Returns:
+            Ticket: Wait on it, then ``release`` it when the generation ends
+
+        Raises:
+            AdmissionRejected: If the queue or the user's share of it is full
+        """
+        priority = self.priorities.get(role, self.priorities['user'])
+        with self._lock:
+            users = self._queues.setdefault(priority, OrderedDict())
+            if len(users.get(user_id, ())) >= self.user_max_queued:
+                metrics.increment('admission.rejected.user_limit')
+                raise AdmissionRejected(
+                    "Too many pending questions; wait for the previous answers",
+                    429, self._retry_after()
+                )
+            if self.queued >= self.max_queue:
+                metrics.increment('admission.rejected.queue_full')
+                raise AdmissionRejected("LM Studio is busy, please retry later", 503, self._retry_after())
+
+            ticket = Ticket(user_id, priority, loop)
+            users.setdefault(user_id, deque()).append(ticket)
+            self.queued += 1
+            self._dispatch()
+        return ticket
+
+    def release(self, ticket):
+        """Free the ticket's slot, or drop it from the queue if it was never admitted"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self.in_flight -= 1
+                self._user_in_flight[ticket.user_id] -= 1
+                if not self._user_in_flight[ticket.user_id]:
+                    del self._user_in_flight[ticket.user_id]
+                held = time.monotonic() - ticket.admitted_at
+                self.hold_time += HOLD_TIME_ALPHA * (held - self.hold_time)
+            else:
+                users = self._queues[ticket.priority]
+                users[ticket.user_id].remove(ticket)
+                if not users[ticket.user_id]:
+                    del users[ticket.user_id]
+                self.queued -= 1
+            self._dispatch()
+
+    def timeout_error(self):
+        metrics.increment('admission.timeouts')
+        with self._lock:
+            retry_after = self._retry_after()
+        return AdmissionRejected(f"No LM Studio slot within {self.queue_timeout}s", 503, retry_after)
+
+    def wait_limit(self, ticket, deadline=None, reserve=0.0):
+        """
+        How much longer a ticket may wait, and the error to raise when that runs out
+
+        The wait ends ``queue_timeout`` after the ticket was queued, or earlier
+        to leave ``reserve`` seconds before a request ``deadline``
+        (``deadline.Deadline``), which then raises ``DeadlineExceeded``.
+
+        Returns:
+            tuple: ``(seconds, error factory)``
+        """
+        limit = ticket.enqueued_at + self.queue_timeout - time.monotonic()
+        if deadline is not None and deadline.wait_limit(limit, reserve) < limit:
+            return deadline.wait_limit(limit, reserve), lambda: deadline.exceeded('queue')
+        return limit, self.timeout_error
+
+    @contextmanager
+    def admit(self, user_id, role='user', deadline=None, reserve=0.0):
+        """Hold a slot for the duration of the block, waiting up to ``queue_timeout`` (see ``wait_limit``)"""
+        ticket = self.enqueue(user_id, role)
+        try:
+            limit, error = self.wait_limit(ticket, deadline, reserve)
+            if not ticket.wait(max(0.0, limit)):
+                raise error()
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def admit_async(self, user_id, role='user', deadline=None, reserve=0.0):
+        """``admit`` for coroutines: waits without blocking the event loop"""
+        ticket = self.enqueue(user_id, role, asyncio.get_running_loop())
+        try:
+            limit, error = self.wait_limit(ticket, deadline, reserve)
+            if not await ticket.wait_async(max(0.0, limit)):
+                raise error()
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def position(self, ticket):
+        """
+        1-based position of a waiting ticket (0 once admitted)
+
+        Counts every waiting ticket of a higher priority class plus the
+        tickets of other users that round-robin will admit first.
+        """
+        with self._lock:
+            if ticket.admitted or ticket.released:
+                return 0
+            position = 1
+            for priority, users in self._queues.items():
+                if priority < ticket.priority:
+                    position += sum(len(tickets) for tickets in users.values())
+                elif priority == ticket.priority:
+                    rank = users[ticket.user_id].index(ticket)
+                    before = True
+                    for user_id, tickets in users.items():
+                        if user_id == ticket.user_id:
+                            before = False
+                            position += rank
+                        else:
+                            position += min(len(tickets), rank + 1 if before else rank)
+            return position
+
+    def user_status(self, user_id):
+        """Positions of a user's waiting tickets and their number of generations in flight"""
+        with self._lock:
+            tickets = [ticket for users in self._queues.values() for ticket in users.get(user_id, ())]
+            in_flight = self._user_in_flight[user_id]
+        return {
+            'in_flight': in_flight,
+            'queued': [{
+                'position': self.position(ticket),
+                'waited': time.monotonic() - ticket.enqueued_at
+            } for ticket in tickets]
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_queue': self.max_queue,
+                'queued_by_priority': {
+                    priority: sum(len(tickets) for tickets in users.values())
+                    for priority, users in sorted(self._queues.items())
+                },
+                'average_hold_time': self.hold_time
+            }
+
+    def _retry_after(self):
+        """Estimated seconds until a new request could be admitted"""
+        return max(1, math.ceil(self.hold_time * (self.queued + 1) / self.max_concurrent))
+
+    def _dispatch(self):
+        while self.in_flight < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self.queued -= 1
+            self.in_flight += 1
+            self._user_in_flight[ticket.user_id] += 1
+            metrics.observe('admission.wait_time', time.monotonic() - ticket.enqueued_at)
+            ticket._admit()
+
+    def _next_ticket(self):
+        """Pop the next ticket: best priority first, round-robin over users under their cap"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            for user_id, tickets in users.items():
+                if self._user_in_flight[user_id] >= self.user_max_in_flight:
+                    continue
+                ticket = tickets.popleft()
+                if tickets:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                return ticket
+        return None
@@ -1,21 +1,48 @@
-from flask import Flask, request, jsonify, session, render_template
+from flask import Flask, request, jsonify, session, render_template, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
-import requests
 import PyPDF2
-from docx import Document
+import docx
+import csv
 import io
 import json
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from prompt_builder import format_document_context, build_messages, build_warmup_messages, DOCUMENT_CONTEXT_CHARS
+from conversation_memory import MemoryStore, estimate_tokens
+from document_index import UserIndexStore, encode_terms, decode_terms
+from prompt_compression import CompressionStats, compress_passage
+from text_analyzer import analyze, stem
+from metrics import metrics
+from llm_backends import BackendPool
+from llm_client import LLMClient, CircuitBreaker, LLMError, LLMTimeoutError
+from admission import AdmissionController, AdmissionRejected
+from single_flight import SingleFlight, request_key
+from cancellation import SessionGenerations
+from question_router import QuestionRouter, ModelTier, PREDEFINED_QUESTIONS, FAST, ANALYTICAL
+from full_analysis import build_analysis_messages, parse_answers, response_format
+from jobs import Job, JobStore, ByteRateLimiter, run_bounded
+from deadline import DEADLINE_HEADER, DeadlineExceeded, parse_deadline
+from extractive import ExtractiveAnswerer, format_extractive_answer
+from bibliography import read_bibliography, author_key, catalog_fields, format_catalog_answer
+from related_papers import RelatedPapers
+from near_duplicates import DuplicateIndex, minhash, encode_signature, decode_signature
+from chunking import ChunkTerms, chunk_hash, content_chunks, pdf_page_keys, extract_pdf_pages, diff_chunks
+from idempotency import IdempotencyStore, fingerprint, IDEMPOTENCY_HEADER, REPLAYED_HEADER, REPLAYED_HEADERS, MAX_KEY_LENGTH
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///document_summarizer.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///document_summarizer.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Ensure upload directory exists
@@ -46,6 +73,8 @@ class Document(db.Model):
     content = db.Column(db.Text)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User')
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,9 +84,281 @@ class ChatHistory(db.Model):
     response = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     document_ids = db.Column(db.String(500))  # Store as comma-separated IDs
+    
+    user = db.relationship('User')
+    
+    __table_args__ = (
+        db.Index('ix_chat_history_user_session', 'user_id', 'session_id', 'timestamp'),
+    )
+
+class RoutingDecision(db.Model):
+    """Model tier chosen for an answer and how the generation went, for tuning the router"""
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, index=True)  # Not a foreign key: decisions outlive deleted chats
+    question_id = db.Column(db.String(50))
+    tier = db.Column(db.String(20), nullable=False, index=True)
+    reason = db.Column(db.String(50))
+    model = db.Column(db.String(100))
+    max_tokens = db.Column(db.Integer)
+    temperature = db.Column(db.Float)
+    generation_time = db.Column(db.Float)  # None when the answer was shared with an identical request
+    answer_tokens = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CachedAnswer(db.Model):
+    """LLM answer keyed by the hash of its prompt and parameters, reused by fan-out jobs"""
+    key = db.Column(db.String(64), primary_key=True)
+    document_id = db.Column(db.Integer, index=True)
+    question = db.Column(db.Text, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ChatSession(db.Model):
+    id = db.Column(db.String(36), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    title = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DocumentCatalog(db.Model):
+    """Bibliographic metadata of a document, read at upload"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(300))
+    authors = db.Column(db.Text)  # Names in page order, separated by '; '
+    year = db.Column(db.Integer)
+    doi = db.Column(db.String(255), index=True)
+    
+    __table_args__ = (
+        db.Index('ix_document_catalog_user_year', 'user_id', 'year'),
+    )
+
+class DocumentSignature(db.Model):
+    """MinHash signature of a document's text, for near-duplicate detection"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    minhash = db.Column(db.Text)  # encode_signature(); None for documents without text
+
+class DocumentTerms(db.Model):
+    """Search index term frequencies of a document's filename and text, so indexes load without analyzing it again"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    counts = db.Column(db.Text, nullable=False)  # encode_terms()
+
+class DocumentChunk(db.Model):
+    """Extracted text of a PDF page by page key, shared by every document containing the page"""
+    key = db.Column(db.String(40), primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+
+class DocumentChunkRef(db.Model):
+    """The chunks of a document, in order: PDF pages, or content-defined chunks of other formats"""
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(40), nullable=False, index=True)
+
+class DocumentVersion(db.Model):
+    """Link from a re-uploaded document to the version it replaces"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+
+class IngestedFile(db.Model):
+    """Content hash of a file loaded by bulk_ingest.py, so a rerun skips it"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    source = db.Column(db.String(500))  # Path of the file in the directory or archive
+    
+    __table_args__ = (
+        db.Index('ix_ingested_file_user_hash', 'user_id', 'sha256'),
+    )
+
+class DocumentExtraction(db.Model):
+    """The extractor version a document's content and chunks come from; documents without one predate versioning"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+class ExtractionRun(db.Model):
+    """Checkpoint of a re-extraction run: documents up to ``cursor`` (by id) are done"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, paused, done, failed
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    job_id = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DocumentAuthor(db.Model):
+    """One author of a cataloged document, for filtering and counting documents by author"""
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    name_key = db.Column(db.String(200), nullable=False)  # author_key(name)
+    
+    __table_args__ = (
+        db.Index('ix_document_author_user_key', 'user_id', 'name_key'),
+    )
 
 # LM Studio Configuration
 LM_STUDIO_URL = "http://localhost:1234/v1/chat/completions"
+LM_STUDIO_MODEL = os.environ.get('LM_STUDIO_MODEL', 'local-model')
+
+# Pool of OpenAI-compatible backends (comma-separated chat completions URLs),
+# health-probed via /v1/models and balanced by load and latency
+LM_STUDIO_URLS = [url.strip() for url in os.environ.get('LM_STUDIO_URLS', LM_STUDIO_URL).split(',') if url.strip()]
+
+llm_backends = BackendPool(
+    LM_STUDIO_URLS,
+    probe_interval=float(os.environ.get('LLM_PROBE_INTERVAL', 10)),
+    unhealthy_after=int(os.environ.get('LLM_UNHEALTHY_AFTER_FAILURES', 3))
+)
+
+llm_client = LLMClient(
+    llm_backends,
+    model=LM_STUDIO_MODEL,
+    connect_timeout=float(os.environ.get('LLM_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.environ.get('LLM_READ_TIMEOUT', 30)),
+    max_retries=int(os.environ.get('LLM_MAX_RETRIES', 2)),
+    pool_size=int(os.environ.get('LLM_POOL_SIZE', 20)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('LLM_CIRCUIT_FAILURE_THRESHOLD', 5)),
+        reset_timeout=float(os.environ.get('LLM_CIRCUIT_RESET_TIMEOUT', 30))
+    )
+)
+
+# Admission control in front of LM Studio: concurrent generations, queue
+# depth, per-user caps and the longest a request may wait for a slot
+llm_admission = AdmissionController(
+    max_concurrent=int(os.environ.get('LLM_MAX_CONCURRENT', 2)),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', 50)),
+    user_max_in_flight=int(os.environ.get('LLM_USER_MAX_IN_FLIGHT', 1)),
+    user_max_queued=int(os.environ.get('LLM_USER_MAX_QUEUED', 3)),
+    queue_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT', 60))
+)
+
+# Seconds between live queue position updates on streamed answers
+QUEUE_POSITION_INTERVAL = 1.0
+
+# Identical concurrent prompts share one generation; a follower gives up if
+# the shared answer makes no progress for as long as a leader could wait
+llm_flights = SingleFlight()
+FLIGHT_WAIT_TIMEOUT = llm_admission.queue_timeout + llm_client.read_timeout
+
+# Asking again in a chat session cancels the answer still being generated there
+session_generations = SessionGenerations(llm_flights)
+SUPERSEDED_MESSAGE = "Cancelled: a newer question was asked in this session"
+
+# Generation parameters used for answers
+ANSWER_MAX_TOKENS = 1000
+ANSWER_TEMPERATURE = 0.7
+
+# Model tiers: short factual questions go to a small fast model with a low,
+# deterministic token budget; analytical ones to the large model
+question_router = QuestionRouter([
+    ModelTier(
+        FAST,
+        os.environ.get('LM_STUDIO_FAST_MODEL', LM_STUDIO_MODEL),
+        max_tokens=int(os.environ.get('FAST_TIER_MAX_TOKENS', 300)),
+        temperature=0.0
+    ),
+    ModelTier(ANALYTICAL, LM_STUDIO_MODEL, max_tokens=ANSWER_MAX_TOKENS, temperature=ANSWER_TEMPERATURE)
+], tokens_per_second=float(os.environ.get('LLM_TOKENS_PER_SECOND', 20)))
+
+# End-to-end request deadlines (seconds): the endpoint's default, or the
+# client's X-Request-Timeout up to the maximum. Retrieval, context packing,
+# the queue and the generation all spend from the same budget
+ASK_DEADLINE = float(os.environ.get('ASK_DEADLINE', 90))
+FULL_ANALYSIS_DEADLINE = float(os.environ.get('FULL_ANALYSIS_DEADLINE', 180))
+MAX_REQUEST_DEADLINE = float(os.environ.get('MAX_REQUEST_DEADLINE', 300))
+
+# Degraded mode: without LM Studio (circuit open, no healthy backend, full
+# queue, or a failed generation) /ask quotes the most relevant passages of the
+# documents instead of failing; clients can also ask for it with "mode": "fast"
+EXTRACTIVE_FALLBACK = os.environ.get('EXTRACTIVE_FALLBACK', 'True').lower() == 'true'
+extractive_answerer = ExtractiveAnswerer(passages=int(os.environ.get('EXTRACTIVE_PASSAGES', 3)))
+
+# Idempotency-Key support for /ask and /upload: responses are replayed to
+# retries for IDEMPOTENCY_TTL seconds, and a retry of a request still running
+# waits up to IDEMPOTENCY_WAIT_TIMEOUT for it
+idempotency_store = IdempotencyStore(ttl=float(os.environ.get('IDEMPOTENCY_TTL', 86400)))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 120))
+
+# Full analysis: every predefined question about a document in one request,
+# with a token budget per question and JSON-schema constrained output
+FULL_ANALYSIS_TOKENS_PER_QUESTION = int(os.environ.get('FULL_ANALYSIS_TOKENS_PER_QUESTION', 250))
+FULL_ANALYSIS_TEMPERATURE = 0.2
+FULL_ANALYSIS_STRUCTURED_OUTPUT = os.environ.get('FULL_ANALYSIS_STRUCTURED_OUTPUT', 'True').lower() == 'true'
+
+# Background jobs: seconds finished jobs stay retrievable, and seconds between
+# keep-alive comments while a streamed job has no new results
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))
+JOB_KEEPALIVE_INTERVAL = 15.0
+
+# /ask?async=1 runs the generation in a job; it is not bound by a client or
+# proxy timeout, so LM Studio gets a much longer read timeout. Long polls of
+# the job wait at most ASK_JOB_MAX_WAIT seconds
+ask_jobs = JobStore(workers=int(os.environ.get('ASK_JOB_WORKERS', 8)), ttl=JOB_TTL)
+ASK_JOB_READ_TIMEOUT = float(os.environ.get('ASK_JOB_READ_TIMEOUT', 600))
+ASK_JOB_MAX_WAIT = 30.0
+
+# Fan-out: one question over many documents, answered per document by at most
+# FANOUT_CONCURRENCY generations at a time at background priority
+fanout_jobs = JobStore(workers=int(os.environ.get('FANOUT_JOB_WORKERS', 2)), ttl=JOB_TTL)
+FANOUT_CONCURRENCY = int(os.environ.get('FANOUT_CONCURRENCY', 2))
+FANOUT_MAX_DOCUMENTS = int(os.environ.get('FANOUT_MAX_DOCUMENTS', 200))
+FANOUT_MAX_ATTEMPTS = 3
+FANOUT_CSV_COLUMNS = ['document_id', 'filename', 'username', 'answer', 'cached', 'error']
+
+# Re-extraction of documents extracted by an older EXTRACTOR_VERSION: files
+# read by REEXTRACT_WORKERS threads at REEXTRACT_BYTES_PER_SECOND at most,
+# written back REEXTRACT_BATCH_SIZE documents per (short) transaction
+reextraction_jobs = JobStore(workers=1, ttl=JOB_TTL)
+REEXTRACT_WORKERS = int(os.environ.get('REEXTRACT_WORKERS', 2))
+REEXTRACT_BATCH_SIZE = int(os.environ.get('REEXTRACT_BATCH_SIZE', 20))
+REEXTRACT_BYTES_PER_SECOND = float(os.environ.get('REEXTRACT_BYTES_PER_SECOND', 5_000_000))
+
+# Prime LM Studio's prompt cache with the document prefix right after upload
+PROMPT_CACHE_WARMUP = os.environ.get('PROMPT_CACHE_WARMUP', 'False').lower() == 'true'
+
+# Conversation memory: token budgets for the rolling window, each replayed
+# answer and the running summary of older turns
+MEMORY_WINDOW_TOKENS = int(os.environ.get('MEMORY_WINDOW_TOKENS', 1500))
+MEMORY_ANSWER_TOKENS = int(os.environ.get('MEMORY_ANSWER_TOKENS', 300))
+MEMORY_SUMMARY_TOKENS = int(os.environ.get('MEMORY_SUMMARY_TOKENS', 300))
+# Number of stored turns replayed when a session is loaded into memory
+MEMORY_REPLAY_TURNS = 20
+
+DEFAULT_SESSION_ID = 'default'
+
+IRRELEVANT_QUESTION_RESPONSE = "Maaf, tolong berikan pertanyaan yang relevan dengan paper atau universitas negeri semarang"
+
+conversation_memories = MemoryStore(
+    max_sessions=int(os.environ.get('MEMORY_MAX_SESSIONS', 1000)),
+    window_tokens=MEMORY_WINDOW_TOKENS,
+    answer_tokens=MEMORY_ANSWER_TOKENS,
+    summary_tokens=MEMORY_SUMMARY_TOKENS
+)
+
+# Automatic document selection when /ask has no document_ids: at most this
+# many top-ranked documents, limited further by the context budget
+AUTO_SELECT_MAX_DOCUMENTS = int(os.environ.get('AUTO_SELECT_MAX_DOCUMENTS', 3))
+AUTO_SELECT_CONTEXT_CHARS = int(os.environ.get('AUTO_SELECT_CONTEXT_CHARS', 6000))
+
+# Default extractive compression ratio for document passages (1.0 = off);
+# clients can override it per request with "compression_ratio"
+PROMPT_COMPRESSION_RATIO = float(os.environ.get('PROMPT_COMPRESSION_RATIO', 1.0))
+
+# Near-duplicates (estimated Jaccard similarity of 5-word shingles) are
+# reported at upload from NEAR_DUPLICATE_THRESHOLD; fan-out jobs reuse cached
+# answers of documents from DUPLICATE_REUSE_THRESHOLD
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.8))
+DUPLICATE_REUSE_THRESHOLD = float(os.environ.get('DUPLICATE_REUSE_THRESHOLD', 0.9))
+
+# Most frequent authors listed in the /documents author facet
+CATALOG_AUTHOR_FACETS = 50
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
@@ -86,6 +387,81 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def stored_headers(response):
+    """The response headers replayed with an idempotent response"""
+    return {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+
+def replayed_response(stored):
+    """Rebuild a stored ``(status, headers, body)`` response for a retried request"""
+    status, headers, body = stored
+    response = Response(body, status=status, headers=headers)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def stored_stream(entry, response, body):
+    """Relay the ``body`` iterable of a streamed response, storing it for replay once it is complete"""
+    chunks = []
+    try:
+        for chunk in body:
+            chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        # Closing the wrapped stream is what aborts the generation upstream
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+    idempotency_store.complete(entry, response.status_code, stored_headers(response), b''.join(chunks))
+
+def idempotent(f):
+    """
+    Honor an Idempotency-Key header on a login-required route
+    
+    The first request with a key runs ``f``; retries get its response
+    replayed, waiting for it if it is still running. Streamed responses are
+    stored once they complete.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return f(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+        
+        scope = (session['user_id'], request.path, key)
+        request_hash = fingerprint(
+            request.method, request.path, request.query_string.decode('latin-1'),
+            request.content_type or '', request.get_data()
+        )
+        entry, leader = idempotency_store.begin(scope, request_hash)
+        while not leader:
+            if entry.fingerprint != request_hash:
+                return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+            if not entry.wait(IDEMPOTENCY_WAIT_TIMEOUT):
+                response = jsonify({'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'})
+                response.status_code = 409
+                response.headers['Retry-After'] = '5'
+                return response
+            if entry.response is not None:
+                return replayed_response(entry.response)
+            # The first request failed and stored nothing: run this one instead
+            entry, leader = idempotency_store.begin(scope, request_hash)
+        
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except BaseException:
+            idempotency_store.abandon(entry)
+            raise
+        if not response.is_streamed:
+            idempotency_store.complete(entry, response.status_code, stored_headers(response), response.get_data())
+            return response
+        response.response = stored_stream(entry, response, response.response)
+        # Does nothing if the stream completed; releases the key if it was cut off
+        response.call_on_close(lambda: idempotency_store.abandon(entry))
+        return response
+    return decorated_function
+
 def get_admin_or_dosen_user():
     """Helper function to get current user if they are admin or dosen"""
     if 'user_id' not in session:
@@ -106,6 +482,10 @@ def admin_or_dosen_required(f):
     return decorated_function
 
 # File processing functions
+# Bump when text extraction or its normalization changes: documents extracted
+# by an older version are re-extracted by /admin/reextract
+EXTRACTOR_VERSION = 1
+
 def extract_text_from_pdf(file_path):
     text = ""
     try:
@@ -120,7 +500,7 @@ def extract_text_from_pdf(file_path):
 def extract_text_from_docx(file_path):
     text = ""
     try:
-        doc = Document(file_path)
+        doc = docx.Document(file_path)
         for paragraph in doc.paragraphs:
             text += paragraph.text + "\n"
     except Exception as e:
@@ -149,48 +529,1406 @@ def extract_text_from_file(file_path, filename):
     else:
         return ""
 
+def save_catalog(document_id, user_id, bibliography):
+    """Store the output of ``read_bibliography`` as a document's catalog entry, replacing any; the caller commits"""
+    DocumentAuthor.query.filter_by(document_id=document_id).delete()
+    DocumentCatalog.query.filter_by(document_id=document_id).delete()
+    db.session.add(DocumentCatalog(
+        document_id=document_id,
+        user_id=user_id,
+        title=bibliography['title'],
+        authors='; '.join(bibliography['authors']) or None,
+        year=bibliography['year'],
+        doi=bibliography['doi']
+    ))
+    for name in bibliography['authors']:
+        db.session.add(DocumentAuthor(document_id=document_id, user_id=user_id, name=name, name_key=author_key(name)))
+
+def backfill_catalog(user_id, document_ids=None):
+    """Catalog the user's documents (or those of ``document_ids``) uploaded before the catalog existed"""
+    query = db.session.query(Document).outerjoin(
+        DocumentCatalog, DocumentCatalog.document_id == Document.id
+    ).filter(Document.user_id == user_id, DocumentCatalog.document_id.is_(None))
+    if document_ids is not None:
+        query = query.filter(Document.id.in_(document_ids))
+    documents = query.all()
+    for document in documents:
+        save_catalog(document.id, user_id, read_bibliography(
+            document.file_path, document.original_filename, document.content
+        ))
+    if documents:
+        db.session.commit()
+        metrics.increment('catalog.backfilled', len(documents))
+
+def catalog_entry(document, catalog):
+    """Bibliographic fields of a document for API responses"""
+    return {
+        'document_id': document.id,
+        'filename': document.original_filename,
+        'title': catalog.title if catalog else None,
+        'authors': catalog.authors.split('; ') if catalog and catalog.authors else [],
+        'year': catalog.year if catalog else None,
+        'doi': catalog.doi if catalog else None
+    }
+
+def document_listing(user_id, year=None, author=None):
+    """
+    The user's documents with their catalog entries, filtered by year and author, and the facet counts
+    
+    Each facet counts the documents matching the other filter, so a client
+    can show how many documents every other year (or author) would give.
+    
+    Args:
+        user_id (int): Owner of the documents
+        year (int): Only documents published that year
+        author (str): Only documents by this author, matched by ``author_key``
+    """
+    backfill_catalog(user_id)
+    key = author_key(author) if author else None
+    by_author = db.session.query(DocumentAuthor.document_id).filter(
+        DocumentAuthor.user_id == user_id, DocumentAuthor.name_key == key
+    )
+    
+    query = db.session.query(Document, DocumentCatalog).outerjoin(
+        DocumentCatalog, DocumentCatalog.document_id == Document.id
+    ).filter(Document.user_id == user_id)
+    if year is not None:
+        query = query.filter(DocumentCatalog.year == year)
+    if key:
+        query = query.filter(Document.id.in_(by_author))
+    
+    years = db.session.query(DocumentCatalog.year, func.count()).filter(
+        DocumentCatalog.user_id == user_id, DocumentCatalog.year.isnot(None)
+    )
+    if key:
+        years = years.filter(DocumentCatalog.document_id.in_(by_author))
+    
+    authors = db.session.query(
+        DocumentAuthor.name_key, func.min(DocumentAuthor.name), func.count(func.distinct(DocumentAuthor.document_id))
+    ).filter(DocumentAuthor.user_id == user_id)
+    if year is not None:
+        authors = authors.join(DocumentCatalog, DocumentCatalog.document_id == DocumentAuthor.document_id).filter(
+            DocumentCatalog.year == year
+        )
+    
+    return {
+        'documents': [dict(catalog_entry(doc, catalog), **{
+            'id': doc.id,
+            'uploaded_at': doc.uploaded_at.isoformat(),
+            'content_preview': doc.content[:200] + '...' if len(doc.content) > 200 else doc.content
+        }) for doc, catalog in query.all()],
+        'facets': {
+            'years': [
+                {'year': facet_year, 'count': count}
+                for facet_year, count in years.group_by(DocumentCatalog.year).order_by(DocumentCatalog.year.desc())
+            ],
+            'authors': [
+                {'author': name, 'key': name_key, 'count': count}
+                for name_key, name, count in authors.group_by(DocumentAuthor.name_key).order_by(
+                    func.count(func.distinct(DocumentAuthor.document_id)).desc(), DocumentAuthor.name_key
+                ).limit(CATALOG_AUTHOR_FACETS)
+            ]
+        }
+    }
+
+# Keywords are compared as analyzer stems, so "meneliti"/"diteliti" match "penelitian"
+PAPER_KEYWORDS = ['paper', 'skripsi', 'penelitian', 'jurnal', 'artikel', 'studi', 'analisis', 'metode', 'hasil', 'kesimpulan', 'abstrak', 'penulis', 'author',
+                  'research', 'study', 'thesis', 'journal', 'method', 'result', 'conclusion', 'abstract']
+PAPER_KEYWORD_STEMS = {stem(keyword) for keyword in PAPER_KEYWORDS} | {stem(keyword, 'en') for keyword in PAPER_KEYWORDS}
+UNNES_KEYWORDS = ['unnes', 'universitas negeri semarang', 'semarang', 'negeri semarang']
+
 def is_relevant_query(query):
     """Check if query is relevant to papers or UNNES"""
     query_lower = query.lower()
-    paper_keywords = ['paper', 'skripsi', 'penelitian', 'jurnal', 'artikel', 'studi', 'analisis', 'metode', 'hasil', 'kesimpulan', 'abstrak', 'penulis', 'author']
-    unnes_keywords = ['unnes', 'universitas negeri semarang', 'semarang', 'negeri semarang']
     
     # Check if query contains paper-related keywords
-    for keyword in paper_keywords:
-        if keyword in query_lower:
-            return True
+    if PAPER_KEYWORD_STEMS.intersection(analyze(query)):
+        return True
     
     # Check if query contains UNNES-related keywords
-    for keyword in unnes_keywords:
+    for keyword in UNNES_KEYWORDS:
         if keyword in query_lower:
             return True
     
     return False
 
-def query_lm_studio(messages, max_tokens=1000):
-    """Query LM Studio API"""
+def query_lm_studio(messages, max_tokens=1000, **params):
+    """
+    Query LM Studio API; ``params`` (model, temperature) override the defaults
+    
+    Raises:
+        LLMError: If LM Studio is unavailable or fails; never returned as an answer
+    """
+    start_time = time.monotonic()
+    content = llm_client.complete(messages, max_tokens=max_tokens, **params)
+    metrics.observe('llm.generation_time', time.monotonic() - start_time)
+    return content
+
+def stream_lm_studio(messages, max_tokens=1000, **params):
+    """Query LM Studio API with stream: true and yield the content deltas (raises LLMError)"""
+    return llm_client.stream(messages, max_tokens=max_tokens, **params)
+
+def generation_params(route):
+    """LM Studio parameters for a routing decision"""
+    params = {'model': route['model'], 'max_tokens': route['max_tokens'], 'temperature': route['temperature']}
+    if route.get('response_format'):
+        params['response_format'] = route['response_format']
+    return params
+
+def llm_error_response(error):
+    """Build the JSON error response for an LLM failure"""
+    if isinstance(error, AdmissionRejected):
+        status = error.status_code
+    else:
+        status = 504 if isinstance(error, LLMTimeoutError) else 503
+    response = jsonify({'error': str(error), 'retryable': True})
+    response.status_code = status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.5)))
+    return response
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events, on_close=None):
+    """Wrap an event generator in a streaming text/event-stream response"""
+    response = Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if on_close is not None:
+        # Runs even if the client disconnects before the generator starts
+        response.call_on_close(on_close)
+    return response
+
+def request_deadline(default):
+    """
+    Deadline of the current request: its X-Request-Timeout (capped) or the endpoint's ``default``
+    
+    Raises:
+        ValueError: If the header is not a positive number of seconds
+    """
+    return parse_deadline(request.headers.get(DEADLINE_HEADER), default, MAX_REQUEST_DEADLINE)
+
+def fit_to_deadline(prepared, deadline, stage):
+    """
+    End ``stage`` of a prepared question and cut its max_tokens to the time left
+    
+    Raises:
+        DeadlineExceeded: If too little time is left for the tier's shortest useful answer
+    """
+    if deadline is None:
+        return
+    route = prepared['route']
+    deadline.check(stage, question_router.min_generation_time(route['tier']))
+    route['max_tokens'] = deadline.fit_tokens(
+        route['max_tokens'],
+        question_router.tokens_per_second(route['tier']),
+        question_router.tiers[route['tier']].min_tokens
+    )
+
+def queue_position_events(ticket, deadline=None, reserve=0.0):
+    """
+    Yield SSE "queue" events with the live position until the ticket is admitted
+    
+    Raises:
+        AdmissionRejected: If no slot frees up within the queue timeout
+        DeadlineExceeded: If none frees up ``reserve`` seconds before the request ``deadline``
+    """
+    position = None
+    while not ticket.admitted:
+        limit, error = llm_admission.wait_limit(ticket, deadline, reserve)
+        if limit <= 0:
+            raise error()
+        current = llm_admission.position(ticket)
+        if current != position:
+            position = current
+            yield sse_event('queue', {'position': position})
+        ticket.wait(min(QUEUE_POSITION_INTERVAL, limit))
+
+def answer_key(prepared):
+    """Single-flight key of an answer generation; the session's history is part of it (see ``single_flight``)"""
+    params = generation_params(prepared['route'])
+    return request_key(params.pop('model'), prepared['messages'], **params)
+
+def join_answer_flight(prepared, generation=None):
+    """
+    Join or lead the flight for a prepared question; followers are marked in the result
+    
+    A leader's flight is attached to its cancellation ``generation``, if any.
+    """
+    flight, leader = llm_flights.join(answer_key(prepared))
+    if not leader:
+        prepared['result']['coalesced'] = True
+    elif generation is not None:
+        generation.flight = flight
+    return flight, leader
+
+def start_generation(prepared):
+    """Cancellation handle for an answer, superseding the one in progress in its session"""
+    return session_generations.start((prepared['user_id'], prepared['session_id']))
+
+def answer_question(prepared, user_id, role, read_timeout=None, generation=None, deadline=None):
+    """
+    Generate the answer to a prepared question, once per identical in-flight prompt
+    
+    ``read_timeout`` overrides LM Studio's read timeout (and how long a
+    follower waits for the shared answer). With a request ``deadline`` the
+    wait for a slot, max_tokens and the LM Studio request are all cut to the
+    time left.
+    
+    Returns:
+        tuple: ``(response, generation_time)``; the time is None for answers
+        shared with an identical request
+    
+    Raises:
+        LLMError: The generation failed (for followers: the leader's error)
+    """
+    flight, leader = join_answer_flight(prepared, generation)
+    if not leader:
+        wait_timeout = llm_admission.queue_timeout + read_timeout if read_timeout else FLIGHT_WAIT_TIMEOUT
+        if deadline is not None:
+            wait_timeout = min(wait_timeout, deadline.remaining())
+        return flight.result(wait_timeout), None
+    
+    reserve = question_router.min_generation_time(prepared['route']['tier'])
+    try:
+        with llm_admission.admit(user_id, role, deadline, reserve):
+            fit_to_deadline(prepared, deadline, 'queue')
+            start_time = time.monotonic()
+            response = query_lm_studio(
+                prepared['messages'], read_timeout=read_timeout, deadline=deadline,
+                **generation_params(prepared['route'])
+            )
+            generation_time = time.monotonic() - start_time
+        flight.publish(response)
+        flight.finish()
+        return response, generation_time
+    except LLMError as e:
+        flight.finish(e)
+        raise
+    finally:
+        flight.abandon()
+
+def stream_answer(prepared, flight, ticket=None, generation=None, deadline=None):
+    """
+    Generate SSE events for a streamed answer and persist it when complete
+    
+    The flight's leader (the request holding ``ticket``) emits "queue" events
+    while waiting for an LM Studio slot and streams the generation into the
+    flight; identical requests follow the flight instead. Then come a "meta"
+    event with the request metadata, one "delta" event per content chunk,
+    and a "done" event with timings and the saved chat id, or an "error"
+    event if LM Studio fails. The slot is released as soon as generation ends.
+    
+    The upstream request is aborted if the client disconnects or the
+    ``generation`` is superseded by a newer question in the session. A
+    request ``deadline`` bounds the wait in the queue and max_tokens.
+    """
+    time_to_first_token = None
+    chunks = []
+    upstream = None
+    
+    try:
+        if ticket is not None:
+            reserve = question_router.min_generation_time(prepared['route']['tier'])
+            yield from queue_position_events(ticket, deadline, reserve)
+            fit_to_deadline(prepared, deadline, 'queue')
+        yield sse_event('meta', prepared['result'])
+        
+        start_time = time.monotonic()
+        if ticket is not None:
+            upstream = stream_lm_studio(prepared['messages'], deadline=deadline, **generation_params(prepared['route']))
+            contents = flight.relay(upstream)
+        else:
+            follow_timeout = FLIGHT_WAIT_TIMEOUT if deadline is None else min(FLIGHT_WAIT_TIMEOUT, deadline.remaining())
+            contents = flight.follow(follow_timeout)
+        for content in contents:
+            if time_to_first_token is None:
+                time_to_first_token = time.monotonic() - start_time
+                metrics.observe('llm.time_to_first_token', time_to_first_token)
+            chunks.append(content)
+            yield sse_event('delta', {'content': content})
+            if generation is not None and generation.should_stop:
+                yield sse_event('error', {'error': SUPERSEDED_MESSAGE, 'retry_after': None, 'cancelled': True})
+                return
+    except LLMError as e:
+        if ticket is not None:
+            flight.finish(e)
+        # Partial answers are not persisted; the client may retry
+        yield sse_event('error', {'error': str(e), 'retry_after': e.retry_after})
+        return
+    finally:
+        # Closing the upstream stream early makes LM Studio stop generating
+        if upstream is not None:
+            upstream.close()
+        if ticket is not None:
+            llm_admission.release(ticket)
+            flight.abandon()
+        if generation is not None:
+            session_generations.finish(generation)
+    
+    generation_time = time.monotonic() - start_time
+    metrics.observe('llm.generation_time', generation_time)
+    
+    chat_history = save_prepared_answer(prepared, ''.join(chunks), generation_time if ticket is not None else None)
+    
+    yield sse_event('done', {
+        'chat_id': chat_history.id,
+        'time_to_first_token': time_to_first_token,
+        'generation_time': generation_time
+    })
+
+def refusal_events(prepared, chat_history):
+    """SSE events for the fixed answer to an irrelevant question"""
+    return [
+        sse_event('meta', {'session_id': prepared['session_id']}),
+        sse_event('delta', {'content': IRRELEVANT_QUESTION_RESPONSE}),
+        sse_event('done', {'chat_id': chat_history.id})
+    ]
+
+def degraded_reason():
+    """Why LM Studio cannot take a question right now, or None if it can (or the fallback is off)"""
+    if not EXTRACTIVE_FALLBACK:
+        return None
+    if llm_client.breaker.retry_after() > 0:
+        return 'circuit_open'
+    if not any(backend.healthy for backend in llm_backends.backends):
+        return 'no_backend'
+    if llm_admission.queued >= llm_admission.max_queue:
+        return 'queue_full'
+    return None
+
+def falls_back(error):
+    """Whether an LLM failure is answered extractively; a per-user cap (429) is reported as is"""
+    if isinstance(error, AdmissionRejected) and error.status_code != 503:
+        return False
+    return EXTRACTIVE_FALLBACK
+
+def extractive_answer(prepared, reason):
+    """
+    Answer a prepared question with passages quoted from its documents and save it
+    
+    Args:
+        prepared (dict): Output of ``prepare_question``
+        reason (str): Why LM Studio was bypassed: 'requested' for ``mode=fast``, otherwise the degraded state
+    
+    Returns:
+        dict: The /ask payload, marked with ``mode: 'extractive'``
+    """
+    start_time = time.monotonic()
+    documents = []
+    if prepared['document_ids']:
+        documents = Document.query.filter(
+            Document.id.in_(prepared['document_ids']),
+            Document.user_id == prepared['user_id']
+        ).all()
+    passages = extractive_answerer.answer(prepared['question'], documents)
+    response = format_extractive_answer(passages, requested=reason == 'requested')
+    metrics.observe('extractive.answer_time', time.monotonic() - start_time)
+    metrics.increment(f'extractive.{reason}')
+    
+    # Not a model outcome, so no routing decision is recorded
+    chat_history = save_chat_history(
+        prepared['user_id'], prepared['session_id'], prepared['question'], response, prepared['document_ids']
+    )
+    return dict(
+        prepared['result'],
+        response=response,
+        mode='extractive',
+        reason=reason,
+        passages=passages,
+        chat_id=chat_history.id
+    )
+
+def catalog_answer(prepared):
+    """
+    Answer a factual question about the author, year, title or DOI from the catalog and save it
+    
+    Returns:
+        dict: The /ask payload marked with ``mode: 'catalog'``, or None if the
+        question asks for more than the catalog holds or an entry lacks a field
+    """
+    route = prepared.get('route')
+    if route is None or route['tier'] != FAST or not prepared['document_ids']:
+        return None
+    fields = catalog_fields(prepared['question'], route['question_id'])
+    if not fields:
+        return None
+    
+    start_time = time.monotonic()
+    backfill_catalog(prepared['user_id'], prepared['document_ids'])
+    rows = db.session.query(Document, DocumentCatalog).outerjoin(
+        DocumentCatalog, DocumentCatalog.document_id == Document.id
+    ).filter(Document.id.in_(prepared['document_ids']), Document.user_id == prepared['user_id']).all()
+    entries = [catalog_entry(document, catalog) for document, catalog in rows]
+    response = format_catalog_answer(entries, fields)
+    if response is None:
+        metrics.increment('catalog.incomplete')
+        return None
+    metrics.observe('catalog.answer_time', time.monotonic() - start_time)
+    metrics.increment('catalog.answered')
+    
+    chat_history = save_chat_history(
+        prepared['user_id'], prepared['session_id'], prepared['question'], response, prepared['document_ids']
+    )
+    return dict(prepared['result'], response=response, mode='catalog', catalog=entries, chat_id=chat_history.id)
+
+def extractive_events(result):
+    """SSE events for an answer made without LM Studio: meta, the whole answer as one delta, done"""
+    meta = {key: value for key, value in result.items() if key not in ('response', 'chat_id')}
+    return [
+        sse_event('meta', meta),
+        sse_event('delta', {'content': result['response']}),
+        sse_event('done', {'chat_id': result['chat_id'], 'time_to_first_token': None, 'generation_time': None})
+    ]
+
+def extractive_response(prepared, reason, stream):
+    """JSON or SSE response with the extractive answer to a prepared question"""
+    result = extractive_answer(prepared, reason)
+    if stream:
+        return sse_response(iter(extractive_events(result)))
+    return jsonify(result)
+
+def get_conversation_memory(user_id, session_id):
+    """Return the cached memory for a chat session, loading it from ChatHistory on a miss"""
+    key = (user_id, session_id)
+    memory = conversation_memories.get(key)
+    if memory is not None:
+        return memory
+    
+    recent_chats = ChatHistory.query.filter_by(
+        user_id=user_id,
+        session_id=session_id
+    ).order_by(ChatHistory.timestamp.desc()).limit(MEMORY_REPLAY_TURNS).all()
+    
+    return conversation_memories.load(key, [(chat.message, chat.response) for chat in reversed(recent_chats)])
+
+def save_chat_history(user_id, session_id, question, response, document_ids=None):
+    """Persist a chat turn and append it to the session's cached memory"""
+    chat_history = ChatHistory(
+        user_id=user_id,
+        session_id=session_id,
+        message=question,
+        response=response,
+        document_ids=','.join(map(str, document_ids)) if document_ids else None
+    )
+    db.session.add(chat_history)
+    db.session.commit()
+    
+    memory = conversation_memories.get((user_id, session_id))
+    if memory is not None:
+        memory.add_turn(question, response)
+    return chat_history
+
+def index_terms(original_filename, counts):
+    """Search index term frequencies of a document: its text's ``counts`` and the terms of its filename"""
+    return counts + Counter(analyze(original_filename))
+
+def load_user_documents_for_index(user_id):
+    """Return (id, index term counts) for every document of a user, analyzing the ones stored before counts were kept"""
+    unindexed = db.session.query(Document).outerjoin(
+        DocumentTerms, DocumentTerms.document_id == Document.id
+    ).filter(Document.user_id == user_id, DocumentTerms.document_id.is_(None)).all()
+    for document in unindexed:
+        counts = index_terms(document.original_filename, Counter(analyze(document.content)))
+        db.session.add(DocumentTerms(document_id=document.id, counts=encode_terms(counts)))
+    if unindexed:
+        db.session.commit()
+        metrics.increment('search_index.backfilled', len(unindexed))
+    
+    rows = db.session.query(DocumentTerms.document_id, DocumentTerms.counts).join(
+        Document, Document.id == DocumentTerms.document_id
+    ).filter(Document.user_id == user_id).all()
+    return [(row.document_id, decode_terms(row.counts)) for row in rows]
+
+user_document_indexes = UserIndexStore(load_user_documents_for_index)
+
+def load_documents_for_related():
+    """Return (id, owner id, content) for every document"""
+    return db.session.query(Document.id, Document.user_id, Document.content).all()
+
+# Index terms of document chunks, reused by new versions and re-uploads
+chunk_terms = ChunkTerms()
+
+# Top related papers per document, precomputed over all users' documents
+related_papers = RelatedPapers(load_documents_for_related, top_n=int(os.environ.get('RELATED_TOP_N', 20)))
+
+def related_documents(document_id, user_id, role, scope=None, limit=10):
+    """
+    The /documents/<id>/related payload, or None if the user may not see the document
+    
+    Owners get related papers among their own documents. Dosen and admins
+    may ask about any document and get related papers across all users,
+    or only the document owner's ones with ``scope='owner'``.
+    """
+    document = db.session.get(Document, document_id)
+    privileged = role in ('admin', 'dosen')
+    if document is None or (document.user_id != user_id and not privileged):
+        return None
+    
+    same_owner = not privileged or scope == 'owner'
+    limit = max(1, min(limit, related_papers.top_n))
+    related = related_papers.related(document_id, limit, same_owner)
+    if related is None:
+        # Uploaded by another worker process after the table was built here
+        related_papers.add_document(document.id, document.user_id, document.content)
+        related = related_papers.related(document_id, limit, same_owner) or []
+    
+    ids = [other for other, _ in related]
+    others = {doc.id: doc for doc in Document.query.filter(Document.id.in_(ids)).all()}
+    catalogs = {catalog.document_id: catalog for catalog in DocumentCatalog.query.filter(DocumentCatalog.document_id.in_(ids)).all()}
+    entries = []
+    for other, similarity in related:
+        if other not in others:
+            continue
+        entry = dict(catalog_entry(others[other], catalogs.get(other)), similarity=similarity)
+        if privileged:
+            entry['username'] = others[other].user.username
+        entries.append(entry)
+    return {
+        'document_id': document.id,
+        'filename': document.original_filename,
+        'scope': 'owner' if same_owner else 'all',
+        'related': entries
+    }
+
+def load_document_signatures():
+    """Return (id, owner id, signature) for every document, signing the ones uploaded before signatures existed"""
+    unsigned = db.session.query(Document).outerjoin(
+        DocumentSignature, DocumentSignature.document_id == Document.id
+    ).filter(DocumentSignature.document_id.is_(None)).all()
+    for document in unsigned:
+        signature = minhash(document.content)
+        db.session.add(DocumentSignature(document_id=document.id, minhash=encode_signature(signature) if signature else None))
+    if unsigned:
+        db.session.commit()
+        metrics.increment('duplicates.backfilled', len(unsigned))
+    
+    rows = db.session.query(Document.id, Document.user_id, DocumentSignature.minhash).join(
+        DocumentSignature, DocumentSignature.document_id == Document.id
+    ).all()
+    return [(row.id, row.user_id, decode_signature(row.minhash) if row.minhash else None) for row in rows]
+
+# LSH index of the documents' MinHash signatures, over all users
+duplicate_index = DuplicateIndex(load_document_signatures, threshold=NEAR_DUPLICATE_THRESHOLD)
+
+def visible_duplicates(matches, user_id, role):
+    """
+    The near-duplicates a user may be told about, for API responses
+    
+    Users only hear about their own documents; dosen and admins about
+    everyone's, with the owner's username.
+    """
+    privileged = role in ('admin', 'dosen')
+    matches = [match for match in matches if privileged or match[1] == user_id]
+    documents = {doc.id: doc for doc in Document.query.filter(Document.id.in_([match[0] for match in matches])).all()}
+    entries = []
+    for document_id, _, similarity in matches:
+        if document_id not in documents:
+            continue
+        entry = {
+            'document_id': document_id,
+            'filename': documents[document_id].original_filename,
+            'similarity': round(similarity, 3)
+        }
+        if privileged:
+            entry['username'] = documents[document_id].user.username
+        entries.append(entry)
+    return entries
+
+def reusable_answer(document_id, question):
+    """
+    A cached answer to the same question about an equivalent document, or None
+    
+    That is the previous version when the changes are all past the part of
+    the document the prompt includes, or else the closest near-duplicate.
+    """
+    version = db.session.get(DocumentVersion, document_id)
+    if version is not None:
+        document = db.session.get(Document, document_id)
+        parent = db.session.get(Document, version.parent_id)
+        if parent is not None and (parent.content or '')[:DOCUMENT_CONTEXT_CHARS] == (document.content or '')[:DOCUMENT_CONTEXT_CHARS]:
+            answer = CachedAnswer.query.filter_by(document_id=parent.id, question=question).first()
+            if answer is not None:
+                return answer
+    
+    matches = duplicate_index.duplicates_of(document_id, DUPLICATE_REUSE_THRESHOLD)
+    if not matches:
+        return None
+    by_similarity = {match[0]: match[2] for match in matches}
+    answers = CachedAnswer.query.filter(
+        CachedAnswer.document_id.in_(by_similarity), CachedAnswer.question == question
+    ).all()
+    return max(answers, key=lambda answer: by_similarity[answer.document_id], default=None)
+
+def text_chunks(content):
+    """Content-defined ``(key, text)`` chunks of extracted text"""
+    return [(chunk_hash(chunk), chunk) for chunk in content_chunks(content)]
+
+def stored_page_texts(keys):
+    """Stored text of the PDF pages among ``keys``, by key"""
+    if not keys:
+        return {}
+    return {chunk.key: chunk.text for chunk in DocumentChunk.query.filter(DocumentChunk.key.in_(set(keys))).all()}
+
+def missing_pages(keys, stored):
+    """The first page number of every page key without stored text"""
+    missing = {}
+    for number, key in enumerate(keys):
+        if key not in stored:
+            missing.setdefault(key, number)
+    return missing
+
+def assemble_pages(keys, stored, missing, extracted):
+    """
+    ``(key, text)`` chunks of a PDF from stored and newly extracted page texts
+    
+    Returns:
+        tuple: (chunks, new_pages), ``new_pages`` the texts extracted now by key
+    """
+    new_pages = {key: extracted.get(number, '') for key, number in missing.items()}
+    return [(key, stored[key] if key in stored else new_pages[key]) for key in keys], new_pages
+
+def extract_document(file_path, filename):
+    """
+    Extract an uploaded file as ``(key, text)`` chunks
+    
+    Pages of a PDF whose text is already stored, from this or any earlier
+    upload, are not extracted again.
+    
+    Returns:
+        tuple: (chunks, new_pages), ``new_pages`` the PDF page texts extracted
+        now by key, None for other formats
+    """
+    if filename.rsplit('.', 1)[1].lower() == 'pdf':
+        keys = pdf_page_keys(file_path, EXTRACTOR_VERSION)
+        if keys:
+            stored = stored_page_texts(keys)
+            missing = missing_pages(keys, stored)
+            return assemble_pages(keys, stored, missing, extract_pdf_pages(file_path, sorted(missing.values())))
+    return text_chunks(extract_text_from_file(file_path, filename)), None
+
+def add_document_rows(user_id, original_filename, filename, file_path, chunks, bibliography, signature, terms, parent_id=None):
+    """
+    Add a new document with its catalog entry, signature, index terms, chunk refs and version link; the caller commits
+    
+    Returns:
+        tuple: (document, its diff against the parent version or None)
+    """
+    content = ''.join(text for _, text in chunks)
+    document = Document(
+        filename=filename,
+        original_filename=original_filename,
+        file_path=file_path,
+        content=content,
+        user_id=user_id
+    )
+    db.session.add(document)
+    db.session.flush()
+    save_catalog(document.id, user_id, bibliography)
+    db.session.add(DocumentSignature(document_id=document.id, minhash=encode_signature(signature) if signature else None))
+    db.session.add(DocumentTerms(document_id=document.id, counts=encode_terms(terms)))
+    db.session.add(DocumentExtraction(document_id=document.id, version=EXTRACTOR_VERSION))
+    db.session.add_all([
+        DocumentChunkRef(document_id=document.id, position=position, key=key)
+        for position, (key, _) in enumerate(chunks)
+    ])
+    version = None
+    if parent_id is not None:
+        previous = [ref.key for ref in DocumentChunkRef.query.filter_by(document_id=parent_id).order_by(DocumentChunkRef.position)]
+        parent_version = db.session.get(DocumentVersion, parent_id)
+        number = (parent_version.version if parent_version else 1) + 1
+        db.session.add(DocumentVersion(document_id=document.id, parent_id=parent_id, version=number))
+        version = dict(parent_id=parent_id, version=number, **diff_chunks(previous, [key for key, _ in chunks]))
+    return document, version
+
+def save_page_texts(pages):
+    """Store newly extracted PDF page texts by key; the caller commits"""
+    for key, text in pages.items():
+        db.session.merge(DocumentChunk(key=key, text=text))
+
+def store_document(user_id, role, original_filename, filename, file_path, chunks, new_pages,
+                   bibliography, signature, parent_id=None):
+    """
+    Save an uploaded document with its catalog entry, signature, chunks and version link, then index it
+    
+    Index terms are analyzed only for chunks not seen before, and a new
+    version is diffed against its parent chunk by chunk.
+    
+    Args:
+        chunks (list): ``(key, text)`` chunks from ``extract_document``
+        new_pages (dict): PDF page texts extracted for this upload, by key
+        parent_id (int): The document this upload is a new version of
+    
+    Returns:
+        tuple: (document, the /upload entry for the file)
+    """
+    counts, reused_terms = chunk_terms.counts(chunks)
+    terms = index_terms(original_filename, counts)
+    document, version = add_document_rows(
+        user_id, original_filename, filename, file_path, chunks, bibliography, signature, terms, parent_id
+    )
+    save_page_texts(new_pages or {})
+    db.session.commit()
+    content = document.content
+    
+    user_document_indexes.add_document(user_id, document.id, f"{original_filename}\n{content}", terms)
+    related_papers.add_document(document.id, user_id, content, counts)
+    duplicate_index.add_document(document.id, user_id, signature)
+    duplicates = duplicate_index.duplicates_of(document.id)
+    if duplicates:
+        metrics.increment('duplicates.detected')
+    reused_pages = len(chunks) - len(new_pages) if new_pages is not None else 0
+    metrics.increment('chunks.reused_pages', reused_pages)
+    metrics.increment('chunks.reused_terms', reused_terms)
+    
+    entry = {
+        'id': document.id,
+        'filename': original_filename,
+        'size': len(content),
+        'catalog': bibliography,
+        'near_duplicates': visible_duplicates(duplicates, user_id, role),
+        'chunks': {'total': len(chunks), 'reused_pages': reused_pages, 'analyzed': len(chunks) - reused_terms}
+    }
+    if version is not None:
+        entry['version'] = version
+    return document, entry
+
+def outdated_documents(cursor=0, limit=None):
+    """``(id, user_id, original_filename, file_path)`` of documents after ``cursor`` extracted by an older EXTRACTOR_VERSION, by id"""
+    query = db.session.query(
+        Document.id, Document.user_id, Document.original_filename, Document.file_path
+    ).outerjoin(DocumentExtraction, DocumentExtraction.document_id == Document.id).filter(
+        Document.id > cursor,
+        db.or_(DocumentExtraction.version.is_(None), DocumentExtraction.version < EXTRACTOR_VERSION)
+    ).order_by(Document.id)
+    return query.limit(limit).all() if limit else query
+
+def reextract_file(document, limiter):
+    """Extract a document's file again, without writing anything; failures are returned as ``error``"""
+    document_id, _, original_filename, file_path = document
     try:
-        headers = {
-            "Content-Type": "application/json"
+        limiter.acquire(os.path.getsize(file_path))
+        with app.app_context():
+            chunks, new_pages = extract_document(file_path, original_filename)
+        content = ''.join(text for _, text in chunks)
+        first_page = chunks[0][1] if new_pages is not None and chunks else None
+        return {
+            'document_id': document_id,
+            'chunks': chunks,
+            'new_pages': new_pages or {},
+            'bibliography': read_bibliography(file_path, original_filename, content, first_page),
+            'signature': minhash(content),
+            'counts': chunk_terms.counts(chunks)[0]
         }
+    except Exception as e:
+        print(f"Error re-extracting document {document_id}: {e}")
+        return {'document_id': document_id, 'error': str(e)}
+
+def save_reextracted(run, batch, results):
+    """
+    Write a batch of re-extracted documents and the run's checkpoint in one transaction
+    
+    Returns:
+        list: ``(document_id, user_id, original_filename, content, counts, signature)``
+        of the documents whose content changed, ``counts`` their text's term frequencies
+    """
+    changed = []
+    new_pages = {}
+    stale_keys = []
+    for result in results:
+        document = db.session.get(Document, result['document_id'])
+        if document is None:
+            continue  # Deleted since the batch was read
+        content = ''.join(text for _, text in result.get('chunks', ()))
+        # An unreadable file never wipes the text extracted before
+        if 'error' in result or (not content.strip() and (document.content or '').strip()):
+            run.failed += 1
+            continue
         
-        data = {
-            "model": "local-model",
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": 0.7
+        refs = DocumentChunkRef.query.filter_by(document_id=document.id)
+        stale_keys.extend(ref.key for ref in refs)
+        refs.delete()
+        db.session.add_all([
+            DocumentChunkRef(document_id=document.id, position=position, key=key)
+            for position, (key, _) in enumerate(result['chunks'])
+        ])
+        new_pages.update(result['new_pages'])
+        db.session.merge(DocumentExtraction(document_id=document.id, version=EXTRACTOR_VERSION))
+        run.processed += 1
+        if content != document.content:
+            document.content = content
+            save_catalog(document.id, document.user_id, result['bibliography'])
+            signature = result['signature']
+            db.session.merge(DocumentSignature(document_id=document.id, minhash=encode_signature(signature) if signature else None))
+            counts = result['counts']
+            db.session.merge(DocumentTerms(document_id=document.id, counts=encode_terms(index_terms(document.original_filename, counts))))
+            CachedAnswer.query.filter_by(document_id=document.id).delete()
+            changed.append((document.id, document.user_id, document.original_filename, content, counts, signature))
+    
+    save_page_texts(new_pages)
+    db.session.flush()
+    delete_orphan_chunks(stale_keys)
+    run.cursor = batch[-1].id
+    run.changed += len(changed)
+    run.updated_at = datetime.utcnow()
+    db.session.commit()
+    return changed
+
+def reindex_documents(documents):
+    """Update the search, related-papers and duplicate indexes for a batch of documents whose content changed"""
+    for document_id, user_id, original_filename, content, counts, signature in documents:
+        user_document_indexes.add_document(
+            user_id, document_id, f"{original_filename}\n{content}", index_terms(original_filename, counts)
+        )
+        related_papers.add_document(document_id, user_id, content, counts)
+        duplicate_index.add_document(document_id, user_id, signature)
+
+def run_reextraction(job, run_id):
+    """
+    Job body for /admin/reextract: re-extract outdated documents batch by batch from the run's checkpoint
+    
+    Files are read and parsed by the workers outside any transaction; each
+    batch is then written with its checkpoint in one short transaction, so
+    uploads and questions never wait long on the database.
+    """
+    limiter = ByteRateLimiter(REEXTRACT_BYTES_PER_SECOND)
+    with app.app_context(), ThreadPoolExecutor(max_workers=REEXTRACT_WORKERS, thread_name_prefix='reextract') as executor:
+        run = db.session.get(ExtractionRun, run_id)
+        try:
+            while not job.cancel_requested:
+                batch = outdated_documents(run.cursor, REEXTRACT_BATCH_SIZE)
+                if not batch:
+                    break
+                failed = run.failed
+                results = list(executor.map(lambda document: reextract_file(document, limiter), batch))
+                changed = save_reextracted(run, batch, results)
+                reindex_documents(changed)
+                metrics.increment('reextract.documents', len(batch))
+                metrics.increment('reextract.changed', len(changed))
+                job.add_result({
+                    'cursor': run.cursor,
+                    'documents': len(batch),
+                    'changed': len(changed),
+                    'failed': run.failed - failed
+                })
+        except Exception as e:
+            db.session.rollback()
+            run.status, run.error = 'failed', str(e)
+            db.session.commit()
+            raise
+        run.status = 'paused' if job.cancel_requested else 'done'
+        run.updated_at = datetime.utcnow()
+        db.session.commit()
+
+def reextraction_job(run):
+    """The in-memory job of a run, None once the server has restarted"""
+    return reextraction_jobs.get(run.job_id) if run.job_id else None
+
+def start_reextraction(user_id):
+    """
+    Resume the unfinished run for the current EXTRACTOR_VERSION from its checkpoint, or start a new one
+    
+    Returns:
+        tuple: (run, job), job None if the run is already in progress
+    """
+    run = ExtractionRun.query.filter(
+        ExtractionRun.version == EXTRACTOR_VERSION, ExtractionRun.status != 'done'
+    ).order_by(ExtractionRun.id.desc()).first()
+    job = run and reextraction_job(run)
+    if job is not None and not job.done:
+        return run, None
+    if run is None:
+        run = ExtractionRun(version=EXTRACTOR_VERSION)
+        db.session.add(run)
+    job = Job('reextract', user_id)
+    run.status, run.error, run.job_id = 'running', None, job.id
+    db.session.commit()
+    reextraction_jobs.submit(job, run_reextraction, run.id)
+    return run, job
+
+def reextraction_overview():
+    """Documents still to re-extract and the state of the latest run"""
+    run = ExtractionRun.query.order_by(ExtractionRun.id.desc()).first()
+    state = None
+    if run is not None:
+        job = reextraction_job(run)
+        status = run.status
+        if status == 'running' and (job is None or job.done):
+            status = 'interrupted'  # The server stopped during the run
+        state = {
+            'run_id': run.id,
+            'version': run.version,
+            'status': status,
+            'cursor': run.cursor,
+            'processed': run.processed,
+            'changed': run.changed,
+            'failed': run.failed,
+            'error': run.error,
+            'job_id': job.id if job else None,
+            'created_at': run.created_at.isoformat(),
+            'updated_at': run.updated_at.isoformat()
         }
+    return {'version': EXTRACTOR_VERSION, 'outdated': outdated_documents().count(), 'run': state}
+
+def delete_orphan_chunks(keys=None):
+    """Delete stored page texts no document refers to any more, among ``keys`` or all of them"""
+    orphans = DocumentChunk.query.filter(
+        ~db.session.query(DocumentChunkRef.id).filter(DocumentChunkRef.key == DocumentChunk.key).exists()
+    )
+    if keys is not None:
+        orphans = orphans.filter(DocumentChunk.key.in_(keys))
+    orphans.delete(synchronize_session=False)
+
+def delete_document_data(document):
+    """Delete a document with its catalog entry, chunks, cached answers and file, and drop it from the indexes"""
+    keys = [ref.key for ref in DocumentChunkRef.query.filter_by(document_id=document.id)]
+    CachedAnswer.query.filter_by(document_id=document.id).delete()
+    DocumentSignature.query.filter_by(document_id=document.id).delete()
+    DocumentTerms.query.filter_by(document_id=document.id).delete()
+    DocumentAuthor.query.filter_by(document_id=document.id).delete()
+    DocumentCatalog.query.filter_by(document_id=document.id).delete()
+    DocumentChunkRef.query.filter_by(document_id=document.id).delete()
+    DocumentExtraction.query.filter_by(document_id=document.id).delete()
+    IngestedFile.query.filter_by(document_id=document.id).delete()
+    # Later versions stay, without a link to the deleted one
+    DocumentVersion.query.filter(
+        db.or_(DocumentVersion.document_id == document.id, DocumentVersion.parent_id == document.id)
+    ).delete(synchronize_session=False)
+    delete_orphan_chunks(keys)
+    db.session.delete(document)
+    db.session.commit()
+    try:
+        os.remove(document.file_path)
+    except OSError as e:
+        print(f"Error removing file: {e}")
+    user_document_indexes.remove_document(document.user_id, document.id)
+    related_papers.remove_document(document.id)
+    duplicate_index.remove_document(document.id)
+
+def delete_chat_session_data(chat_session):
+    """Delete a chat session with its history, and its cached conversation memory once committed"""
+    key = (chat_session.user_id, chat_session.id)
+    ChatHistory.query.filter_by(user_id=key[0], session_id=key[1]).delete()
+    db.session.delete(chat_session)
+    db.session.commit()
+    conversation_memories.evict(key)
+
+def delete_user_data(user):
+    """Delete a user with their chat history, documents and everything derived from them, and drop them from the in-memory state"""
+    user_id = user.id
+    ChatHistory.query.filter_by(user_id=user_id).delete()
+    ChatSession.query.filter_by(user_id=user_id).delete()
+    DocumentAuthor.query.filter_by(user_id=user_id).delete()
+    DocumentCatalog.query.filter_by(user_id=user_id).delete()
+    user_documents = db.session.query(Document.id).filter_by(user_id=user_id)
+    for model in (DocumentSignature, DocumentTerms, DocumentChunkRef, DocumentExtraction, IngestedFile, DocumentVersion, CachedAnswer):
+        model.query.filter(model.document_id.in_(user_documents)).delete(synchronize_session=False)
+    DocumentVersion.query.filter(DocumentVersion.parent_id.in_(user_documents)).delete(synchronize_session=False)
+    delete_orphan_chunks()
+    Document.query.filter_by(user_id=user_id).delete()
+    db.session.delete(user)
+    db.session.commit()
+    # Only once committed: a failed commit leaves the indexes matching the database
+    conversation_memories.evict_user(user_id)
+    user_document_indexes.drop_user(user_id)
+    related_papers.remove_owner(user_id)
+    duplicate_index.remove_owner(user_id)
+
+def select_relevant_documents(user_id, question):
+    """Pick the user's documents most relevant to the question within the context budget"""
+    limit = max(1, min(AUTO_SELECT_MAX_DOCUMENTS, AUTO_SELECT_CONTEXT_CHARS // DOCUMENT_CONTEXT_CHARS))
+    return [document_id for document_id, _ in user_document_indexes.search(user_id, question, limit)]
+
+def prepare_question(user_id, data, default_session_id=DEFAULT_SESSION_ID, deadline=None):
+    """
+    Validate an /ask payload and build the prompt for it
+    
+    Args:
+        user_id (int): The asking user
+        data (dict): The /ask JSON payload
+        default_session_id (str): Chat session used when the payload names none
+        deadline (Deadline): Request deadline; retrieval and context packing
+            spend from it and the route's max_tokens is cut to what is left
         
-        response = requests.post(LM_STUDIO_URL, headers=headers, json=data, timeout=30)
+    Returns:
+        tuple: (prepared, None) or (None, (error message, HTTP status)).
+        ``prepared`` holds the question, session_id, document_ids, the
+        response metadata in ``result``, the model tier in ``route`` and the
+        chat ``messages``, which are None when the question is not relevant.
+    
+    Raises:
+        DeadlineExceeded: If too little time is left to answer after retrieval or context packing
+    """
+    if not data or 'question' not in data:
+        return None, ('Question is required', 400)
+    
+    question = data['question']
+    document_ids = data.get('document_ids', [])
+    session_id = data.get('session_id') or default_session_id
+    
+    try:
+        compression_ratio = float(data.get('compression_ratio', PROMPT_COMPRESSION_RATIO))
+    except (TypeError, ValueError):
+        compression_ratio = 0
+    if not 0 < compression_ratio <= 1:
+        return None, ('compression_ratio must be between 0 and 1', 400)
+    
+    # A cached memory implies the session was already validated for this user
+    if (session_id != DEFAULT_SESSION_ID
+            and conversation_memories.get((user_id, session_id)) is None
+            and not ChatSession.query.filter_by(id=session_id, user_id=user_id).first()):
+        return None, ('Chat session not found', 404)
+    
+    prepared = {
+        'user_id': user_id,
+        'question': question,
+        'session_id': session_id,
+        'document_ids': document_ids,
+        'messages': None,
+        'result': {'session_id': session_id}
+    }
+    
+    # Check if question is relevant
+    if not is_relevant_query(question):
+        return prepared, None
+    
+    route = question_router.route(question, data.get('question_id'))
+    
+    # Without explicit documents, rank the user's documents against the question
+    auto_selected = not document_ids
+    if auto_selected:
+        document_ids = select_relevant_documents(user_id, question)
+    if deadline is not None:
+        deadline.check('retrieval', question_router.min_generation_time(route['tier']))
+    
+    # Get document contents, dropping low-information sentences if requested
+    documents_content = ""
+    compression = CompressionStats(compression_ratio)
+    if document_ids:
+        documents = Document.query.filter(
+            Document.id.in_(document_ids),
+            Document.user_id == user_id
+        ).all()
         
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
+        compress = None
+        if compression_ratio < 1:
+            compress = lambda passage: compress_passage(passage, question, compression_ratio, compression)
+        documents_content = format_document_context(documents, compress)
+    
+    # Conversation context comes from the session's in-process memory
+    memory = get_conversation_memory(user_id, session_id)
+    
+    # Stable prefix (system prompt + documents) first, history and question last
+    prepared['messages'] = build_messages(documents_content, question, memory.history(), memory.summary)
+    prepared['document_ids'] = document_ids
+    prepared['route'] = route
+    prepared['result'] = {
+        'session_id': session_id,
+        'document_ids': document_ids,
+        'auto_selected': auto_selected,
+        'tier': prepared['route']['tier']
+    }
+    if compression_ratio < 1:
+        prepared['result']['compression'] = compression.to_dict()
+    
+    fit_to_deadline(prepared, deadline, 'context')
+    return prepared, None
+
+def save_prepared_answer(prepared, response, generation_time=None):
+    """
+    Persist the answer to a prepared question, with its routing decision
+    
+    ``generation_time`` is the model's time for this answer; None if it was
+    shared with an identical request (not a model outcome).
+    """
+    chat_history = save_chat_history(
+        prepared['user_id'], prepared['session_id'], prepared['question'], response, prepared['document_ids']
+    )
+    
+    route = prepared.get('route')
+    if route is not None:
+        if generation_time is not None:
+            answer_tokens = question_router.record(route, generation_time, response)
         else:
-            return f"Error: LM Studio returned status code {response.status_code}"
-            
-    except requests.exceptions.RequestException as e:
-        return f"Error connecting to LM Studio: {str(e)}"
+            answer_tokens = estimate_tokens(response)
+        db.session.add(RoutingDecision(
+            chat_id=chat_history.id,
+            question_id=route['question_id'],
+            tier=route['tier'],
+            reason=route['reason'],
+            model=route['model'],
+            max_tokens=route['max_tokens'],
+            temperature=route['temperature'],
+            generation_time=generation_time,
+            answer_tokens=answer_tokens
+        ))
+        db.session.commit()
+    return chat_history
+
+def prepare_analysis(user_id, data, default_session_id=DEFAULT_SESSION_ID, deadline=None):
+    """
+    Validate a /full-analysis payload and build the single prompt for it
+    
+    Returns:
+        tuple: (prepared, None) or (None, (error message, HTTP status)).
+        ``prepared`` has the same keys as for ``prepare_question`` plus the
+        ``(question id, question)`` pairs in ``questions``.
+    
+    Raises:
+        DeadlineExceeded: If too little time is left to answer once the context is packed
+    """
+    data = data or {}
+    document_ids = data.get('document_ids') or []
+    if not document_ids:
+        return None, ('document_ids is required', 400)
+    
+    question_ids = data.get('question_ids') or list(PREDEFINED_QUESTIONS)
+    unknown = [question_id for question_id in question_ids if question_id not in PREDEFINED_QUESTIONS]
+    if unknown:
+        return None, (f"Unknown question_ids: {', '.join(map(str, unknown))}", 400)
+    questions = [(question_id, PREDEFINED_QUESTIONS[question_id][0]) for question_id in question_ids]
+    
+    session_id = data.get('session_id') or default_session_id
+    if (session_id != DEFAULT_SESSION_ID
+            and not ChatSession.query.filter_by(id=session_id, user_id=user_id).first()):
+        return None, ('Chat session not found', 404)
+    
+    documents = Document.query.filter(
+        Document.id.in_(document_ids),
+        Document.user_id == user_id
+    ).all()
+    if len(documents) != len(set(document_ids)):
+        return None, ('Document not found', 404)
+    
+    document_ids = sorted(document.id for document in documents)
+    route = {
+        'question_id': None,
+        'tier': ANALYTICAL,
+        'reason': 'full_analysis',
+        'model': question_router.tiers[ANALYTICAL].model,
+        'max_tokens': FULL_ANALYSIS_TOKENS_PER_QUESTION * len(questions),
+        'temperature': FULL_ANALYSIS_TEMPERATURE
+    }
+    if FULL_ANALYSIS_STRUCTURED_OUTPUT:
+        route['response_format'] = response_format(question_ids)
+    
+    prepared = {
+        'user_id': user_id,
+        'session_id': session_id,
+        'document_ids': document_ids,
+        'questions': questions,
+        'messages': build_analysis_messages(format_document_context(documents), questions),
+        'route': route,
+        'result': {'session_id': session_id, 'document_ids': document_ids}
+    }
+    fit_to_deadline(prepared, deadline, 'context')
+    return prepared, None
+
+def save_analysis_answers(prepared, answers):
+    """Persist each answer of a full analysis as its own chat turn; returns question id -> chat id"""
+    rows = {}
+    for question_id, question in prepared['questions']:
+        if question_id in answers:
+            rows[question_id] = ChatHistory(
+                user_id=prepared['user_id'],
+                session_id=prepared['session_id'],
+                message=question,
+                response=answers[question_id],
+                document_ids=','.join(map(str, prepared['document_ids']))
+            )
+    db.session.add_all(rows.values())
+    db.session.commit()
+    
+    memory = conversation_memories.get((prepared['user_id'], prepared['session_id']))
+    if memory is not None:
+        for chat_history in rows.values():
+            memory.add_turn(chat_history.message, chat_history.response)
+    return {question_id: chat_history.id for question_id, chat_history in rows.items()}
+
+def analysis_result(prepared, answers, chat_ids):
+    """Response body of a full analysis; unanswered questions are listed in ``missing``"""
+    return dict(
+        prepared['result'],
+        answers=[
+            {'id': question_id, 'question': question, 'answer': answers[question_id], 'chat_id': chat_ids[question_id]}
+            for question_id, question in prepared['questions'] if question_id in answers
+        ],
+        missing=[question_id for question_id, _ in prepared['questions'] if question_id not in answers]
+    )
+
+def prepare_fanout(data):
+    """
+    Validate a /fanout payload and resolve its document set
+    
+    The set is the union of ``document_ids`` and every document of ``user_ids``.
+    
+    Returns:
+        tuple: (params, None) or (None, (error message, HTTP status)); ``params``
+        holds the question, its routing decision and the document ids
+    """
+    data = data or {}
+    question = (data.get('question') or '').strip()
+    if not question:
+        return None, ('Question is required', 400)
+    
+    document_ids = data.get('document_ids') or []
+    user_ids = data.get('user_ids') or []
+    if not document_ids and not user_ids:
+        return None, ('document_ids or user_ids is required', 400)
+    
+    rows = db.session.query(Document.id).filter(
+        db.or_(Document.id.in_(document_ids), Document.user_id.in_(user_ids))
+    ).order_by(Document.user_id, Document.id).all()
+    if not rows:
+        return None, ('No documents found', 404)
+    if len(rows) > FANOUT_MAX_DOCUMENTS:
+        return None, (f'At most {FANOUT_MAX_DOCUMENTS} documents per job', 400)
+    
+    return {
+        'question': question,
+        'route': question_router.route(question),
+        'document_ids': [row.id for row in rows]
+    }, None
+
+def fanout_answer(job, document_id, worker):
+    """Answer the job's question about one document, from the answer cache when possible"""
+    document = db.session.get(Document, document_id)
+    if document is None:
+        return {'document_id': document_id, 'error': 'Document not found'}
+    result = {
+        'document_id': document.id,
+        'filename': document.original_filename,
+        'username': document.user.username,
+        'cached': False
+    }
+    
+    messages = build_messages(format_document_context([document]), job.params['question'])
+    params = generation_params(job.params['route'])
+    key = request_key(params['model'], messages, **{k: v for k, v in params.items() if k != 'model'})
+    cached = db.session.get(CachedAnswer, key)
+    if cached is not None:
+        metrics.increment('fanout.cache_hits')
+        return dict(result, answer=cached.response, cached=True)
+    
+    # A re-export or revision of a document already answered needs no new generation
+    reused = reusable_answer(document.id, job.params['question'])
+    if reused is not None:
+        db.session.merge(CachedAnswer(key=key, document_id=document.id, question=job.params['question'], response=reused.response))
+        db.session.commit()
+        metrics.increment('fanout.duplicate_reuses')
+        return dict(result, answer=reused.response, cached=True, reused_from=reused.document_id)
+    
+    # Background priority keeps interactive questions first; one admission
+    # key per worker so the job's workers can run side by side
+    for attempt in range(1, FANOUT_MAX_ATTEMPTS + 1):
+        try:
+            with llm_admission.admit(f'job:{job.id}:{worker}', 'background'):
+                response = query_lm_studio(messages, **params)
+            break
+        except AdmissionRejected as e:
+            if attempt == FANOUT_MAX_ATTEMPTS or job.cancel_requested:
+                return dict(result, error=str(e))
+            time.sleep(e.retry_after or 1)
+        except LLMError as e:
+            return dict(result, error=str(e))
+    
+    db.session.merge(CachedAnswer(key=key, document_id=document.id, question=job.params['question'], response=response))
+    db.session.commit()
+    return dict(result, answer=response)
+
+def run_fanout(job):
+    """Job body: answer every document of the job with bounded concurrency"""
+    def handle(document_id, worker):
+        with app.app_context():
+            try:
+                return fanout_answer(job, document_id, worker)
+            except Exception as e:
+                # Reported against its document, like LLM errors, so results and exports stay keyed by document
+                db.session.rollback()
+                print(f"Error answering document {document_id} in job {job.id}: {e}")
+                return {'document_id': document_id, 'error': str(e)}
+    run_bounded(job, job.params['document_ids'], handle, FANOUT_CONCURRENCY)
+
+def start_fanout(user_id, params):
+    job = Job('fanout', user_id, total=len(params['document_ids']), params=params)
+    return fanout_jobs.submit(job, run_fanout)
+
+def fanout_summary(job):
+    """Job state without results, plus counts of failed and cached answers"""
+    summary = job.to_dict(results=False)
+    summary['question'] = job.params['question']
+    summary['failed'] = sum(1 for result in job.results if result.get('error'))
+    summary['cached'] = sum(1 for result in job.results if result.get('cached'))
+    return summary
+
+def visible_job(store, job_id, user_id, role):
+    """The job if it exists and the user may see it (its owner, or an admin)"""
+    job = store.get(job_id)
+    if job is None or (job.owner_id != user_id and role != 'admin'):
+        return None
+    return job
+
+def job_events(job, summarize):
+    """SSE events of a job: "meta", then a "result" per item as it finishes and a final "done" event"""
+    yield sse_event('meta', summarize(job))
+    index = 0
+    while True:
+        results, finished = job.wait_results(index, JOB_KEEPALIVE_INTERVAL)
+        for result in results:
+            yield sse_event('result', result)
+        index += len(results)
+        if finished:
+            break
+        if not results:
+            # Comment line: keeps proxies from timing out and detects gone clients
+            yield ": keep-alive\n\n"
+    yield sse_event('done', summarize(job))
+
+def fanout_csv(job):
+    """The job's results as a CSV table, in document order"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FANOUT_CSV_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    order = {document_id: position for position, document_id in enumerate(job.params['document_ids'])}
+    for result in sorted(job.results, key=lambda result: order.get(result.get('document_id'), len(order))):
+        writer.writerow(result)
+    return buffer.getvalue()
+
+def run_ask_job(job, prepared, role):
+    """Job body for /ask?async=1: answer and persist, whether or not anyone is still polling"""
+    with app.app_context():
+        if prepared['messages'] is None:
+            response, generation_time = IRRELEVANT_QUESTION_RESPONSE, None
+        else:
+            response, generation_time = answer_question(
+                prepared, prepared['user_id'], role, read_timeout=ASK_JOB_READ_TIMEOUT
+            )
+        chat_history = save_prepared_answer(prepared, response, generation_time)
+        job.add_result(dict(prepared['result'], response=response, chat_id=chat_history.id))
+
+def start_ask_job(prepared, role):
+    job = Job('ask', prepared['user_id'], total=1)
+    return ask_jobs.submit(job, run_ask_job, prepared, role)
+
+def ask_job_state(job):
+    """Poll response of an /ask job: its state, plus the answer once there is one"""
+    state = job.to_dict(results=False)
+    if job.results:
+        state['result'] = job.results[0]
+    return state
+
+def warm_prompt_cache(documents_content):
+    """Send the stable prompt prefix with max_tokens=1 so LM Studio caches it"""
+    try:
+        # Lowest priority: warm-ups never delay questions
+        with llm_admission.admit(None, 'background'):
+            query_lm_studio(build_warmup_messages(documents_content), max_tokens=1)
+    except LLMError as e:
+        print(f"Prompt cache warm-up failed: {e}")
 
 # Routes
 @app.route('/')
@@ -255,6 +1993,7 @@ def logout():
 
 @app.route('/upload', methods=['POST'])
 @login_required
+@idempotent
 def upload_files():
     if 'files' not in request.files:
         return jsonify({'error': 'No files provided'}), 400
@@ -267,7 +2006,16 @@ def upload_files():
     if not files or all(file.filename == '' for file in files):
         return jsonify({'error': 'No files selected'}), 400
     
+    # A new version of one of the user's documents
+    parent_id = request.form.get('parent_id', type=int)
+    if parent_id is not None:
+        if len(files) != 1:
+            return jsonify({'error': 'parent_id requires a single file'}), 400
+        if not Document.query.filter_by(id=parent_id, user_id=session['user_id']).first():
+            return jsonify({'error': 'Parent document not found'}), 404
+    
     uploaded_files = []
+    uploaded_documents = []
     
     for file in files:
         if file and allowed_file(file.filename):
@@ -279,146 +2027,302 @@ def upload_files():
             
             file.save(file_path)
             
-            # Extract text content
-            content = extract_text_from_file(file_path, file.filename)
+            # Extract text content, page by page for PDFs
+            chunks, new_pages = extract_document(file_path, file.filename)
+            content = ''.join(text for _, text in chunks)
+            first_page = chunks[0][1] if new_pages is not None and chunks else None
+            bibliography = read_bibliography(file_path, file.filename, content, first_page)
             
             # Save to database
-            document = Document(
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                content=content,
-                user_id=session['user_id']
+            document, uploaded = store_document(
+                session['user_id'], session.get('role'), file.filename, filename, file_path,
+                chunks, new_pages, bibliography, minhash(content), parent_id
             )
-            db.session.add(document)
-            db.session.commit()
-            
-            uploaded_files.append({
-                'id': document.id,
-                'filename': file.filename,
-                'size': len(content)
-            })
+            uploaded_documents.append(document)
+            uploaded_files.append(uploaded)
+    
+    # Warm the prompt cache in the background so the first question is fast
+    warm_cache = request.form.get('warm_cache', str(PROMPT_CACHE_WARMUP)).lower() in ('1', 'true')
+    if warm_cache and uploaded_documents:
+        documents_content = format_document_context(uploaded_documents)
+        threading.Thread(target=warm_prompt_cache, args=(documents_content,), daemon=True).start()
     
     return jsonify({
         'message': f'{len(uploaded_files)} files uploaded successfully',
-        'files': uploaded_files
+        'files': uploaded_files,
+        'cache_warmup': bool(warm_cache and uploaded_documents)
     })
 
 @app.route('/predefined-questions', methods=['GET'])
 def get_predefined_questions():
-    questions = [
-        "Metode apa yang digunakan pada paper tersebut?",
-        "Siapa penulis dan kapan paper tersebut dibuat?",
-        "Apa hasil dari paper tersebut?",
-        "Apa kesimpulan dari penelitian ini?",
-        "Apa tujuan dari penelitian ini?",
-        "Apa kontribusi utama dari paper ini?",
-        "Apa keterbatasan dari penelitian ini?",
-        "Bagaimana metodologi penelitian yang digunakan?"
-    ]
-    return jsonify({'questions': questions})
+    # Clients can send the id as "question_id" with /ask to pick the model tier
+    return jsonify({
+        'questions': [question for question, _ in PREDEFINED_QUESTIONS.values()],
+        'predefined': [{'id': question_id, 'question': question} for question_id, (question, _) in PREDEFINED_QUESTIONS.items()]
+    })
 
 @app.route('/ask', methods=['POST'])
 @login_required
+@idempotent
 def ask_question():
     data = request.get_json()
     
-    if not data or 'question' not in data:
-        return jsonify({'error': 'Question is required'}), 400
-    
-    question = data['question']
-    document_ids = data.get('document_ids', [])
+    try:
+        deadline = request_deadline(ASK_DEADLINE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Check if question is relevant
-    if not is_relevant_query(question):
-        response = "Maaf, tolong berikan pertanyaan yang relevan dengan paper atau universitas negeri semarang"
-        
-        # Save to chat history
-        chat_history = ChatHistory(
-            user_id=session['user_id'],
-            session_id=session.get('session_id', 'default'),
-            message=question,
-            response=response,
-            document_ids=','.join(map(str, document_ids)) if document_ids else None
+    try:
+        prepared, error = prepare_question(
+            session['user_id'], data, session.get('session_id', DEFAULT_SESSION_ID), deadline
         )
-        db.session.add(chat_history)
-        db.session.commit()
+    except DeadlineExceeded as e:
+        return llm_error_response(e)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    
+    # Job mode: answer in the background and let the client poll /ask/jobs/<id>
+    if request.args.get('async') in ('1', 'true') or data.get('async'):
+        job = start_ask_job(prepared, session.get('role', 'user'))
+        response = jsonify(dict(ask_job_state(job), poll_url=f'/ask/jobs/{job.id}'))
+        response.headers['Location'] = f'/ask/jobs/{job.id}'
+        return response, 202
+    
+    # Stream the answer as Server-Sent Events instead of waiting for all of it
+    stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+    
+    # Irrelevant questions get a fixed answer without calling LM Studio
+    if prepared['messages'] is None:
+        chat_history = save_prepared_answer(prepared, IRRELEVANT_QUESTION_RESPONSE)
         
-        return jsonify({'response': response})
+        if stream:
+            return sse_response(iter(refusal_events(prepared, chat_history)))
+        return jsonify({'response': IRRELEVANT_QUESTION_RESPONSE, 'session_id': prepared['session_id']})
     
-    # Get document contents
-    documents_content = ""
-    if document_ids:
-        documents = Document.query.filter(
-            Document.id.in_(document_ids),
-            Document.user_id == session['user_id']
-        ).all()
+    # Authors, years, titles and DOIs are looked up in the catalog
+    result = catalog_answer(prepared)
+    if result is not None:
+        if stream:
+            return sse_response(iter(extractive_events(result)))
+        return jsonify(result)
+    
+    # Quote the documents instead of generating when asked to, or when LM Studio can't answer
+    fast = (data.get('mode') or request.args.get('mode')) == 'fast'
+    reason = 'requested' if fast else degraded_reason()
+    if reason:
+        return extractive_response(prepared, reason, stream)
+    
+    role = session.get('role', 'user')
+    generation = start_generation(prepared)
+    
+    if stream:
+        flight, leader = join_answer_flight(prepared, generation)
+        if not leader:
+            return sse_response(
+                stream_answer(prepared, flight, generation=generation, deadline=deadline),
+                on_close=lambda: session_generations.finish(generation)
+            )
         
-        documents_content = "\n\n".join([
-            f"Document: {doc.original_filename}\nContent: {doc.content[:2000]}..."
-            for doc in documents
-        ])
+        # Shed the request before streaming starts if the queue is full
+        try:
+            ticket = llm_admission.enqueue(session['user_id'], role)
+        except AdmissionRejected as e:
+            flight.finish(e)
+            session_generations.finish(generation)
+            if falls_back(e):
+                return extractive_response(prepared, 'llm_error', stream)
+            return llm_error_response(e)
+        
+        def close():
+            llm_admission.release(ticket)
+            flight.abandon()
+            session_generations.finish(generation)
+        return sse_response(stream_answer(prepared, flight, ticket, generation, deadline), on_close=close)
+    
+    # Query LM Studio once admitted; failures are reported, never stored as answers.
+    # A blocking request cannot notice a disconnect or be superseded itself
+    try:
+        response, generation_time = answer_question(prepared, session['user_id'], role, deadline=deadline)
+    except DeadlineExceeded as e:
+        # The caller's deadline has passed; an extractive answer would arrive too late as well
+        return llm_error_response(e)
+    except LLMError as e:
+        if falls_back(e):
+            return extractive_response(prepared, 'llm_error', stream)
+        return llm_error_response(e)
+    finally:
+        session_generations.finish(generation)
     
-    # Prepare messages for LM Studio
-    system_prompt = """Anda adalah asisten AI yang membantu menganalisis dokumen akademik, khususnya paper penelitian dan informasi tentang Universitas Negeri Semarang (UNNES). 
+    # Save to chat history
+    save_prepared_answer(prepared, response, generation_time)
     
-Tugas Anda:
-1. Berikan jawaban yang akurat dan informatif berdasarkan dokumen yang diberikan
-2. Fokus pada aspek akademik dan penelitian
-3. Jika ditanya tentang UNNES, berikan informasi yang relevan
-4. Berikan jawaban dalam bahasa Indonesia yang jelas dan mudah dipahami
+    return jsonify(dict(prepared['result'], response=response))
 
-Konteks dokumen:"""
+@app.route('/full-analysis', methods=['POST'])
+@login_required
+def full_analysis():
+    try:
+        deadline = request_deadline(FULL_ANALYSIS_DEADLINE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    if documents_content:
-        system_prompt += f"\n\n{documents_content}"
+    try:
+        prepared, error = prepare_analysis(
+            session['user_id'], request.get_json(silent=True), session.get('session_id', DEFAULT_SESSION_ID), deadline
+        )
+    except DeadlineExceeded as e:
+        return llm_error_response(e)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
     
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": question}
-    ]
+    # One generation for all questions, shared with identical concurrent requests
+    try:
+        response, _ = answer_question(prepared, session['user_id'], session.get('role', 'user'), deadline=deadline)
+    except LLMError as e:
+        return llm_error_response(e)
     
-    # Get previous chat history for context
-    recent_chats = ChatHistory.query.filter_by(
-        user_id=session['user_id']
-    ).order_by(ChatHistory.timestamp.desc()).limit(3).all()
+    answers = parse_answers(response, prepared['questions'])
+    metrics.increment('full_analysis.requests')
+    metrics.increment('full_analysis.missing_answers', len(prepared['questions']) - len(answers))
+    if not answers:
+        return jsonify({'error': 'LM Studio returned no usable answers, please try again'}), 502
     
-    # Add recent context
-    for chat in reversed(recent_chats):
-        messages.insert(-1, {"role": "user", "content": chat.message})
-        messages.insert(-1, {"role": "assistant", "content": chat.response})
+    return jsonify(analysis_result(prepared, answers, save_analysis_answers(prepared, answers)))
+
+@app.route('/fanout', methods=['POST'])
+@admin_or_dosen_required
+def create_fanout():
+    params, error = prepare_fanout(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error[0]}), error[1]
     
-    # Query LM Studio
-    response = query_lm_studio(messages)
+    job = start_fanout(session['user_id'], params)
+    return jsonify(fanout_summary(job)), 202
+
+@app.route('/fanout/<job_id>', methods=['GET'])
+@admin_or_dosen_required
+def get_fanout(job_id):
+    job = visible_job(fanout_jobs, job_id, session['user_id'], session.get('role'))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
     
-    # Save to chat history
-    chat_history = ChatHistory(
+    # Results as they finish, or the current state with every result so far
+    if request.args.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', ''):
+        return sse_response(job_events(job, fanout_summary))
+    return jsonify(dict(fanout_summary(job), results=list(job.results)))
+
+@app.route('/fanout/<job_id>/export', methods=['GET'])
+@admin_or_dosen_required
+def export_fanout(job_id):
+    job = visible_job(fanout_jobs, job_id, session['user_id'], session.get('role'))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return Response(
+        fanout_csv(job),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=fanout-{job.id}.csv'}
+    )
+
+@app.route('/fanout/<job_id>', methods=['DELETE'])
+@admin_or_dosen_required
+def cancel_fanout(job_id):
+    job = visible_job(fanout_jobs, job_id, session['user_id'], session.get('role'))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job.cancel()
+    return jsonify(fanout_summary(job))
+
+@app.route('/ask/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_ask_job(job_id):
+    job = visible_job(ask_jobs, job_id, session['user_id'], session.get('role'))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Long poll: ?wait=N holds the request until the answer is ready or N seconds pass
+    wait = min(request.args.get('wait', 0, type=float), ASK_JOB_MAX_WAIT)
+    if wait > 0:
+        job.wait(wait)
+    return jsonify(ask_job_state(job))
+
+@app.route('/ask/queue', methods=['GET'])
+@login_required
+def get_queue_status():
+    status = llm_admission.user_status(session['user_id'])
+    status['queue_depth'] = llm_admission.snapshot()['queued']
+    return jsonify(status)
+
+@app.route('/sessions', methods=['POST'])
+@login_required
+def create_chat_session():
+    data = request.get_json(silent=True) or {}
+    
+    chat_session = ChatSession(
         user_id=session['user_id'],
-        session_id=session.get('session_id', 'default'),
-        message=question,
-        response=response,
-        document_ids=','.join(map(str, document_ids)) if document_ids else None
+        title=data.get('title')
     )
-    db.session.add(chat_history)
+    db.session.add(chat_session)
     db.session.commit()
     
-    return jsonify({'response': response})
+    # New questions go to this session unless the client names another one
+    session['session_id'] = chat_session.id
+    
+    return jsonify({
+        'id': chat_session.id,
+        'title': chat_session.title,
+        'created_at': chat_session.created_at.isoformat()
+    }), 201
+
+@app.route('/sessions', methods=['GET'])
+@login_required
+def get_chat_sessions():
+    chat_sessions = ChatSession.query.filter_by(
+        user_id=session['user_id']
+    ).order_by(ChatSession.created_at.desc()).all()
+    
+    return jsonify({
+        'sessions': [{
+            'id': chat_session.id,
+            'title': chat_session.title,
+            'created_at': chat_session.created_at.isoformat()
+        } for chat_session in chat_sessions],
+        'current': session.get('session_id', DEFAULT_SESSION_ID)
+    })
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+@login_required
+def delete_chat_session(session_id):
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=session['user_id']).first()
+    if not chat_session:
+        return jsonify({'error': 'Chat session not found'}), 404
+    
+    delete_chat_session_data(chat_session)
+    if session.get('session_id') == session_id:
+        session.pop('session_id')
+    
+    return jsonify({'message': 'Chat session deleted successfully'})
 
 @app.route('/chat-history', methods=['GET'])
 @login_required
 def get_chat_history():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
+    session_id = request.args.get('session_id')
     
-    chats = ChatHistory.query.filter_by(
-        user_id=session['user_id']
-    ).order_by(ChatHistory.timestamp.desc()).paginate(
+    query = ChatHistory.query.filter_by(user_id=session['user_id'])
+    if session_id:
+        query = query.filter_by(session_id=session_id)
+    
+    chats = query.order_by(ChatHistory.timestamp.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
     return jsonify({
         'chats': [{
             'id': chat.id,
+            'session_id': chat.session_id,
             'message': chat.message,
             'response': chat.response,
             'timestamp': chat.timestamp.isoformat()
@@ -430,16 +2334,31 @@ def get_chat_history():
 @app.route('/documents', methods=['GET'])
 @login_required
 def get_user_documents():
-    documents = Document.query.filter_by(user_id=session['user_id']).all()
+    # Faceted by the catalog: ?year=2021&author=budi santoso
+    return jsonify(document_listing(
+        session['user_id'], request.args.get('year', type=int), request.args.get('author')
+    ))
+
+@app.route('/documents/<int:document_id>', methods=['DELETE'])
+@login_required
+def delete_document(document_id):
+    document = Document.query.filter_by(id=document_id, user_id=session['user_id']).first()
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
     
-    return jsonify({
-        'documents': [{
-            'id': doc.id,
-            'filename': doc.original_filename,
-            'uploaded_at': doc.uploaded_at.isoformat(),
-            'content_preview': doc.content[:200] + '...' if len(doc.content) > 200 else doc.content
-        } for doc in documents]
-    })
+    delete_document_data(document)
+    return jsonify({'message': 'Document deleted successfully'})
+
+@app.route('/documents/<int:document_id>/related', methods=['GET'])
+@login_required
+def get_related_documents(document_id):
+    related = related_documents(
+        document_id, session['user_id'], session.get('role'),
+        request.args.get('scope'), request.args.get('limit', 10, type=int)
+    )
+    if related is None:
+        return jsonify({'error': 'Document not found'}), 404
+    return jsonify(related)
 
 # Admin Routes
 @app.route('/admin/users', methods=['GET'])
@@ -471,6 +2390,32 @@ def get_all_documents():
         } for doc in documents]
     })
 
+@app.route('/admin/reextract', methods=['POST'])
+@admin_required
+def start_reextract():
+    # Resumes from the checkpoint of a paused, failed or interrupted run
+    _, job = start_reextraction(session['user_id'])
+    if job is None:
+        return jsonify(dict(reextraction_overview(), error='Re-extraction is already running')), 409
+    return jsonify(reextraction_overview()), 202
+
+@app.route('/admin/reextract', methods=['GET'])
+@admin_required
+def get_reextract():
+    return jsonify(reextraction_overview())
+
+@app.route('/admin/reextract', methods=['DELETE'])
+@admin_required
+def pause_reextract():
+    run = ExtractionRun.query.order_by(ExtractionRun.id.desc()).first()
+    job = run and reextraction_job(run)
+    if job is None or job.done:
+        return jsonify({'error': 'No re-extraction running'}), 404
+    
+    # Stops after the current batch; POST resumes
+    job.cancel()
+    return jsonify(reextraction_overview())
+
 @app.route('/admin/chat-history', methods=['GET'])
 @admin_or_dosen_required
 def get_all_chat_history():
@@ -529,15 +2474,52 @@ def delete_user():
     if user.id == session['user_id']:
         return jsonify({'error': 'Cannot delete your own account'}), 400
     
-    # Delete related data
-    ChatHistory.query.filter_by(user_id=user_id).delete()
-    Document.query.filter_by(user_id=user_id).delete()
-    
-    db.session.delete(user)
-    db.session.commit()
+    delete_user_data(user)
     
     return jsonify({'message': 'User deleted successfully'})
 
+@app.route('/admin/metrics', methods=['GET'])
+@admin_required
+def get_metrics():
+    snapshot = dict(metrics.snapshot(), admission=llm_admission.snapshot())
+    snapshot['single_flight'] = {'in_flight': llm_flights.in_flight()}
+    snapshot['generations_in_progress'] = session_generations.in_progress()
+    snapshot['backends'] = llm_backends.snapshot()
+    snapshot['jobs'] = {
+        'ask': ask_jobs.snapshot(), 'fanout': fanout_jobs.snapshot(), 'reextract': reextraction_jobs.snapshot()
+    }
+    return jsonify(snapshot)
+
+def routing_summary():
+    """Per-tier counts and outcomes of recorded routing decisions"""
+    rows = db.session.query(
+        RoutingDecision.tier,
+        RoutingDecision.reason,
+        db.func.count(RoutingDecision.id),
+        db.func.avg(RoutingDecision.generation_time),
+        db.func.avg(RoutingDecision.answer_tokens),
+        db.func.sum(db.case((RoutingDecision.answer_tokens >= RoutingDecision.max_tokens * 0.95, 1), else_=0))
+    ).group_by(RoutingDecision.tier, RoutingDecision.reason).all()
+    
+    tiers = {}
+    for tier, reason, count, generation_time, answer_tokens, capped in rows:
+        summary = tiers.setdefault(tier, {
+            'current_max_tokens': question_router.max_tokens(tier) if tier in question_router.tiers else None,
+            'reasons': {}
+        })
+        summary['reasons'][reason] = {
+            'count': count,
+            'avg_generation_time': generation_time,
+            'avg_answer_tokens': answer_tokens,
+            'hit_token_cap': capped
+        }
+    return {'tiers': tiers}
+
+@app.route('/admin/routing', methods=['GET'])
+@admin_required
+def get_routing_summary():
+    return jsonify(routing_summary())
+
 @app.route('/user-info', methods=['GET'])
 @login_required
 def get_user_info():
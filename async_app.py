@@ -0,0 +1,1125 @@
+"""
+ASGI (FastAPI) implementation of the API in ``app.py``.
+
+Routes, models, sessions and JSON responses are the same as the Flask app;
+only the execution model differs. LM Studio is called through an
+``httpx.AsyncClient``, so a chat waiting for its answer costs a coroutine
+instead of a thread and one worker can hold hundreds of them. Database work
+runs in the threadpool inside a Flask app context (the Flask-SQLAlchemy
+models are reused as is), text extraction runs in a process pool and uploads
+are written with aiofiles.
+
+Run with:
+    uvicorn async_app:api --host 127.0.0.1 --port 5000
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import wraps
+
+import aiofiles
+from fastapi import Depends, FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.sessions import SessionMiddleware
+from werkzeug.utils import secure_filename
+
+from app import (
+    app as flask_app, db, User, Document, ChatHistory, ChatSession, ExtractionRun,
+    EXTRACTOR_VERSION, start_reextraction, reextraction_job, reextraction_overview, reextraction_jobs,
+    llm_client, llm_admission, metrics,
+    allowed_file, extract_text_from_file, prepare_question, save_prepared_answer, refusal_events,
+    sse_event, format_document_context, build_warmup_messages,
+    join_answer_flight, llm_flights, generation_params, routing_summary,
+    prepare_analysis, parse_answers, save_analysis_answers, analysis_result,
+    fanout_jobs, prepare_fanout, start_fanout, fanout_summary, visible_job, fanout_csv, JOB_KEEPALIVE_INTERVAL,
+    ask_jobs, start_ask_job, ask_job_state, ASK_JOB_MAX_WAIT,
+    session_generations, start_generation, SUPERSEDED_MESSAGE,
+    question_router, fit_to_deadline, ASK_DEADLINE, FULL_ANALYSIS_DEADLINE, MAX_REQUEST_DEADLINE,
+    idempotency_store, stored_headers, IDEMPOTENCY_WAIT_TIMEOUT,
+    degraded_reason, extractive_answer, extractive_events, falls_back,
+    catalog_answer, document_listing, related_documents, delete_document_data, delete_chat_session_data, delete_user_data,
+    text_chunks, stored_page_texts, missing_pages, assemble_pages, store_document,
+    DEFAULT_SESSION_ID, IRRELEVANT_QUESTION_RESPONSE, PROMPT_CACHE_WARMUP, QUEUE_POSITION_INTERVAL,
+    FLIGHT_WAIT_TIMEOUT
+)
+from admission import AdmissionRejected
+from bibliography import read_bibliography
+from chunking import pdf_page_keys, extract_pdf_pages
+from near_duplicates import minhash
+from deadline import DEADLINE_HEADER, DeadlineExceeded, parse_deadline
+from idempotency import fingerprint, IDEMPOTENCY_HEADER, REPLAYED_HEADER, MAX_KEY_LENGTH
+from llm_client import AsyncLLMClient, LLMError, LLMTimeoutError
+from question_router import PREDEFINED_QUESTIONS
+
+# Processes for PDF/DOCX extraction (0 = use the threadpool instead)
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', 2))
+
+# Size of the blocks streamed from an upload to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Seconds between checks for a gone client while a non-streamed answer is generated
+DISCONNECT_CHECK_INTERVAL = 0.5
+
+# Same settings and circuit breaker as the synchronous client
+async_llm_client = AsyncLLMClient(
+    llm_client.backends,
+    model=llm_client.model,
+    connect_timeout=llm_client.connect_timeout,
+    read_timeout=llm_client.read_timeout,
+    max_retries=llm_client.max_retries,
+    pool_size=llm_client.pool_size,
+    breaker=llm_client.breaker
+)
+
+templates = Jinja2Templates(directory='templates')
+
+extraction_executor = None
+
+# Keeps background warm-up tasks referenced until they finish
+background_tasks = set()
+
+
+class APIError(Exception):
+    """Error returned to the client as ``{'error': message}``"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@asynccontextmanager
+async def lifespan(api):
+    global extraction_executor
+    with flask_app.app_context():
+        db.create_all()
+    if EXTRACTION_WORKERS > 0:
+        extraction_executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    yield
+    await async_llm_client.aclose()
+    if extraction_executor is not None:
+        extraction_executor.shutdown(wait=False, cancel_futures=True)
+
+
+api = FastAPI(lifespan=lifespan)
+api.add_middleware(SessionMiddleware, secret_key=flask_app.config['SECRET_KEY'])
+
+
+@api.exception_handler(APIError)
+async def api_error_handler(request, error):
+    return JSONResponse({'error': error.message}, status_code=error.status_code)
+
+
+# Helpers
+def _in_app_context(fn, *args):
+    with flask_app.app_context():
+        return fn(*args)
+
+
+async def run_db(fn, *args):
+    """
+    Run blocking database work in the threadpool inside a Flask app context
+
+    The session is removed when the context ends, so ``fn`` should return
+    plain values rather than model instances that are used afterwards.
+    """
+    return await run_in_threadpool(_in_app_context, fn, *args)
+
+
+async def run_extraction(fn, *args):
+    """Run file parsing off the event loop, in the process pool when one is configured"""
+    if extraction_executor is None:
+        return await run_in_threadpool(fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(extraction_executor, fn, *args)
+
+
+async def extract_text(file_path, filename):
+    """Extract text off the event loop"""
+    return await run_extraction(extract_text_from_file, file_path, filename)
+
+
+async def extract_document(file_path, filename):
+    """``app.extract_document`` with parsing off the event loop and queries in the threadpool"""
+    if filename.rsplit('.', 1)[1].lower() == 'pdf':
+        keys = await run_extraction(pdf_page_keys, file_path, EXTRACTOR_VERSION)
+        if keys:
+            stored = await run_db(stored_page_texts, keys)
+            missing = missing_pages(keys, stored)
+            extracted = await run_extraction(extract_pdf_pages, file_path, sorted(missing.values()))
+            return assemble_pages(keys, stored, missing, extracted)
+    return await run_extraction(text_chunks, await extract_text(file_path, filename)), None
+
+
+async def get_json(request):
+    """Return the JSON body, or None if it is missing or invalid (like Flask's get_json)"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def query_arg(request, name, default, type=int):
+    """Read a query argument, falling back to ``default`` when it does not parse"""
+    try:
+        return type(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def request_deadline(request, default):
+    """Deadline of a request: its X-Request-Timeout (capped) or the endpoint's ``default``"""
+    try:
+        return parse_deadline(request.headers.get(DEADLINE_HEADER), default, MAX_REQUEST_DEADLINE)
+    except ValueError as e:
+        raise APIError(str(e), 400)
+
+
+def llm_error_response(error):
+    """Build the JSON error response for an LLM failure"""
+    if isinstance(error, AdmissionRejected):
+        status = error.status_code
+    else:
+        status = 504 if isinstance(error, LLMTimeoutError) else 503
+    headers = {}
+    if error.retry_after:
+        headers['Retry-After'] = str(max(1, int(error.retry_after + 0.5)))
+    return JSONResponse({'error': str(error), 'retryable': True}, status_code=status, headers=headers)
+
+
+def sse_response(events, on_close=None):
+    """Wrap an async event generator in a streaming text/event-stream response"""
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        # Runs even if the client disconnects before the generator starts
+        background=BackgroundTask(on_close) if on_close is not None else None
+    )
+
+
+def _user_role(user_id):
+    user = db.session.get(User, user_id)
+    return user.role if user else None
+
+
+async def stored_stream(entry, response, body):
+    """Async version of ``app.stored_stream``"""
+    chunks = []
+    try:
+        async for chunk in body:
+            chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        aclose = getattr(body, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+    idempotency_store.complete(entry, response.status_code, stored_headers(response), b''.join(chunks))
+
+
+def idempotent(view):
+    """
+    Async version of ``app.idempotent``
+
+    The route must take ``request`` and the logged-in ``user_id``.
+    """
+    @wraps(view)
+    async def wrapper(**kwargs):
+        request = kwargs['request']
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await view(**kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise APIError(f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters', 400)
+        # The body is read to fingerprint it, so check its size first
+        if int(request.headers.get('content-length') or 0) > flask_app.config['MAX_CONTENT_LENGTH']:
+            raise APIError('File too large', 413)
+
+        scope = (kwargs['user_id'], request.url.path, key)
+        request_hash = fingerprint(
+            request.method, request.url.path, request.url.query,
+            request.headers.get('content-type', ''), await request.body()
+        )
+        entry, leader = idempotency_store.begin(scope, request_hash)
+        while not leader:
+            if entry.fingerprint != request_hash:
+                raise APIError(f'{IDEMPOTENCY_HEADER} was already used for a different request', 422)
+            if not await entry.wait_async(IDEMPOTENCY_WAIT_TIMEOUT):
+                return JSONResponse(
+                    {'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'},
+                    status_code=409, headers={'Retry-After': '5'}
+                )
+            if entry.response is not None:
+                status, headers, body = entry.response
+                return Response(body, status_code=status, headers=dict(headers, **{REPLAYED_HEADER: 'true'}))
+            # The first request failed and stored nothing: run this one instead
+            entry, leader = idempotency_store.begin(scope, request_hash)
+
+        try:
+            response = await view(**kwargs)
+        except BaseException:
+            idempotency_store.abandon(entry)
+            raise
+        if not isinstance(response, Response):
+            response = JSONResponse(jsonable_encoder(response))
+        if not isinstance(response, StreamingResponse):
+            idempotency_store.complete(entry, response.status_code, stored_headers(response), response.body)
+            return response
+
+        response.body_iterator = stored_stream(entry, response, response.body_iterator)
+        on_close = response.background
+
+        async def release():
+            # Does nothing if the stream completed; releases the key if it was cut off
+            idempotency_store.abandon(entry)
+            if on_close is not None:
+                await on_close()
+        response.background = BackgroundTask(release)
+        return response
+    return wrapper
+
+
+# Authentication dependencies
+async def login_required(request: Request):
+    if 'user_id' not in request.session:
+        raise APIError('Authentication required', 401)
+    return request.session['user_id']
+
+
+async def admin_required(request: Request):
+    user_id = await login_required(request)
+    if await run_db(_user_role, user_id) != 'admin':
+        raise APIError('Admin access required', 403)
+    return user_id
+
+
+async def admin_or_dosen_required(request: Request):
+    user_id = request.session.get('user_id')
+    if user_id is None or await run_db(_user_role, user_id) not in ('admin', 'dosen'):
+        raise APIError('Admin or Dosen access required', 403)
+    return user_id
+
+
+# LM Studio
+async def query_lm_studio(messages, max_tokens=1000, **params):
+    """
+    Query LM Studio API without blocking the event loop; ``params`` override the defaults
+
+    Raises:
+        LLMError: If LM Studio is unavailable or fails; never returned as an answer
+    """
+    start_time = asyncio.get_running_loop().time()
+    content = await async_llm_client.complete(messages, max_tokens=max_tokens, **params)
+    metrics.observe('llm.generation_time', asyncio.get_running_loop().time() - start_time)
+    return content
+
+
+async def queue_position_events(ticket, deadline=None, reserve=0.0):
+    """Async version of ``app.queue_position_events`` (raises AdmissionRejected or DeadlineExceeded)"""
+    position = None
+    while not ticket.admitted:
+        limit, error = llm_admission.wait_limit(ticket, deadline, reserve)
+        if limit <= 0:
+            raise error()
+        current = llm_admission.position(ticket)
+        if current != position:
+            position = current
+            yield sse_event('queue', {'position': position})
+        await ticket.wait_async(min(QUEUE_POSITION_INTERVAL, limit))
+
+
+async def answer_question(prepared, user_id, role, generation=None, deadline=None):
+    """Async version of ``app.answer_question``"""
+    flight, leader = join_answer_flight(prepared, generation)
+    if not leader:
+        wait_timeout = FLIGHT_WAIT_TIMEOUT if deadline is None else min(FLIGHT_WAIT_TIMEOUT, deadline.remaining())
+        return await flight.result_async(wait_timeout), None
+
+    reserve = question_router.min_generation_time(prepared['route']['tier'])
+    try:
+        async with llm_admission.admit_async(user_id, role, deadline, reserve):
+            fit_to_deadline(prepared, deadline, 'queue')
+            start_time = time.monotonic()
+            response = await query_lm_studio(
+                prepared['messages'], deadline=deadline, **generation_params(prepared['route'])
+            )
+            generation_time = time.monotonic() - start_time
+        flight.publish(response)
+        flight.finish()
+        return response, generation_time
+    except LLMError as e:
+        flight.finish(e)
+        raise
+    finally:
+        flight.abandon()
+
+
+async def stream_answer(prepared, flight, ticket=None, generation=None, deadline=None):
+    """
+    Async version of ``app.stream_answer``: queue, meta, deltas, then done or error
+
+    A client disconnect cancels the response task, which aborts the upstream
+    request; so does a newer question superseding ``generation``.
+    """
+    loop = asyncio.get_running_loop()
+    time_to_first_token = None
+    chunks = []
+    upstream = None
+
+    try:
+        if ticket is not None:
+            reserve = question_router.min_generation_time(prepared['route']['tier'])
+            async for event in queue_position_events(ticket, deadline, reserve):
+                yield event
+            fit_to_deadline(prepared, deadline, 'queue')
+        yield sse_event('meta', prepared['result'])
+
+        start_time = loop.time()
+        if ticket is not None:
+            upstream = async_llm_client.stream(
+                prepared['messages'], deadline=deadline, **generation_params(prepared['route'])
+            )
+            contents = flight.arelay(upstream)
+        else:
+            follow_timeout = FLIGHT_WAIT_TIMEOUT if deadline is None else min(FLIGHT_WAIT_TIMEOUT, deadline.remaining())
+            contents = flight.afollow(follow_timeout)
+        async for content in contents:
+            if time_to_first_token is None:
+                time_to_first_token = loop.time() - start_time
+                metrics.observe('llm.time_to_first_token', time_to_first_token)
+            chunks.append(content)
+            yield sse_event('delta', {'content': content})
+            if generation is not None and generation.should_stop:
+                yield sse_event('error', {'error': SUPERSEDED_MESSAGE, 'retry_after': None, 'cancelled': True})
+                return
+    except LLMError as e:
+        if ticket is not None:
+            flight.finish(e)
+        # Partial answers are not persisted; the client may retry
+        yield sse_event('error', {'error': str(e), 'retry_after': e.retry_after})
+        return
+    finally:
+        if upstream is not None:
+            await upstream.aclose()
+        if ticket is not None:
+            llm_admission.release(ticket)
+            flight.abandon()
+        if generation is not None:
+            session_generations.finish(generation)
+
+    generation_time = loop.time() - start_time
+    metrics.observe('llm.generation_time', generation_time)
+
+    leader_time = generation_time if ticket is not None else None
+    chat_id = await run_db(lambda: save_prepared_answer(prepared, ''.join(chunks), leader_time).id)
+
+    yield sse_event('done', {
+        'chat_id': chat_id,
+        'time_to_first_token': time_to_first_token,
+        'generation_time': generation_time
+    })
+
+
+async def extractive_response(prepared, reason, stream):
+    """Async version of ``app.extractive_response``"""
+    result = await run_db(extractive_answer, prepared, reason)
+    if stream:
+        return sse_response(iter_events(extractive_events(result)))
+    return result
+
+
+async def warm_prompt_cache(documents_content):
+    """Send the stable prompt prefix with max_tokens=1 so LM Studio caches it"""
+    try:
+        # Lowest priority: warm-ups never delay questions
+        async with llm_admission.admit_async(None, 'background'):
+            await query_lm_studio(build_warmup_messages(documents_content), max_tokens=1)
+    except LLMError as e:
+        print(f"Prompt cache warm-up failed: {e}")
+
+
+async def until_disconnected(request, coro, generation=None):
+    """
+    Await ``coro``, cancelling it (and with it the LM Studio request) when the
+    client disconnects or ``generation`` is superseded
+
+    Raises:
+        APIError: 499 if the client is gone, 409 if the answer was superseded
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_CHECK_INTERVAL)
+            if done:
+                return task.result()
+            if generation is not None and generation.should_stop:
+                raise APIError(SUPERSEDED_MESSAGE, 409)
+            if await request.is_disconnected():
+                metrics.increment('requests.disconnected')
+                raise APIError('Client closed the request', 499)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def iter_events(events):
+    for event in events:
+        yield event
+
+
+async def job_events(job, summarize):
+    """Async version of ``app.job_events``"""
+    yield sse_event('meta', summarize(job))
+    index = 0
+    while True:
+        results, finished = await job.wait_results_async(index, JOB_KEEPALIVE_INTERVAL)
+        for result in results:
+            yield sse_event('result', result)
+        index += len(results)
+        if finished:
+            break
+        if not results:
+            yield ": keep-alive\n\n"
+    yield sse_event('done', summarize(job))
+
+
+# Routes
+@api.get('/')
+async def index(request: Request):
+    return templates.TemplateResponse(request, 'index.html')
+
+
+@api.post('/register', status_code=201)
+async def register(request: Request):
+    data = await get_json(request)
+
+    if not data or not all(k in data for k in ('username', 'email', 'password')):
+        raise APIError('Missing required fields', 400)
+
+    def create_user():
+        # Check if user already exists
+        if User.query.filter_by(username=data['username']).first():
+            raise APIError('Username already exists', 400)
+
+        if User.query.filter_by(email=data['email']).first():
+            raise APIError('Email already exists', 400)
+
+        user = User(
+            username=data['username'],
+            email=data['email'],
+            role=data.get('role', 'user')  # Default to 'user' if role not specified
+        )
+        user.set_password(data['password'])
+
+        db.session.add(user)
+        db.session.commit()
+
+    await run_db(create_user)
+
+    return {'message': 'User registered successfully'}
+
+
+@api.post('/login')
+async def login(request: Request):
+    data = await get_json(request)
+
+    if not data or not all(k in data for k in ('username', 'password')):
+        raise APIError('Missing username or password', 400)
+
+    def authenticate():
+        user = User.query.filter_by(username=data['username']).first()
+        if user and user.check_password(data['password']):
+            return {'id': user.id, 'username': user.username, 'role': user.role}
+        return None
+
+    user = await run_db(authenticate)
+    if not user:
+        raise APIError('Invalid credentials', 401)
+
+    request.session['user_id'] = user['id']
+    request.session['username'] = user['username']
+    request.session['role'] = user['role']
+    return {'message': 'Login successful', 'user': user}
+
+
+@api.post('/logout')
+async def logout(request: Request):
+    request.session.clear()
+    return {'message': 'Logged out successfully'}
+
+
+@api.post('/upload')
+@idempotent
+async def upload_files(request: Request, user_id=Depends(login_required)):
+    content_length = int(request.headers.get('content-length') or 0)
+    if content_length > flask_app.config['MAX_CONTENT_LENGTH']:
+        raise APIError('File too large', 413)
+
+    form = await request.form()
+    files = [file for file in form.getlist('files') if hasattr(file, 'filename')]
+
+    if not files:
+        raise APIError('No files provided', 400)
+
+    if len(files) > 5:
+        raise APIError('Maximum 5 files allowed', 400)
+
+    if all(not file.filename for file in files):
+        raise APIError('No files selected', 400)
+
+    # A new version of one of the user's documents
+    try:
+        parent_id = int(form['parent_id']) if form.get('parent_id') else None
+    except ValueError:
+        parent_id = None
+    if parent_id is not None:
+        if len(files) != 1:
+            raise APIError('parent_id requires a single file', 400)
+        parent = await run_db(lambda: Document.query.filter_by(id=parent_id, user_id=user_id).first() is not None)
+        if not parent:
+            raise APIError('Parent document not found', 404)
+
+    role = request.session.get('role')
+    uploaded_files = []
+    uploaded_documents = []
+
+    for file in files:
+        if file.filename and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            # Add timestamp to prevent filename conflicts
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
+            filename = timestamp + filename
+            file_path = os.path.join(flask_app.config['UPLOAD_FOLDER'], filename)
+
+            async with aiofiles.open(file_path, 'wb') as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await out.write(chunk)
+
+            # Extract text content, page by page for PDFs
+            chunks, new_pages = await extract_document(file_path, file.filename)
+            content = ''.join(text for _, text in chunks)
+            first_page = chunks[0][1] if new_pages is not None and chunks else None
+            bibliography = await run_extraction(read_bibliography, file_path, file.filename, content, first_page)
+            signature = await run_extraction(minhash, content)
+
+            def save_document(original_filename=file.filename, filename=filename, file_path=file_path,
+                              chunks=chunks, new_pages=new_pages, bibliography=bibliography, signature=signature):
+                _, uploaded = store_document(
+                    user_id, role, original_filename, filename, file_path,
+                    chunks, new_pages, bibliography, signature, parent_id
+                )
+                return uploaded
+
+            uploaded = await run_db(save_document)
+            uploaded_documents.append(Document(id=uploaded['id'], original_filename=file.filename, content=content))
+            uploaded_files.append(uploaded)
+
+    # Warm the prompt cache in the background so the first question is fast
+    warm_cache = str(form.get('warm_cache', PROMPT_CACHE_WARMUP)).lower() in ('1', 'true')
+    if warm_cache and uploaded_documents:
+        task = asyncio.create_task(warm_prompt_cache(format_document_context(uploaded_documents)))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    return {
+        'message': f'{len(uploaded_files)} files uploaded successfully',
+        'files': uploaded_files,
+        'cache_warmup': bool(warm_cache and uploaded_documents)
+    }
+
+
+@api.get('/predefined-questions')
+async def get_predefined_questions():
+    return {
+        'questions': [question for question, _ in PREDEFINED_QUESTIONS.values()],
+        'predefined': [{'id': question_id, 'question': question} for question_id, (question, _) in PREDEFINED_QUESTIONS.items()]
+    }
+
+
+@api.post('/ask')
+@idempotent
+async def ask_question(request: Request, user_id=Depends(login_required)):
+    data = await get_json(request)
+    deadline = request_deadline(request, ASK_DEADLINE)
+
+    try:
+        prepared, error = await run_db(
+            prepare_question, user_id, data, request.session.get('session_id', DEFAULT_SESSION_ID), deadline
+        )
+    except DeadlineExceeded as e:
+        return llm_error_response(e)
+    if error:
+        raise APIError(*error)
+
+    # Job mode: answer in the background and let the client poll /ask/jobs/<id>
+    if request.query_params.get('async') in ('1', 'true') or data.get('async'):
+        job = start_ask_job(prepared, request.session.get('role', 'user'))
+        return JSONResponse(
+            dict(ask_job_state(job), poll_url=f'/ask/jobs/{job.id}'),
+            status_code=202,
+            headers={'Location': f'/ask/jobs/{job.id}'}
+        )
+
+    # Stream the answer as Server-Sent Events instead of waiting for all of it
+    stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('accept', '')
+
+    # Irrelevant questions get a fixed answer without calling LM Studio
+    if prepared['messages'] is None:
+        events = await run_db(
+            lambda: refusal_events(prepared, save_prepared_answer(prepared, IRRELEVANT_QUESTION_RESPONSE))
+        )
+
+        if stream:
+            return sse_response(iter_events(events))
+        return {'response': IRRELEVANT_QUESTION_RESPONSE, 'session_id': prepared['session_id']}
+
+    # Authors, years, titles and DOIs are looked up in the catalog
+    result = await run_db(catalog_answer, prepared)
+    if result is not None:
+        if stream:
+            return sse_response(iter_events(extractive_events(result)))
+        return result
+
+    # Quote the documents instead of generating when asked to, or when LM Studio can't answer
+    fast = (data.get('mode') or request.query_params.get('mode')) == 'fast'
+    reason = 'requested' if fast else degraded_reason()
+    if reason:
+        return await extractive_response(prepared, reason, stream)
+
+    role = request.session.get('role', 'user')
+    generation = start_generation(prepared)
+
+    if stream:
+        flight, leader = join_answer_flight(prepared, generation)
+        if not leader:
+            return sse_response(
+                stream_answer(prepared, flight, generation=generation, deadline=deadline),
+                on_close=lambda: session_generations.finish(generation)
+            )
+
+        # Shed the request before streaming starts if the queue is full
+        try:
+            ticket = llm_admission.enqueue(user_id, role, asyncio.get_running_loop())
+        except AdmissionRejected as e:
+            flight.finish(e)
+            session_generations.finish(generation)
+            if falls_back(e):
+                return await extractive_response(prepared, 'llm_error', stream)
+            return llm_error_response(e)
+
+        def close():
+            llm_admission.release(ticket)
+            flight.abandon()
+            session_generations.finish(generation)
+        return sse_response(stream_answer(prepared, flight, ticket, generation, deadline), on_close=close)
+
+    # Query LM Studio once admitted; failures are reported, never stored as answers
+    try:
+        response, generation_time = await until_disconnected(
+            request, answer_question(prepared, user_id, role, generation, deadline), generation
+        )
+    except DeadlineExceeded as e:
+        # The caller's deadline has passed; an extractive answer would arrive too late as well
+        return llm_error_response(e)
+    except LLMError as e:
+        if falls_back(e):
+            return await extractive_response(prepared, 'llm_error', stream)
+        return llm_error_response(e)
+    finally:
+        session_generations.finish(generation)
+
+    # Save to chat history
+    await run_db(save_prepared_answer, prepared, response, generation_time)
+
+    return dict(prepared['result'], response=response)
+
+
+@api.post('/full-analysis')
+async def full_analysis(request: Request, user_id=Depends(login_required)):
+    deadline = request_deadline(request, FULL_ANALYSIS_DEADLINE)
+    try:
+        prepared, error = await run_db(
+            prepare_analysis, user_id, await get_json(request),
+            request.session.get('session_id', DEFAULT_SESSION_ID), deadline
+        )
+    except DeadlineExceeded as e:
+        return llm_error_response(e)
+    if error:
+        raise APIError(*error)
+
+    # One generation for all questions, shared with identical concurrent requests
+    try:
+        response, _ = await until_disconnected(
+            request, answer_question(prepared, user_id, request.session.get('role', 'user'), deadline=deadline)
+        )
+    except LLMError as e:
+        return llm_error_response(e)
+
+    answers = parse_answers(response, prepared['questions'])
+    metrics.increment('full_analysis.requests')
+    metrics.increment('full_analysis.missing_answers', len(prepared['questions']) - len(answers))
+    if not answers:
+        raise APIError('LM Studio returned no usable answers, please try again', 502)
+
+    chat_ids = await run_db(save_analysis_answers, prepared, answers)
+    return analysis_result(prepared, answers, chat_ids)
+
+
+@api.post('/fanout', status_code=202)
+async def create_fanout(request: Request, user_id=Depends(admin_or_dosen_required)):
+    params, error = await run_db(prepare_fanout, await get_json(request))
+    if error:
+        raise APIError(*error)
+
+    return fanout_summary(start_fanout(user_id, params))
+
+
+def fanout_job(request, job_id, user_id):
+    job = visible_job(fanout_jobs, job_id, user_id, request.session.get('role'))
+    if job is None:
+        raise APIError('Job not found', 404)
+    return job
+
+
+@api.get('/fanout/{job_id}')
+async def get_fanout(job_id: str, request: Request, user_id=Depends(admin_or_dosen_required)):
+    job = fanout_job(request, job_id, user_id)
+
+    # Results as they finish, or the current state with every result so far
+    if request.query_params.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('accept', ''):
+        return sse_response(job_events(job, fanout_summary))
+    return dict(fanout_summary(job), results=list(job.results))
+
+
+@api.get('/fanout/{job_id}/export')
+async def export_fanout(job_id: str, request: Request, user_id=Depends(admin_or_dosen_required)):
+    job = fanout_job(request, job_id, user_id)
+    return Response(
+        fanout_csv(job),
+        media_type='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=fanout-{job.id}.csv'}
+    )
+
+
+@api.delete('/fanout/{job_id}')
+async def cancel_fanout(job_id: str, request: Request, user_id=Depends(admin_or_dosen_required)):
+    job = fanout_job(request, job_id, user_id)
+    job.cancel()
+    return fanout_summary(job)
+
+
+@api.get('/ask/jobs/{job_id}')
+async def get_ask_job(job_id: str, request: Request, user_id=Depends(login_required)):
+    job = visible_job(ask_jobs, job_id, user_id, request.session.get('role'))
+    if job is None:
+        raise APIError('Job not found', 404)
+
+    # Long poll: ?wait=N holds the request until the answer is ready or N seconds pass
+    wait = min(query_arg(request, 'wait', 0, float), ASK_JOB_MAX_WAIT)
+    if wait > 0:
+        await job.wait_async(wait)
+    return ask_job_state(job)
+
+
+@api.get('/ask/queue')
+async def get_queue_status(user_id=Depends(login_required)):
+    status = llm_admission.user_status(user_id)
+    status['queue_depth'] = llm_admission.snapshot()['queued']
+    return status
+
+
+@api.post('/sessions', status_code=201)
+async def create_chat_session(request: Request, user_id=Depends(login_required)):
+    data = await get_json(request) or {}
+
+    def create():
+        chat_session = ChatSession(user_id=user_id, title=data.get('title'))
+        db.session.add(chat_session)
+        db.session.commit()
+        return {
+            'id': chat_session.id,
+            'title': chat_session.title,
+            'created_at': chat_session.created_at.isoformat()
+        }
+
+    chat_session = await run_db(create)
+
+    # New questions go to this session unless the client names another one
+    request.session['session_id'] = chat_session['id']
+
+    return chat_session
+
+
+@api.get('/sessions')
+async def get_chat_sessions(request: Request, user_id=Depends(login_required)):
+    def list_sessions():
+        chat_sessions = ChatSession.query.filter_by(
+            user_id=user_id
+        ).order_by(ChatSession.created_at.desc()).all()
+        return [{
+            'id': chat_session.id,
+            'title': chat_session.title,
+            'created_at': chat_session.created_at.isoformat()
+        } for chat_session in chat_sessions]
+
+    return {
+        'sessions': await run_db(list_sessions),
+        'current': request.session.get('session_id', DEFAULT_SESSION_ID)
+    }
+
+
+@api.delete('/sessions/{session_id}')
+async def delete_chat_session(session_id: str, request: Request, user_id=Depends(login_required)):
+    def delete():
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
+        if not chat_session:
+            raise APIError('Chat session not found', 404)
+
+        delete_chat_session_data(chat_session)
+
+    await run_db(delete)
+
+    if request.session.get('session_id') == session_id:
+        request.session.pop('session_id')
+
+    return {'message': 'Chat session deleted successfully'}
+
+
+@api.get('/chat-history')
+async def get_chat_history(request: Request, user_id=Depends(login_required)):
+    page = query_arg(request, 'page', 1)
+    per_page = query_arg(request, 'per_page', 20)
+    session_id = request.query_params.get('session_id')
+
+    def history():
+        query = ChatHistory.query.filter_by(user_id=user_id)
+        if session_id:
+            query = query.filter_by(session_id=session_id)
+
+        chats = query.order_by(ChatHistory.timestamp.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        return {
+            'chats': [{
+                'id': chat.id,
+                'session_id': chat.session_id,
+                'message': chat.message,
+                'response': chat.response,
+                'timestamp': chat.timestamp.isoformat()
+            } for chat in chats.items],
+            'has_more': chats.has_next,
+            'total': chats.total
+        }
+
+    return await run_db(history)
+
+
+@api.get('/documents')
+async def get_user_documents(request: Request, user_id=Depends(login_required)):
+    # Faceted by the catalog: ?year=2021&author=budi santoso
+    year = query_arg(request, 'year', None)
+    return await run_db(document_listing, user_id, year, request.query_params.get('author'))
+
+
+@api.delete('/documents/{document_id}')
+async def delete_document(document_id: int, user_id=Depends(login_required)):
+    def delete():
+        document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+        if not document:
+            raise APIError('Document not found', 404)
+
+        delete_document_data(document)
+
+    await run_db(delete)
+
+    return {'message': 'Document deleted successfully'}
+
+
+@api.get('/documents/{document_id}/related')
+async def get_related_documents(document_id: int, request: Request, user_id=Depends(login_required)):
+    related = await run_db(
+        related_documents, document_id, user_id, request.session.get('role'),
+        request.query_params.get('scope'), query_arg(request, 'limit', 10)
+    )
+    if related is None:
+        raise APIError('Document not found', 404)
+    return related
+
+
+# Admin Routes
+@api.get('/admin/users')
+async def get_all_users(user_id=Depends(admin_required)):
+    def users():
+        return [{
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'created_at': user.created_at.isoformat()
+        } for user in User.query.all()]
+
+    return {'users': await run_db(users)}
+
+
+@api.get('/admin/documents')
+async def get_all_documents(user_id=Depends(admin_or_dosen_required)):
+    def documents():
+        return [{
+            'id': doc.id,
+            'filename': doc.original_filename,
+            'username': doc.user.username,
+            'uploaded_at': doc.uploaded_at.isoformat(),
+            'content_preview': doc.content[:200] + '...' if len(doc.content) > 200 else doc.content
+        } for doc in Document.query.join(User).all()]
+
+    return {'documents': await run_db(documents)}
+
+
+@api.post('/admin/reextract', status_code=202)
+async def start_reextract(user_id=Depends(admin_required)):
+    # Resumes from the checkpoint of a paused, failed or interrupted run
+    def start():
+        _, job = start_reextraction(user_id)
+        return job is not None, reextraction_overview()
+
+    started, overview = await run_db(start)
+    if not started:
+        return JSONResponse(dict(overview, error='Re-extraction is already running'), status_code=409)
+    return overview
+
+
+@api.get('/admin/reextract')
+async def get_reextract(user_id=Depends(admin_required)):
+    return await run_db(reextraction_overview)
+
+
+@api.delete('/admin/reextract')
+async def pause_reextract(user_id=Depends(admin_required)):
+    def pause():
+        run = ExtractionRun.query.order_by(ExtractionRun.id.desc()).first()
+        job = run and reextraction_job(run)
+        if job is None or job.done:
+            raise APIError('No re-extraction running', 404)
+
+        # Stops after the current batch; POST resumes
+        job.cancel()
+        return reextraction_overview()
+
+    return await run_db(pause)
+
+
+@api.get('/admin/chat-history')
+async def get_all_chat_history(request: Request, user_id=Depends(admin_or_dosen_required)):
+    page = query_arg(request, 'page', 1)
+    per_page = query_arg(request, 'per_page', 50)
+
+    def history():
+        chats = ChatHistory.query.join(User).order_by(
+            ChatHistory.timestamp.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        return {
+            'chats': [{
+                'id': chat.id,
+                'username': chat.user.username,
+                'message': chat.message,
+                'response': chat.response,
+                'timestamp': chat.timestamp.isoformat()
+            } for chat in chats.items],
+            'has_more': chats.has_next,
+            'total': chats.total
+        }
+
+    return await run_db(history)
+
+
+@api.post('/admin/update-user-role')
+async def update_user_role(request: Request, user_id=Depends(admin_required)):
+    data = await get_json(request)
+
+    if not data or not all(k in data for k in ('user_id', 'role')):
+        raise APIError('User ID and role are required', 400)
+
+    if data['role'] not in ['user', 'admin', 'dosen']:
+        raise APIError('Invalid role', 400)
+
+    def update():
+        user = db.session.get(User, data['user_id'])
+        if not user:
+            raise APIError('User not found', 404)
+
+        user.role = data['role']
+        db.session.commit()
+
+    await run_db(update)
+
+    return {'message': 'User role updated successfully'}
+
+
+@api.delete('/admin/delete-user')
+async def delete_user(request: Request, admin_id=Depends(admin_required)):
+    user_id = query_arg(request, 'user_id', None)
+
+    if not user_id:
+        raise APIError('User ID is required', 400)
+
+    def delete():
+        user = db.session.get(User, user_id)
+        if not user:
+            raise APIError('User not found', 404)
+
+        # Don't allow deleting the current admin
+        if user.id == admin_id:
+            raise APIError('Cannot delete your own account', 400)
+
+        delete_user_data(user)
+
+    await run_db(delete)
+
+    return {'message': 'User deleted successfully'}
+
+
+@api.get('/admin/metrics')
+async def get_metrics(user_id=Depends(admin_required)):
+    snapshot = dict(metrics.snapshot(), admission=llm_admission.snapshot())
+    snapshot['single_flight'] = {'in_flight': llm_flights.in_flight()}
+    snapshot['generations_in_progress'] = session_generations.in_progress()
+    snapshot['backends'] = llm_client.backends.snapshot()
+    snapshot['jobs'] = {
+        'ask': ask_jobs.snapshot(), 'fanout': fanout_jobs.snapshot(), 'reextract': reextraction_jobs.snapshot()
+    }
+    return snapshot
+
+
+@api.get('/admin/routing')
+async def get_routing_summary(user_id=Depends(admin_required)):
+    return await run_db(routing_summary)
+
+
+@api.get('/user-info')
+async def get_user_info(user_id=Depends(login_required)):
+    def user_info():
+        user = db.session.get(User, user_id)
+        return {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'created_at': user.created_at.isoformat()
+        }
+
+    return await run_db(user_info)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(api, host='127.0.0.1', port=5000)
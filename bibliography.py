@@ -0,0 +1,350 @@
+"""
+Bibliographic metadata of uploaded papers.
+
+At upload each document gets a catalog entry: title, authors, year and DOI,
+taken from the PDF ``/Info`` dictionary (or the DOCX core properties) where
+those look real, and otherwise read off the first page: the title is the
+first line that is not a journal header, the authors are the name lines
+between it and the abstract, the year is the publication year near
+"published"/"diterbitkan"-style markers, and the DOI is the first one on
+the page.
+
+Short questions about a paper's author, year, title or DOI are answered
+from the catalog without LM Studio.
+"""
+
+import re
+from datetime import datetime
+
+import PyPDF2
+import docx
+
+from text_analyzer import tokenize
+
+# Lines of the first page searched for the title and authors
+FIRST_PAGE_CHARS = 4000
+TITLE_MAX_CHARS = 300
+# A line that ends a sentence of more words than this is body text, not a title
+TITLE_MAX_SENTENCE_WORDS = 12
+MAX_AUTHORS = 12
+MIN_YEAR = 1950
+
+DOI_PATTERN = re.compile(r'\b(10\.\d{4,9}/[^\s"<>]+)', re.IGNORECASE)
+YEAR_PATTERN = re.compile(r'\b(19\d{2}|20\d{2})\b')
+_AUTHOR_SPLIT = re.compile(r'\s*(?:,|;|&|\band\b|\bdan\b)\s*', re.IGNORECASE)
+_AUTHOR_MARKS = re.compile(r'[\d*†‡§¹²³⁴⁵⁶⁷⁸⁹⁰]+')
+_INITIAL = re.compile(r"^[A-Z]\.?$|^[A-Z]\.[A-Z]\.?$")
+# A sentence end: after a lower-case letter or digit (not an initial), before the next capitalized sentence
+_SENTENCE_END = re.compile(r'(?<=[a-z0-9)][.!?])\s+(?=[A-Z])')
+
+# Lines that are journal headers, not the title
+HEADER_WORDS = (
+    'jurnal', 'journal', 'vol.', 'volume', 'issn', 'e-issn', 'p-issn', 'doi', 'http', 'www.', 'proceeding',
+    'prosiding', 'copyright', '©', 'received', 'accepted', 'available online', 'halaman', 'hal.', 'pp.',
+    'no.', 'article info', 'info artikel', 'open access', 'creative commons', 'diterima', 'diterbitkan', 'direvisi',
+    'published', 'revised', 'history'
+)
+# Lines that are affiliations or contact details, not author names
+AFFILIATION_WORDS = (
+    'universitas', 'university', 'fakultas', 'faculty', 'jurusan', 'department', 'program studi', 'prodi',
+    'institut', 'institute', 'sekolah', 'school', 'politeknik', 'polytechnic', 'email', 'e-mail', '@',
+    'jl.', 'jalan', 'street', 'indonesia', 'korespondensi', 'corresponding', 'laboratorium', 'laboratory'
+)
+ABSTRACT_WORDS = ('abstrak', 'abstract', 'intisari', 'ringkasan', 'keywords', 'kata kunci')
+# Words near the publication year on a first page
+YEAR_MARKERS = (
+    '©', 'copyright', 'published', 'diterbitkan', 'terbit', 'accepted', 'diterima', 'received', 'vol',
+    'tahun', 'year', 'skripsi', 'tesis', 'thesis'
+)
+# /Info values that are software or account names, not real titles or authors
+PLACEHOLDER_VALUES = ('user', 'admin', 'administrator', 'owner', 'author', 'hp', 'asus', 'lenovo', 'acer', 'dell', 'windows user', 'pc')
+PLACEHOLDER_PREFIXES = ('untitled', 'microsoft')
+
+# Question words per catalog field
+FIELD_WORDS = {
+    'authors': frozenset('penulis pengarang author authors'.split()),
+    'year': frozenset('kapan tahun year when tanggal date terbit diterbitkan published'.split()),
+    'title': frozenset('judul title'.split()),
+    'doi': frozenset(['doi'])
+}
+# Other words a question about the catalog may contain
+CATALOG_QUESTION_WORDS = frozenset("""
+siapa apa apakah berapa ini itu tersebut paper dokumen artikel jurnal skripsi tesis penelitian karya nya dari
+dan yang dengan pada oleh di ke saja sebutkan tolong dong mohon adalah dibuat dipublikasikan publikasi para
+who what which is are was were the this that of and by paper document article study its it give me please
+""".split())
+FIELD_WORDS_ALL = frozenset().union(*FIELD_WORDS.values())
+# "Who wrote" asks for the authors, but "when was it written" for the year
+WRITING_WORDS = frozenset('ditulis menulis'.split())
+# Predefined questions the catalog answers
+QUESTION_FIELDS = {'author_date': ('authors', 'year')}
+
+
+def _clean(value):
+    return re.sub(r'\s+', ' ', value or '').strip()
+
+
+def _is_placeholder(value):
+    lowered = value.lower()
+    return not value or lowered in PLACEHOLDER_VALUES or lowered.startswith(PLACEHOLDER_PREFIXES) or \
+        lowered.endswith(('.doc', '.docx', '.pdf', '.tex', '.dvi'))
+
+
+def _plausible_title(value):
+    value = re.sub(r'^microsoft word\s*-\s*', '', _clean(value), flags=re.IGNORECASE)
+    if _is_placeholder(value) or len(value.split()) < 3 or len(value) > TITLE_MAX_CHARS:
+        return None
+    return value
+
+
+def author_key(name):
+    """Normalized form of an author's name, as matched by the catalog's author filter"""
+    return ' '.join(re.findall(r'[0-9a-zÀ-ɏ]+', (name or '').lower()))
+
+
+def _name_words(name):
+    words = name.split()
+    return 2 <= len(words) <= 5 and all(
+        _INITIAL.match(word) or (word[0].isupper() and word.replace('.', '').replace('-', '').replace("'", '').isalpha())
+        for word in words
+    )
+
+
+def split_authors(line):
+    """
+    The names on an author line, or None if it is not one
+
+    Affiliation markers (digits, asterisks) are dropped, and a line of
+    names written in capitals is title-cased.
+    """
+    lowered = line.lower()
+    if any(word in lowered for word in AFFILIATION_WORDS + HEADER_WORDS + ABSTRACT_WORDS):
+        return None
+    line = _AUTHOR_MARKS.sub(' ', line)
+    if line.isupper():
+        line = line.title()
+    names = [_clean(name).strip('.,') for name in _AUTHOR_SPLIT.split(line)]
+    names = [name for name in names if name]
+    if not names or not all(_name_words(name) for name in names):
+        return None
+    return names
+
+
+def _is_header(line):
+    lowered = line.lower()
+    return any(word in lowered for word in HEADER_WORDS) or sum(c.isalpha() for c in line) < len(line) / 2
+
+
+def _is_prose(sentence):
+    return sentence.endswith('.') and len(sentence.split()) > TITLE_MAX_SENTENCE_WORDS
+
+
+def title_from_lines(lines):
+    """
+    The title on a first page and the index of the line after it
+
+    The first line of at least three words that is neither a journal header,
+    a list of names nor a sentence of body text, continued by the next lines
+    while they are in capitals like it or start in lower case, and cut at the
+    first sentence end (text extracted as a single line runs on into the body).
+    """
+    for index, line in enumerate(lines):
+        if len(line.split()) < 3 or _is_header(line) or _is_prose(_SENTENCE_END.split(line, 1)[0]):
+            continue
+        # A short title in capitals reads like a name once title-cased
+        names = split_authors(line)
+        if names and (len(names) > 1 or not line.isupper()):
+            continue
+        title = line
+        end = index + 1
+        while end < len(lines) and len(title) < TITLE_MAX_CHARS:
+            following = lines[end]
+            continued = (title.isupper() and following.isupper()) or following[:1].islower()
+            if not continued or _is_header(following) or any(word in following.lower() for word in ABSTRACT_WORDS):
+                break
+            title = f"{title} {following}"
+            end += 1
+        title = _SENTENCE_END.split(title, 1)[0].rstrip('.')
+        if title.isupper():
+            title = title.capitalize()
+        return title[:TITLE_MAX_CHARS], end
+    return None, 0
+
+
+def authors_from_lines(lines, start):
+    """Names on the author lines after the title, up to the abstract"""
+    authors = []
+    for line in lines[start:start + 8]:
+        lowered = line.lower()
+        if any(lowered.startswith(word) for word in ABSTRACT_WORDS):
+            break
+        names = split_authors(line)
+        if names:
+            authors.extend(name for name in names if name not in authors)
+        elif authors:
+            # Affiliations follow the names
+            break
+    return authors[:MAX_AUTHORS]
+
+
+def year_from_text(text, fallback=None):
+    """
+    Publication year on a first page
+
+    The latest year on a line with a publication marker, else the most
+    frequent year on the page, else ``fallback``.
+    """
+    latest = datetime.now().year + 1
+    marked = []
+    counts = {}
+    for line in text.splitlines():
+        years = [int(year) for year in YEAR_PATTERN.findall(line) if MIN_YEAR <= int(year) <= latest]
+        if not years:
+            continue
+        lowered = line.lower()
+        if any(marker in lowered for marker in YEAR_MARKERS):
+            marked.extend(years)
+        for year in years:
+            counts[year] = counts.get(year, 0) + 1
+    if marked:
+        return max(marked)
+    if counts:
+        return max(counts, key=lambda year: (counts[year], year))
+    return fallback
+
+
+def doi_from_text(text):
+    match = DOI_PATTERN.search(text or '')
+    return match.group(1).rstrip('.,;)]') if match else None
+
+
+def _pdf_metadata(file_path, first_page=None):
+    """(title, author, creation year, first page text) of a PDF; blanks on errors"""
+    try:
+        with open(file_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            info = reader.metadata or {}
+            if first_page is None:
+                first_page = reader.pages[0].extract_text() if reader.pages else ''
+            created = None
+            try:
+                created = info.creation_date.year if info.get('/CreationDate') else None
+            except (ValueError, AttributeError):
+                created = None
+            return _clean(info.get('/Title')), _clean(info.get('/Author')), created, first_page or ''
+    except Exception as e:
+        print(f"Error reading PDF metadata: {e}")
+        return '', '', None, first_page or ''
+
+
+def _docx_metadata(file_path):
+    """(title, author, creation year) of a DOCX; blanks on errors"""
+    try:
+        properties = docx.Document(file_path).core_properties
+        created = properties.created.year if properties.created else None
+        return _clean(properties.title), _clean(properties.author), created
+    except Exception as e:
+        print(f"Error reading DOCX metadata: {e}")
+        return '', '', None
+
+
+def read_bibliography(file_path, filename, content, first_page=None):
+    """
+    Catalog entry of an uploaded document
+
+    Args:
+        file_path (str): The stored file
+        filename (str): The original filename, whose extension picks the format
+        content (str): The extracted text, used as the first page of non-PDF files
+        first_page (str): The first page of a PDF when it is already extracted
+
+    Returns:
+        dict: ``title``, ``authors`` (list of names), ``year`` and ``doi``;
+        None for what could not be found
+    """
+    ext = filename.rsplit('.', 1)[-1].lower()
+    info_title, info_author, created = '', '', None
+    if ext == 'pdf':
+        info_title, info_author, created, first_page = _pdf_metadata(file_path, first_page)
+    elif ext in ('doc', 'docx'):
+        info_title, info_author, created = _docx_metadata(file_path)
+    if not (first_page or '').strip():
+        first_page = content or ''
+    first_page = first_page[:FIRST_PAGE_CHARS]
+
+    lines = [_clean(line) for line in first_page.splitlines()]
+    lines = [line for line in lines if line]
+    title, end = title_from_lines(lines)
+    authors = authors_from_lines(lines, end)
+
+    if not _is_placeholder(info_author):
+        named = split_authors(info_author)
+        if named:
+            authors = named[:MAX_AUTHORS]
+
+    return {
+        'title': _plausible_title(info_title) or title,
+        'authors': authors,
+        'year': year_from_text(first_page, created),
+        'doi': doi_from_text(first_page)
+    }
+
+
+def catalog_fields(question, question_id=None):
+    """
+    The catalog fields a factual question asks for, or None if it asks for something else
+
+    Only questions that name nothing but catalog fields qualify: "siapa
+    penulis paper ini?" does, "apa metode yang dipakai penulis?" does not
+    (it is routed to the analytical tier or asks for "metode").
+    """
+    if question_id in QUESTION_FIELDS:
+        return QUESTION_FIELDS[question_id]
+    # "penulisnya" asks for "penulis"
+    words = {word[:-3] if word.endswith('nya') and len(word) > 5 else word for word in tokenize(question)}
+    fields = tuple(field for field, field_words in FIELD_WORDS.items() if words & field_words)
+    if not fields and words & WRITING_WORDS:
+        fields = ('authors',)
+    if not fields:
+        return None
+    # Anything beyond question words, catalog words and references to the paper is another question
+    other = words - FIELD_WORDS_ALL - WRITING_WORDS - CATALOG_QUESTION_WORDS
+    return None if other else fields
+
+
+
+def _join_names(names):
+    if len(names) == 1:
+        return names[0]
+    return f"{', '.join(names[:-1])} dan {names[-1]}"
+
+
+def _describe(entry, fields):
+    paper = f'"{entry["title"]}"' if entry.get('title') and 'title' not in fields else entry['filename']
+    parts = []
+    if 'title' in fields:
+        parts.append(f'Judul paper {paper} adalah "{entry["title"]}".')
+    if 'authors' in fields and 'year' in fields:
+        parts.append(f"Paper {paper} ditulis oleh {_join_names(entry['authors'])} pada tahun {entry['year']}.")
+    elif 'authors' in fields:
+        parts.append(f"Penulis paper {paper} adalah {_join_names(entry['authors'])}.")
+    elif 'year' in fields:
+        parts.append(f"Paper {paper} dibuat pada tahun {entry['year']}.")
+    if 'doi' in fields:
+        parts.append(f"DOI paper {paper} adalah {entry['doi']}.")
+    return " ".join(parts)
+
+
+def format_catalog_answer(entries, fields):
+    """
+    Answer from catalog entries, or None if one of them lacks a requested field
+
+    Args:
+        entries (list): Dicts with ``filename``, ``title``, ``authors``, ``year`` and ``doi``
+        fields (tuple): Output of ``catalog_fields``
+    """
+    if not entries or any(not entry.get(field) for entry in entries for field in fields):
+        return None
+    if len(entries) == 1:
+        return _describe(entries[0], fields)
+    return "\n".join(f"- {_describe(entry, fields)}" for entry in entries)
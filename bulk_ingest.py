@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Bulk ingestion of a directory or zip archive of documents for one user
+Usage: python bulk_ingest.py <directory|archive.zip> --user <username> [--workers N] [--batch-size N]
+
+Files are read one at a time (zip members are streamed from the archive,
+which is never extracted as a whole), copied to the upload folder,
+extracted and analyzed for search by a pool of worker processes. Documents are written to the
+database in batches of one transaction each. Every file's SHA-256 is kept,
+so running the command again on the same files skips those already ingested.
+
+The server builds its search, related-papers and duplicate indexes in
+memory; restart it afterwards so they include the new documents.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from app import (
+    app, db, User, IngestedFile, allowed_file, extract_document, add_document_rows, save_page_texts,
+    chunk_terms, index_terms
+)
+from bibliography import read_bibliography
+from near_duplicates import minhash
+
+DEFAULT_BATCH_SIZE = 200
+# Files queued per worker, so results never pile up in memory
+QUEUED_PER_WORKER = 2
+
+# State of a worker process: hashes of the files the user already has, and the open archive
+_known_hashes = frozenset()
+_archive = None
+
+
+def wanted(name):
+    """Supported files, without hidden files and macOS resource forks"""
+    basename = name.rsplit('/', 1)[-1]
+    return allowed_file(basename) and not basename.startswith('.') and '__MACOSX/' not in name
+
+
+def iter_entries(source):
+    """Yield ``(name, size)`` of the supported files of a directory or zip archive, names with '/' separators"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, source).replace(os.sep, '/')
+                if wanted(name):
+                    yield name, os.path.getsize(path)
+    else:
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and wanted(info.filename):
+                    yield info.filename, info.file_size
+
+
+def init_worker(source, known_hashes):
+    global _known_hashes, _archive
+    _known_hashes = known_hashes
+    _archive = None if os.path.isdir(source) else zipfile.ZipFile(source)
+    # Database connections inherited from the parent process must not be shared
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def prepare_entry(source, name, file_path):
+    """
+    Copy one file to ``file_path`` in the upload folder and extract it, in a worker process
+
+    Returns:
+        dict: What ``save_batch`` writes, or ``skipped`` when the user already
+        has a file with the same content
+    """
+    if _archive is not None:
+        with _archive.open(name) as entry:
+            data = entry.read()
+    else:
+        with open(os.path.join(source, *name.split('/')), 'rb') as entry:
+            data = entry.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if sha256 in _known_hashes:
+        return {'name': name, 'sha256': sha256, 'size': len(data), 'skipped': True}
+
+    with open(file_path, 'wb') as out:
+        out.write(data)
+    filename = name.rsplit('/', 1)[-1]
+    try:
+        with app.app_context():
+            chunks, new_pages = extract_document(file_path, filename)
+        content = ''.join(text for _, text in chunks)
+        first_page = chunks[0][1] if new_pages is not None and chunks else None
+        return {
+            'name': name,
+            'sha256': sha256,
+            'size': len(data),
+            'filename': filename,
+            'file_path': file_path,
+            'chunks': chunks,
+            'new_pages': new_pages or {},
+            'bibliography': read_bibliography(file_path, filename, content, first_page),
+            'signature': minhash(content),
+            'terms': index_terms(filename, chunk_terms.counts(chunks)[0])
+        }
+    except Exception:
+        # A file that cannot be extracted is never saved, so its copy must not stay behind
+        os.remove(file_path)
+        raise
+
+
+def save_batch(user_id, batch):
+    """Write prepared files as the user's documents in one transaction"""
+    pages = {}
+    try:
+        for item in batch:
+            document, _ = add_document_rows(
+                user_id, item['filename'], os.path.basename(item['file_path']), item['file_path'],
+                item['chunks'], item['bibliography'], item['signature'], item['terms']
+            )
+            db.session.add(IngestedFile(document_id=document.id, user_id=user_id, sha256=item['sha256'], source=item['name']))
+            pages.update(item['new_pages'])
+        save_page_texts(pages)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for item in batch:
+            if os.path.exists(item['file_path']):
+                os.remove(item['file_path'])
+        raise
+
+
+class IngestStats:
+    """Counts and throughput of an ingestion run"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ingested = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        files = self.ingested + self.skipped + self.failed
+        return (
+            f"{self.ingested} ingested, {self.skipped} skipped, {self.failed} failed in {elapsed:.1f}s - "
+            f"{files / elapsed:.1f} files/s, {self.bytes / elapsed / 1_000_000:.2f} MB/s"
+        )
+
+
+def ingest(source, user_id, workers, batch_size):
+    """Ingest every supported file of ``source`` as documents of the user"""
+    known_hashes = frozenset(sha256 for (sha256,) in db.session.query(IngestedFile.sha256).filter_by(user_id=user_id))
+    prefix = datetime.now().strftime('%Y%m%d_%H%M%S_')
+    stats = IngestStats()
+    seen = set()
+    batch = []
+
+    def flush():
+        try:
+            save_batch(user_id, batch)
+        except Exception as e:
+            # save_batch rolled back and removed the batch's files; later batches still run
+            print(f"Error saving a batch of {len(batch)} files: {e}")
+            stats.failed += len(batch)
+        else:
+            stats.ingested += len(batch)
+        batch.clear()
+
+    def collect(future, name):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Error ingesting {name}: {e}")
+            stats.failed += 1
+            return
+        stats.bytes += result['size']
+        if result.get('skipped') or result['sha256'] in seen:
+            # Same content as an earlier file; only the first one is kept
+            if not result.get('skipped'):
+                os.remove(result['file_path'])
+            stats.skipped += 1
+            return
+        seen.add(result['sha256'])
+        batch.append(result)
+        if len(batch) >= batch_size:
+            flush()
+            print(stats.report())
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(source, known_hashes)) as executor:
+        pending = {}
+        for index, (name, _) in enumerate(iter_entries(source)):
+            if len(pending) >= workers * QUEUED_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                # In submission order, so batches and the copy of duplicates kept do not depend on set order
+                for future in [future for future in pending if future in done]:
+                    collect(future, pending.pop(future))
+            filename = secure_filename(name.rsplit('/', 1)[-1]) or 'document'
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{prefix}{index:05d}_{filename}")
+            pending[executor.submit(prepare_entry, source, name, file_path)] = name
+        for future in list(pending):
+            collect(future, pending.pop(future))
+
+    if batch:
+        flush()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest a directory or zip archive of documents for one user')
+    parser.add_argument('source', help='Directory or zip archive of PDF, DOCX and TXT files')
+    parser.add_argument('--user', required=True, help='Username the documents are attributed to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Extraction worker processes')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per database transaction')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source) and not zipfile.is_zipfile(args.source):
+        print(f"Error: {args.source} is neither a directory nor a zip archive")
+        return 1
+
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(username=args.user).first()
+        if not user:
+            print(f"Error: user '{args.user}' not found")
+            return 1
+
+        stats = ingest(args.source, user.id, max(1, args.workers), max(1, args.batch_size))
+    print(f"Done: {stats.report()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
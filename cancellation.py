@@ -0,0 +1,73 @@
+"""
+Cancellation of answers nobody will read.
+
+A chat session has at most one answer in progress: asking again in the same
+session supersedes the previous answer. Its handle is cancelled and the
+request generating it stops reading from LM Studio, which closes the
+upstream connection and ends the generation, unless identical requests
+are still following it. Client disconnects are handled where they are
+detected (the streaming loops and the ASGI app) by the same means.
+"""
+
+import threading
+
+from metrics import metrics
+
+
+class Generation:
+    """Cancellation handle of the answer a chat session is generating"""
+
+    def __init__(self, key):
+        self.key = key
+        self.flight = None  # Set when this request leads the generation
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def should_stop(self):
+        """Cancelled, and no identical request is following the generation"""
+        return self.cancelled and not (self.flight is not None and self.flight.followers)
+
+
+class SessionGenerations:
+    """The latest answer in progress per chat session"""
+
+    def __init__(self, flights):
+        """
+        Args:
+            flights (SingleFlight): Registry of the generations being shared
+        """
+        self.flights = flights
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        """Register a new answer for session ``key``, superseding the one in progress"""
+        generation = Generation(key)
+        with self._lock:
+            previous = self._active.get(key)
+            self._active[key] = generation
+
+        if previous is not None:
+            previous.cancel()
+            metrics.increment('llm.superseded')
+            # A re-ask of the same question must lead a fresh generation,
+            # not follow the one that is about to stop
+            if previous.flight is not None and not previous.flight.followers:
+                self.flights.forget(previous.flight)
+        return generation
+
+    def finish(self, generation):
+        with self._lock:
+            if self._active.get(generation.key) is generation:
+                del self._active[generation.key]
+
+    def in_progress(self):
+        with self._lock:
+            return len(self._active)
@@ -0,0 +1,152 @@
+"""
+Chunks of document text, for reusing work across versions of a document.
+
+A PDF is chunked by page and a page is keyed by a hash of what its text is
+extracted from (its content stream and fonts, and the extractor), so pages
+that did not change between two uploads are recognized before any text is
+extracted. Other formats are chunked by content: a chunk ends after a word
+whose hash hits a fixed pattern, so an edit only moves the boundaries near
+it and the rest of the chunks keep their hashes.
+
+Work derived from a chunk is kept by its key: the extracted text of PDF pages
+in the database, and the index terms of every chunk in ``ChunkTerms``.
+"""
+
+import hashlib
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+import PyPDF2
+
+from text_analyzer import analyze
+
+# Content-defined chunks: a boundary follows a word whose CRC32 is 0 modulo
+# CHUNK_BOUNDARY_MODULUS, once the chunk has CHUNK_MIN_CHARS; never longer than CHUNK_MAX_CHARS
+CHUNK_MIN_CHARS = 512
+CHUNK_MAX_CHARS = 4096
+CHUNK_BOUNDARY_MODULUS = 128
+# Chunks whose index terms are kept analyzed
+CHUNK_TERMS_CACHE_SIZE = 20000
+
+_WORD = re.compile(r'\S+\s*')
+
+
+def chunk_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def content_chunks(text):
+    """
+    Split a text into content-defined chunks
+
+    Returns:
+        list: The chunks, whose concatenation is ``text``
+    """
+    chunks = []
+    start = 0
+    for match in _WORD.finditer(text or ''):
+        end = match.end()
+        size = end - start
+        word = match.group().rstrip()
+        if size >= CHUNK_MAX_CHARS or (
+                size >= CHUNK_MIN_CHARS and zlib.crc32(word.encode('utf-8')) % CHUNK_BOUNDARY_MODULUS == 0):
+            chunks.append(text[start:end])
+            start = end
+    if start < len(text or ''):
+        chunks.append(text[start:])
+    return chunks
+
+
+def pdf_page_key(page, extractor_version=0):
+    """Hash of what a PDF page's text is extracted from, and how"""
+    digest = hashlib.sha1(f"PyPDF2 {PyPDF2.__version__} {extractor_version}\n".encode('utf-8'))
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    resources = page.get('/Resources')
+    fonts = resources.get_object().get('/Font') if resources is not None else None
+    if fonts is not None:
+        for name, font in sorted(fonts.get_object().items()):
+            font = font.get_object()
+            digest.update(f"\n{name} {font.get('/BaseFont')} {font.get('/Encoding')}".encode('utf-8'))
+            to_unicode = font.get('/ToUnicode')
+            if to_unicode is not None:
+                digest.update(to_unicode.get_object().get_data())
+    return digest.hexdigest()
+
+
+def pdf_page_keys(file_path, extractor_version=0):
+    """Keys of every page of a PDF; empty if it cannot be read"""
+    try:
+        with open(file_path, 'rb') as file:
+            return [pdf_page_key(page, extractor_version) for page in PyPDF2.PdfReader(file).pages]
+    except Exception as e:
+        print(f"Error reading PDF pages: {e}")
+        return []
+
+
+def extract_pdf_pages(file_path, page_numbers):
+    """Extracted text of the given pages of a PDF, by page number"""
+    texts = {}
+    try:
+        with open(file_path, 'rb') as file:
+            pages = PyPDF2.PdfReader(file).pages
+            for number in page_numbers:
+                texts[number] = pages[number].extract_text()
+    except Exception as e:
+        print(f"Error extracting PDF: {e}")
+    return texts
+
+
+def diff_chunks(previous, current):
+    """
+    Compare the chunk keys of two versions of a document
+
+    Returns:
+        dict: Number of chunks ``unchanged`` (present in both, counted in
+        ``current``), ``added`` and ``removed``
+    """
+    previous_counts = Counter(previous)
+    current_counts = Counter(current)
+    unchanged = sum((previous_counts & current_counts).values())
+    return {
+        'unchanged': unchanged,
+        'added': len(current) - unchanged,
+        'removed': len(previous) - unchanged
+    }
+
+
+class ChunkTerms:
+    """Index terms of chunks by key, analyzed once and then cached"""
+
+    def __init__(self, cache_size=CHUNK_TERMS_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # chunk key -> Counter of terms
+        self._lock = threading.Lock()
+
+    def counts(self, chunks):
+        """
+        Term frequencies of a text given as ``(key, text)`` chunks
+
+        Returns:
+            tuple: ``(Counter, reused)``, the number of chunks found in the cache
+        """
+        total = Counter()
+        reused = 0
+        for key, text in chunks:
+            with self._lock:
+                counts = self._cache.get(key)
+                if counts is not None:
+                    self._cache.move_to_end(key)
+            if counts is None:
+                counts = Counter(analyze(text))
+                with self._lock:
+                    self._cache[key] = counts
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            else:
+                reused += 1
+            total.update(counts)
+        return total, reused
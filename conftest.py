@@ -0,0 +1,42 @@
+"""
+Tests that import the app run it on a throwaway database and upload folder
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix='document_summarizer_tests_')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_data_dir, 'test.db')}")
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_data_dir, 'uploads'))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Empty tables and in-memory indexes, inside an app context"""
+    import app as tess
+    from document_index import UserIndexStore
+    from near_duplicates import DuplicateIndex
+    from related_papers import RelatedPapers
+
+    monkeypatch.setattr(tess, 'user_document_indexes', UserIndexStore(tess.user_document_indexes.loader))
+    monkeypatch.setattr(tess, 'related_papers', RelatedPapers(tess.related_papers.loader, top_n=tess.related_papers.top_n))
+    monkeypatch.setattr(tess, 'duplicate_index', DuplicateIndex(tess.duplicate_index.loader, threshold=tess.duplicate_index.threshold))
+    with tess.app.app_context():
+        tess.db.drop_all()
+        tess.db.create_all()
+        yield tess.db
+        tess.db.session.remove()
+
+
+@pytest.fixture
+def admin(database):
+    """Id of an admin user"""
+    import app as tess
+
+    user = tess.User(username='admin', email='admin@example.com', role='admin')
+    user.set_password('rahasia')
+    database.session.add(user)
+    database.session.commit()
+    return user.id
@@ -0,0 +1,137 @@
+"""
+Per-session conversation memory.
+
+Each chat session keeps a rolling window of recent turns bounded by an
+estimated token budget. Turns that fall out of the window are folded into a
+compact running summary, so the prompt stays bounded no matter how long the
+conversation or its answers get. Memories are cached in-process, which lets
+``/ask`` build its history without querying ``ChatHistory``.
+"""
+
+import re
+import threading
+from collections import OrderedDict, deque
+
+# Rough token estimate for Indonesian/English text (~4 characters per token)
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in ``text``"""
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+def clip_to_tokens(text, max_tokens):
+    """Clip ``text`` to roughly ``max_tokens`` tokens, on a word boundary if possible"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    clipped = text[:max_chars]
+    if ' ' in clipped:
+        clipped = clipped.rsplit(' ', 1)[0]
+    return clipped + '...'
+
+
+def first_sentence(text, max_chars=200):
+    """Return the first sentence of ``text``, capped at ``max_chars``"""
+    sentence = _SENTENCE_END.split(text.strip(), 1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rsplit(' ', 1)[0] + '...'
+    return sentence
+
+
+class ConversationMemory:
+    """Rolling token-bounded window of turns plus a summary of older turns"""
+
+    def __init__(self, window_tokens=1500, answer_tokens=300, summary_tokens=300):
+        self.window_tokens = window_tokens
+        self.answer_tokens = answer_tokens
+        self.summary_tokens = summary_tokens
+        self.turns = deque()
+        self.summary_lines = deque()
+        self._window_size = 0
+        self._summary_size = 0
+        self._lock = threading.Lock()
+
+    def add_turn(self, message, response):
+        """Add a question/answer pair, folding old turns into the summary as needed"""
+        turn = (message, clip_to_tokens(response, self.answer_tokens))
+        with self._lock:
+            self.turns.append(turn)
+            self._window_size += self._turn_tokens(turn)
+
+            # Always keep the latest turn verbatim, even if it alone exceeds the window
+            while self._window_size > self.window_tokens and len(self.turns) > 1:
+                oldest = self.turns.popleft()
+                self._window_size -= self._turn_tokens(oldest)
+                self._fold_into_summary(*oldest)
+
+    def history(self):
+        """Return the windowed turns as ``(message, response)`` pairs, oldest first"""
+        with self._lock:
+            return list(self.turns)
+
+    @property
+    def summary(self):
+        with self._lock:
+            return "\n".join(self.summary_lines)
+
+    def _turn_tokens(self, turn):
+        return estimate_tokens(turn[0]) + estimate_tokens(turn[1])
+
+    def _fold_into_summary(self, message, response):
+        line = f"- Pertanyaan: {first_sentence(message, 150)} Jawaban: {first_sentence(response)}"
+        self.summary_lines.append(line)
+        self._summary_size += estimate_tokens(line)
+
+        # The summary is itself bounded: the oldest lines are forgotten first
+        while self._summary_size > self.summary_tokens and len(self.summary_lines) > 1:
+            self._summary_size -= estimate_tokens(self.summary_lines.popleft())
+
+
+class MemoryStore:
+    """Thread-safe LRU cache of ``ConversationMemory`` objects keyed by session"""
+
+    def __init__(self, max_sessions=1000, **memory_options):
+        self.max_sessions = max_sessions
+        self.memory_options = memory_options
+        self._memories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached memory for ``key`` or None"""
+        with self._lock:
+            memory = self._memories.get(key)
+            if memory is not None:
+                self._memories.move_to_end(key)
+            return memory
+
+    def load(self, key, turns):
+        """Build and cache a memory for ``key`` by replaying ``turns`` (oldest first)"""
+        memory = ConversationMemory(**self.memory_options)
+        for message, response in turns:
+            memory.add_turn(message, response)
+
+        with self._lock:
+            # Another request may have loaded the same session meanwhile
+            existing = self._memories.get(key)
+            if existing is not None:
+                self._memories.move_to_end(key)
+                return existing
+            self._memories[key] = memory
+            while len(self._memories) > self.max_sessions:
+                self._memories.popitem(last=False)
+        return memory
+
+    def evict(self, key):
+        """Drop the cached memory for ``key``"""
+        with self._lock:
+            self._memories.pop(key, None)
+
+    def evict_user(self, user_id):
+        """Drop all cached memories belonging to ``user_id``"""
+        with self._lock:
+            for key in [key for key in self._memories if key[0] == user_id]:
+                del self._memories[key]
@@ -0,0 +1,114 @@
+"""
+End-to-end request deadlines.
+
+A deadline is set once at the edge, from the ``X-Request-Timeout`` header or
+the endpoint's default, and travels with the request. Retrieval, context
+packing, the wait for an LM Studio slot and the generation all spend from
+the same budget: each stage is timed when it ends and the request fails
+fast with a 504 as soon as too little time is left for a useful answer,
+instead of holding a worker (and an LM Studio slot) for an answer the
+client will not wait for. The generation gets whatever time remains: the
+read timeout is cut to it, and so is max_tokens, at the observed decode rate.
+"""
+
+import math
+import time
+
+from llm_client import LLMTimeoutError
+from metrics import metrics
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+
+class DeadlineExceeded(LLMTimeoutError):
+    """The request's deadline passed, or would pass, during ``stage``"""
+
+    def __init__(self, stage, budget):
+        super().__init__(f"Request deadline of {budget:g}s exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget of one request, spent stage by stage"""
+
+    def __init__(self, budget):
+        """
+        Args:
+            budget (float): Seconds from now until the request must be answered
+        """
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self._stage_started_at = self.started_at
+
+    def remaining(self):
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def exceeded(self, stage):
+        """The error for a request that ran out of time in ``stage``"""
+        metrics.increment(f'deadline.exceeded.{stage}')
+        return DeadlineExceeded(stage, self.budget)
+
+    def check(self, stage, reserve=0.0):
+        """
+        End ``stage``: record how long it took and make sure the request can still finish
+
+        Args:
+            stage (str): Name of the stage that just ended
+            reserve (float): Seconds the remaining stages need at least
+
+        Raises:
+            DeadlineExceeded: If no more than ``reserve`` seconds are left
+        """
+        now = time.monotonic()
+        metrics.observe(f'deadline.{stage}', now - self._stage_started_at)
+        self._stage_started_at = now
+        if self.expires_at - now <= reserve:
+            raise self.exceeded(stage)
+
+    def wait_limit(self, limit, reserve=0.0):
+        """How long the next wait may last: at most ``limit``, leaving ``reserve`` seconds"""
+        return min(limit, self.expires_at - time.monotonic() - reserve)
+
+    def fit_tokens(self, max_tokens, tokens_per_second, min_tokens):
+        """
+        Cut ``max_tokens`` to what can be generated in the time left
+
+        Raises:
+            DeadlineExceeded: If not even ``min_tokens`` can be generated
+        """
+        fit = math.floor(self.remaining() * tokens_per_second)
+        if fit < min_tokens:
+            raise self.exceeded('generation')
+        return min(max_tokens, fit)
+
+
+def parse_deadline(value, default, maximum):
+    """
+    Deadline of a request from its ``X-Request-Timeout`` header
+
+    Args:
+        value (str): The header value in seconds, or None when absent
+        default (float): The endpoint's deadline
+        maximum (float): Upper bound for client-chosen deadlines
+
+    Returns:
+        Deadline: Starting now
+
+    Raises:
+        ValueError: If the value is not a positive number
+    """
+    if value is None or not value.strip():
+        return Deadline(default)
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:
+        raise ValueError(f"{DEADLINE_HEADER} must be a positive number of seconds")
+    return Deadline(min(seconds, maximum))
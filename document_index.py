@@ -0,0 +1,143 @@
+"""
+Per-user lexical (BM25) index over uploaded documents.
+
+The index is built once per user from the term frequencies stored with
+each document at upload, without analyzing any content again, and then kept
+up to date incrementally, so ranking a question against a user's documents
+only touches the postings of the question terms.
+"""
+
+import math
+import threading
+from collections import Counter
+
+from text_analyzer import analyze
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def encode_terms(counts):
+    """Term frequencies as compact text: analyzed terms hold neither spaces nor colons"""
+    return ' '.join(f"{term}:{frequency}" for term, frequency in counts.items())
+
+
+def decode_terms(text):
+    return Counter({term: int(frequency) for term, frequency in (pair.rsplit(':', 1) for pair in text.split())})
+
+
+class DocumentIndex:
+    """BM25 inverted index over the documents of a single user"""
+
+    def __init__(self):
+        self.postings = {}  # term -> {document_id: term frequency}
+        self.lengths = {}   # document_id -> number of tokens
+        self.terms = {}     # document_id -> indexed terms, for removal
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, document_id, text, counts=None):
+        """Index (or re-index) a document; ``counts`` are its term frequencies when already analyzed"""
+        if counts is None:
+            counts = Counter(analyze(text))
+        with self._lock:
+            self._remove(document_id)
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, {})[document_id] = frequency
+            length = sum(counts.values())
+            self.terms[document_id] = list(counts)
+            self.lengths[document_id] = length
+            self.total_length += length
+
+    def remove(self, document_id):
+        """Drop a document from the index"""
+        with self._lock:
+            self._remove(document_id)
+
+    def search(self, query, limit=3):
+        """
+        Rank indexed documents against a query
+
+        Args:
+            query (str): Free-text query
+            limit (int): Maximum number of results
+
+        Returns:
+            list: ``(document_id, score)`` pairs, best first, only positive scores
+        """
+        terms = set(analyze(query))
+        with self._lock:
+            count = len(self.lengths)
+            if not count or not terms:
+                return []
+            average_length = self.total_length / count or 1
+
+            scores = Counter()
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for document_id, frequency in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[document_id] / average_length)
+                    scores[document_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        return [(document_id, score) for document_id, score in scores.most_common(limit) if score > 0]
+
+    def _remove(self, document_id):
+        length = self.lengths.pop(document_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.terms.pop(document_id):
+            del self.postings[term][document_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+
+class UserIndexStore:
+    """In-process ``DocumentIndex`` per user, loaded on first use"""
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader (callable): ``loader(user_id)`` returning ``(document_id, term counts)`` pairs
+        """
+        self.loader = loader
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the user's index, building it from the stored term counts on first use"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            return index
+
+        index = DocumentIndex()
+        for document_id, counts in self.loader(user_id):
+            index.add(document_id, None, counts)
+
+        with self._lock:
+            return self._indexes.setdefault(user_id, index)
+
+    def add_document(self, user_id, document_id, content, counts=None):
+        """Index a new document if the user's index has already been built"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.add(document_id, content, counts)
+
+    def remove_document(self, user_id, document_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove(document_id)
+
+    def drop_user(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def search(self, user_id, query, limit=3):
+        return self.get(user_id).search(query, limit)
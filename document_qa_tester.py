@@ -9,7 +9,13 @@ import httpx
 import os
 import time
 import json
-from text_extractor import extract_text
+import uuid
+from types import SimpleNamespace
+from text_extractor import extract_text_from_file
+from collections import Counter
+from prompt_builder import format_document_context, build_messages, build_warmup_messages
+from prompt_compression import CompressionStats, compress_passage
+from text_analyzer import analyze
 
 # Default API endpoint
 DEFAULT_API_ENDPOINT = "http://127.0.0.1:1234"
@@ -67,7 +73,7 @@ def test_model_on_document(document_path, questions, system_prompt=None, tempera
     
     # Extract document text
     print(f"Extracting text from {document_path}...")
-    document_text = extract_text(document_path)
+    document_text, _ = extract_text_from_file(document_path)
     document_name = os.path.basename(document_path)
     
     print(f"\nDocument: {document_name}")
@@ -145,6 +151,161 @@ Berikan jawaban yang informatif dan akurat berdasarkan konten dokumen di atas.""
     
     print(f"\nTest results saved to {output_file}")
 
+def measure_time_to_first_token(messages, endpoint=DEFAULT_API_ENDPOINT, model=DEFAULT_MODEL, max_tokens=32):
+    """
+    Stream a completion and measure time-to-first-token
+    
+    Args:
+        messages (list): Chat messages to send
+        endpoint (str): API endpoint URL
+        model (str): Model identifier
+        max_tokens (int): Generation limit (kept small, only the first token matters)
+        
+    Returns:
+        float: Seconds until the first content delta arrived
+    """
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.0,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    
+    start_time = time.time()
+    with httpx.stream("POST", f"{endpoint}/v1/chat/completions", json=data, timeout=60.0) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            delta = json.loads(line[len("data: "):])["choices"][0].get("delta", {})
+            if delta.get("content"):
+                return time.time() - start_time
+    return time.time() - start_time
+
+def benchmark_prompt_cache(document_path, question, runs=3, endpoint=DEFAULT_API_ENDPOINT, model=DEFAULT_MODEL):
+    """
+    Compare time-to-first-token with a cold prompt cache and after a warm-up call
+    
+    Every run uses a fresh nonce in the document name so the cold measurement
+    cannot hit a prefix cached by a previous run.
+    
+    Args:
+        document_path (str): Path to document file
+        question (str): Question to ask about the document
+        runs (int): Number of cold/warm pairs to measure
+        endpoint (str): API endpoint URL
+        model (str): Model identifier
+    """
+    print(f"Extracting text from {document_path}...")
+    document_text, _ = extract_text_from_file(document_path)
+    document_name = os.path.basename(document_path)
+    
+    def make_context():
+        document = SimpleNamespace(id=1, original_filename=f"{document_name} [{uuid.uuid4().hex[:8]}]", content=document_text)
+        return format_document_context([document])
+    
+    cold_times = []
+    warm_times = []
+    
+    for run in range(1, runs + 1):
+        # Cold: the document prefix has never been seen by the backend
+        documents_content = make_context()
+        cold = measure_time_to_first_token(build_messages(documents_content, question), endpoint, model)
+        cold_times.append(cold)
+        
+        # Warm: prime the prefix with max_tokens=1 first, as /upload does
+        documents_content = make_context()
+        httpx.post(
+            f"{endpoint}/v1/chat/completions",
+            json={"model": model, "messages": build_warmup_messages(documents_content), "max_tokens": 1},
+            timeout=60.0
+        )
+        warm = measure_time_to_first_token(build_messages(documents_content, question), endpoint, model)
+        warm_times.append(warm)
+        
+        print(f"[{run}/{runs}] TTFT cold: {cold:.3f}s, warm: {warm:.3f}s")
+    
+    avg_cold = sum(cold_times) / len(cold_times)
+    avg_warm = sum(warm_times) / len(warm_times)
+    print(f"\nAverage TTFT cold: {avg_cold:.3f}s")
+    print(f"Average TTFT warm: {avg_warm:.3f}s")
+    if avg_cold > 0:
+        print(f"Improvement: {(1 - avg_warm / avg_cold) * 100:.1f}%")
+
+def token_f1(prediction, reference):
+    """Token-level F1 between two answers, used as a cheap quality proxy"""
+    prediction_tokens = Counter(analyze(prediction))
+    reference_tokens = Counter(analyze(reference))
+    overlap = sum((prediction_tokens & reference_tokens).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(prediction_tokens.values())
+    recall = overlap / sum(reference_tokens.values())
+    return 2 * precision * recall / (precision + recall)
+
+def evaluate_compression(document_path, questions, ratios, endpoint=DEFAULT_API_ENDPOINT, model=DEFAULT_MODEL):
+    """
+    Show the latency/quality tradeoff of extractive prompt compression
+    
+    Each question is answered with the uncompressed passage first; answers at
+    lower ratios are scored by token F1 against that baseline answer.
+    
+    Args:
+        document_path (str): Path to document file
+        questions (list): List of questions to ask
+        ratios (list): Compression ratios to compare, e.g. [1.0, 0.7, 0.5]
+        endpoint (str): API endpoint URL
+        model (str): Model identifier
+    """
+    print(f"Extracting text from {document_path}...")
+    document_text, _ = extract_text_from_file(document_path)
+    document_name = os.path.basename(document_path)
+    passage = document_text[:10000]
+    
+    ratios = sorted(set(ratios) | {1.0}, reverse=True)
+    totals = {ratio: {"latency": 0.0, "tokens_saved": 0, "f1": 0.0} for ratio in ratios}
+    results = []
+    
+    for i, question in enumerate(questions, 1):
+        print(f"\n[{i}/{len(questions)}] {question}")
+        baseline = None
+        
+        for ratio in ratios:
+            stats = CompressionStats(ratio)
+            compressed = compress_passage(passage, question, ratio, stats)
+            messages = build_messages(f"Document: {document_name}\nContent: {compressed}", question)
+            
+            start_time = time.time()
+            response = httpx.post(
+                f"{endpoint}/v1/chat/completions",
+                json={"model": model, "messages": messages, "temperature": 0.0, "max_tokens": 1000},
+                timeout=60.0
+            )
+            latency = time.time() - start_time
+            response.raise_for_status()
+            answer = response.json()["choices"][0]["message"]["content"]
+            
+            if baseline is None:
+                baseline = answer
+            f1 = token_f1(answer, baseline)
+            
+            totals[ratio]["latency"] += latency
+            totals[ratio]["tokens_saved"] += stats.tokens_saved
+            totals[ratio]["f1"] += f1
+            results.append({"question": question, "response": answer, "latency": latency, "f1": f1, **stats.to_dict()})
+            print(f"  ratio {ratio:.2f}: {latency:.2f}s, tokens saved {stats.tokens_saved}, F1 vs baseline {f1:.2f}")
+    
+    print(f"\n{'Ratio':>6} {'Avg latency':>12} {'Avg tokens saved':>17} {'Avg F1':>7}")
+    for ratio in ratios:
+        n = len(questions)
+        print(f"{ratio:>6.2f} {totals[ratio]['latency'] / n:>11.2f}s {totals[ratio]['tokens_saved'] / n:>17.0f} {totals[ratio]['f1'] / n:>7.2f}")
+    
+    output_file = f"compression_results_{os.path.splitext(document_name)[0]}_{int(time.time())}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nCompression results saved to {output_file}")
+
 def main():
     parser = argparse.ArgumentParser(description='Test model responses on documents')
     parser.add_argument('document', help='Path to document file')
@@ -156,9 +317,24 @@ def main():
     parser.add_argument('--temperature', type=float, default=0.7, help='Temperature for generation')
     parser.add_argument('--endpoint', default=DEFAULT_API_ENDPOINT, help='LM Studio API endpoint')
     parser.add_argument('--model', default=DEFAULT_MODEL, help='Model identifier')
+    parser.add_argument('--benchmark-cache', action='store_true',
+                        help='Measure time-to-first-token with and without prompt cache warm-up')
+    parser.add_argument('--runs', type=int, default=3, help='Number of benchmark runs')
+    parser.add_argument('--compression-ratios',
+                        help='Comma separated compression ratios to evaluate, e.g. 1.0,0.7,0.5')
     
     args = parser.parse_args()
     
+    if args.benchmark_cache:
+        benchmark_prompt_cache(
+            document_path=args.document,
+            question=PAPER_TEST_QUESTIONS[2],
+            runs=args.runs,
+            endpoint=args.endpoint,
+            model=args.model
+        )
+        return
+    
     # Select question set based on type
     if args.type == 'paper':
         questions = PAPER_TEST_QUESTIONS
@@ -180,6 +356,16 @@ def main():
             print(f"Error loading custom questions: {e}")
             return
     
+    if args.compression_ratios:
+        evaluate_compression(
+            document_path=args.document,
+            questions=questions,
+            ratios=[float(ratio) for ratio in args.compression_ratios.split(',')],
+            endpoint=args.endpoint,
+            model=args.model
+        )
+        return
+    
     # Run tests
     test_model_on_document(
         document_path=args.document,
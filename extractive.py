@@ -0,0 +1,169 @@
+"""
+Extractive answers for when LM Studio cannot answer.
+
+Without an LLM the best answer is the documents' own text: the passages that
+rank highest for the question (BM25 over passages of a few sentences of the
+selected documents), with the sentences that match it best highlighted.
+Nothing is generated, so the answer is marked as extractive. Each document
+is split and analyzed once and then cached, so answering takes milliseconds.
+"""
+
+import hashlib
+import math
+import threading
+from collections import Counter, OrderedDict
+
+from document_index import BM25_B, BM25_K1
+from prompt_compression import score_sentences, split_sentences
+from text_analyzer import analyze
+
+# Passages are whole sentences, about this many characters each
+PASSAGE_CHARS = 600
+# Highlighted sentences per passage
+HIGHLIGHTS_PER_PASSAGE = 2
+# Documents whose passages are kept analyzed
+PASSAGE_CACHE_SIZE = 256
+
+EXTRACTIVE_NOTICE = (
+    "Jawaban ekstraktif: LM Studio sedang tidak tersedia, jadi berikut kutipan dokumen yang paling relevan "
+    "tanpa diolah AI. Kalimat yang paling sesuai dengan pertanyaan ditebalkan."
+)
+FAST_MODE_NOTICE = (
+    "Jawaban ekstraktif (mode cepat): berikut kutipan dokumen yang paling relevan tanpa diolah AI. "
+    "Kalimat yang paling sesuai dengan pertanyaan ditebalkan."
+)
+NO_PASSAGES_RESPONSE = "Tidak ditemukan bagian dokumen yang relevan dengan pertanyaan ini."
+
+
+class Passage:
+    """A run of consecutive sentences of one document, with its index terms"""
+
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.terms = Counter(analyze(" ".join(sentences)))
+        self.length = sum(self.terms.values())
+
+
+def split_passages(text, passage_chars=PASSAGE_CHARS):
+    """Group a document's sentences into passages of about ``passage_chars`` characters"""
+    passages = []
+    current = []
+    size = 0
+    for sentence in split_sentences(text or ''):
+        current.append(sentence)
+        size += len(sentence) + 1
+        if size >= passage_chars:
+            passages.append(Passage(current))
+            current = []
+            size = 0
+    if current:
+        passages.append(Passage(current))
+    return passages
+
+
+class ExtractiveAnswerer:
+    """Ranks passages of documents against a question"""
+
+    def __init__(self, passages=3, cache_size=PASSAGE_CACHE_SIZE):
+        """
+        Args:
+            passages (int): Passages returned per answer
+            cache_size (int): Documents whose analyzed passages are cached
+        """
+        self.passages = passages
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (document id, content hash) -> passages
+        self._lock = threading.Lock()
+
+    def document_passages(self, document):
+        """The analyzed passages of a document, from the cache when its content is unchanged"""
+        content = document.content or ''
+        key = (document.id, hashlib.sha1(content.encode('utf-8')).hexdigest())
+        with self._lock:
+            passages = self._cache.get(key)
+            if passages is not None:
+                self._cache.move_to_end(key)
+                return passages
+        passages = split_passages(content)
+        with self._lock:
+            self._cache[key] = passages
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return passages
+
+    def answer(self, question, documents):
+        """
+        Find the passages that best answer a question
+
+        Args:
+            question (str): The user's question
+            documents (iterable): Objects with ``id``, ``original_filename`` and ``content``
+
+        Returns:
+            list: Dicts with ``document_id``, ``filename``, ``text``, the
+            ``highlights`` (best matching sentences) and ``score``, best first;
+            only passages sharing terms with the question
+        """
+        candidates = [
+            (document, passage)
+            for document in documents
+            for passage in self.document_passages(document)
+        ]
+        terms = set(analyze(question))
+        if not candidates or not terms:
+            return []
+
+        # BM25 with statistics over the candidate passages
+        count = len(candidates)
+        average_length = sum(passage.length for _, passage in candidates) / count or 1
+        frequency = Counter()
+        for _, passage in candidates:
+            frequency.update(terms.intersection(passage.terms))
+        idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in frequency.items()}
+
+        scored = []
+        for document, passage in candidates:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * passage.length / average_length)
+            score = 0.0
+            for term, weight in idf.items():
+                tf = passage.terms.get(term)
+                if tf:
+                    score += weight * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, document, passage))
+        scored.sort(key=lambda item: -item[0])
+
+        return [self._result(question, score, document, passage) for score, document, passage in scored[:self.passages]]
+
+    def _result(self, question, score, document, passage):
+        sentence_scores = score_sentences(passage.sentences, question)
+        ranked = sorted(range(len(passage.sentences)), key=lambda i: (-sentence_scores[i], i))
+        highlighted = {i for i in ranked[:HIGHLIGHTS_PER_PASSAGE] if sentence_scores[i] > 0}
+        return {
+            'document_id': document.id,
+            'filename': document.original_filename,
+            'text': " ".join(
+                f"**{sentence}**" if i in highlighted else sentence
+                for i, sentence in enumerate(passage.sentences)
+            ),
+            'highlights': [passage.sentences[i] for i in sorted(highlighted)],
+            'score': round(score, 4)
+        }
+
+
+def format_extractive_answer(passages, requested=False):
+    """
+    Render ranked passages as the answer text
+
+    Args:
+        passages (list): Output of ``ExtractiveAnswerer.answer``
+        requested (bool): The client asked for the fast mode (rather than LM Studio being unavailable)
+    """
+    notice = FAST_MODE_NOTICE if requested else EXTRACTIVE_NOTICE
+    if not passages:
+        return f"{notice}\n\n{NO_PASSAGES_RESPONSE}"
+    quotes = "\n\n".join(
+        f"[{number}] {passage['filename']}:\n{passage['text']}"
+        for number, passage in enumerate(passages, 1)
+    )
+    return f"{notice}\n\n{quotes}"
@@ -0,0 +1,118 @@
+"""
+Stand-in for an LM Studio server, for trying out the backend pool locally.
+
+Serves the OpenAI-compatible ``/v1/models`` and ``/v1/chat/completions``
+endpoints (streaming and non-streaming) and echoes the question back (or
+fills in a JSON-schema ``response_format``), with configurable latency and
+failure modes. Example with two backends, one slow:
+
+    python fake_lm_studio.py --port 1234
+    python fake_lm_studio.py --port 1235 --latency 2
+    LM_STUDIO_URLS=http://127.0.0.1:1234/v1/chat/completions,http://127.0.0.1:1235/v1/chat/completions python app.py
+"""
+
+import argparse
+import json
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeLMStudioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set from the command line
+    model = 'fake-model'
+    latency = 0.0
+    token_delay = 0.02
+    status = 200
+    no_model = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/v1/models':
+            self.send_json(404, {'error': 'Not found'})
+        elif self.status != 200:
+            self.send_json(self.status, {'error': 'Simulated failure'})
+        else:
+            self.send_json(200, {'data': [] if self.no_model else [{'id': self.model, 'object': 'model'}]})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        if self.status != 200:
+            self.send_json(self.status, {'error': 'Simulated failure'})
+            return
+
+        time.sleep(self.latency)
+        question = payload.get('messages', [{}])[-1].get('content', '')
+        answer = f"Jawaban dari {self.model} untuk: {question[:80]}"
+        schema = (payload.get('response_format') or {}).get('json_schema', {}).get('schema')
+        if schema:
+            # Structured output: one answer per property, as /full-analysis asks for
+            answer = json.dumps({key: f"Jawaban dari {self.model} untuk {key}" for key in schema.get('properties', {})})
+
+        if not payload.get('stream'):
+            self.send_json(200, {
+                'model': self.model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}]
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for word in answer.split(' '):
+                chunk = {'choices': [{'index': 0, 'delta': {'content': word + ' '}}]}
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(self.token_delay)
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI-compatible LM Studio server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    parser.add_argument('--model', default='fake-model', help='Model id to report')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each completion starts')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Seconds between streamed tokens')
+    parser.add_argument('--status', type=int, default=200, help='Answer every request with this status')
+    parser.add_argument('--no-model', action='store_true', help='Report no loaded model')
+    args = parser.parse_args()
+
+    FakeLMStudioHandler.model = args.model
+    FakeLMStudioHandler.latency = args.latency
+    FakeLMStudioHandler.token_delay = args.token_delay
+    FakeLMStudioHandler.status = args.status
+    FakeLMStudioHandler.no_model = args.no_model
+
+    print(f"Fake LM Studio ({args.model}) on http://{args.host}:{args.port}/v1")
+    ThreadingHTTPServer((args.host, args.port), FakeLMStudioHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Batched answering of the predefined questions for a document.
+
+Instead of one request per predefined question, the document context is
+sent once with every selected question and the model is asked for a JSON
+object mapping question ids to answers. The prompt keeps the same stable
+prefix as ``prompt_builder.build_messages`` (system prompt, then document
+context), so LM Studio can reuse its cache for follow-up questions.
+
+Models do not always return clean JSON: the reply may be wrapped in code
+fences or prose, use a list instead of an object, be cut off at the token
+limit, or ignore the format and answer as a numbered list or in "id: answer"
+lines. ``parse_answers`` recovers every complete answer it can find.
+"""
+
+import json
+import re
+
+from prompt_builder import build_messages
+
+ANALYSIS_INSTRUCTIONS = """Jawab semua pertanyaan berikut berdasarkan dokumen di atas.
+Balas hanya dengan satu objek JSON tanpa teks lain. Kunci objek adalah id pertanyaan dan nilainya adalah jawaban (string) dalam bahasa Indonesia yang jelas dan ringkas.
+
+Pertanyaan:
+{questions}
+
+Format balasan:
+{example}"""
+
+# Matches one complete "key": "string value" pair, for replies that are not valid JSON
+_PAIR_PATTERN = re.compile(r'"([A-Za-z0-9_\-]+)"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+_FENCE_PATTERN = re.compile(r'^```[A-Za-z]*\s*|\s*```$')
+_TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+# Plain-text replies: "1. answer" items, and "label: answer" lines (labels may be bold or bulleted)
+_NUMBERED_PATTERN = re.compile(r'^[ \t]*(\d+)[.)][ \t]+', re.MULTILINE)
+_LABEL_PATTERN = re.compile(r'^[ \t]*(?:[-*\u2022][ \t]*)?\**([^:\n*]+?)\**[ \t]*:\**[ \t]*', re.MULTILINE)
+
+
+def build_analysis_messages(documents_content, questions):
+    """
+    Build the chat messages asking every question in one request
+
+    Args:
+        documents_content (str): Output of ``format_document_context``
+        questions (list): ``(question id, question)`` pairs
+
+    Returns:
+        list: OpenAI-compatible chat messages
+    """
+    listed = "\n".join(f"- {question_id}: {question}" for question_id, question in questions)
+    example = json.dumps({question_id: "..." for question_id, _ in questions}, ensure_ascii=False)
+    return build_messages(documents_content, ANALYSIS_INSTRUCTIONS.format(questions=listed, example=example))
+
+
+def response_format(question_ids):
+    """JSON schema ``response_format`` constraining the reply to one string per question id"""
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'paper_analysis',
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {question_id: {'type': 'string'} for question_id in question_ids},
+                'required': list(question_ids),
+                'additionalProperties': False
+            }
+        }
+    }
+
+
+def _load_json(text):
+    """Decode the JSON value in a reply, or None"""
+    text = _FENCE_PATTERN.sub('', text.strip())
+    candidates = [text]
+    # The outermost object or list, whichever opens first
+    openers = [(text.find(opener), opener, closer) for opener, closer in (('{', '}'), ('[', ']')) if opener in text]
+    if openers:
+        start, _, closer = min(openers)
+        end = text.rfind(closer)
+        if start < end:
+            candidates.append(text[start:end + 1])
+
+    for candidate in candidates:
+        for attempt in (candidate, _TRAILING_COMMA_PATTERN.sub(r'\1', candidate)):
+            try:
+                return json.loads(attempt)
+            except ValueError:
+                continue
+    return None
+
+
+def _as_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        return "\n".join(f"- {_as_text(item)}" for item in value)
+    if isinstance(value, dict):
+        return "\n".join(f"{key}: {_as_text(item)}" for key, item in value.items())
+    return str(value)
+
+
+def _answers_from_value(value):
+    """``{key: answer}`` from a decoded reply in any of the shapes models produce"""
+    if isinstance(value, dict):
+        # {"answers": {...}} or {"answers": [...]}
+        if len(value) == 1 and isinstance(next(iter(value.values())), (dict, list)):
+            nested = _answers_from_value(next(iter(value.values())))
+            if nested:
+                return nested
+        return {str(key): _as_text(answer) for key, answer in value.items()}
+    if isinstance(value, list):
+        answers = {}
+        for item in value:
+            if isinstance(item, dict):
+                key = item.get('id') or item.get('question_id') or item.get('question')
+                if key is not None:
+                    answers[str(key)] = _as_text(item.get('answer', item.get('jawaban')))
+        return answers
+    return {}
+
+
+def _split_at(text, matches):
+    """``(match, text up to the next match)`` for each match, in order"""
+    return [
+        (match, text[match.end():matches[index + 1].start() if index + 1 < len(matches) else len(text)].strip())
+        for index, match in enumerate(matches)
+    ]
+
+
+def _answers_from_lines(text, questions):
+    """``{key: answer}`` from a reply that is not JSON at all"""
+    labels = {label.lower() for question in questions for label in question}
+    labelled = [match for match in _LABEL_PATTERN.finditer(text) if match.group(1).strip().lower() in labels]
+    if labelled:
+        return {match.group(1).strip(): answer for match, answer in _split_at(text, labelled)}
+
+    answers = {}
+    for match, answer in _split_at(text, list(_NUMBERED_PATTERN.finditer(text))):
+        number = int(match.group(1))
+        if 1 <= number <= len(questions):
+            question_id, question = questions[number - 1]
+            # The item may repeat the question or its id before answering it
+            for label in (question, question_id):
+                if answer.lower().startswith(label.lower()):
+                    answer = answer[len(label):].lstrip(' *:\n')
+                    break
+            answers[question_id] = answer
+    if not answers and len(questions) == 1:
+        answers[questions[0][0]] = text.strip()
+    return answers
+
+
+def parse_answers(text, questions):
+    """
+    Extract the answers from a model reply
+
+    Args:
+        text (str): The raw reply
+        questions (list): ``(question id, question)`` pairs that were asked
+
+    Returns:
+        dict: Question id -> answer for every question answered; ids with no
+        (or an empty) answer are left out
+    """
+    value = _load_json(text or '')
+    found = _answers_from_value(value) if value is not None else {}
+    if not found:
+        # Invalid or truncated JSON: keep every complete "id": "answer" pair
+        for key, raw in _PAIR_PATTERN.findall(text or ''):
+            try:
+                found[key] = json.loads(f'"{raw}"').strip()
+            except ValueError:
+                found[key] = raw.strip()
+    if not found and value is None:
+        # No JSON at all: a numbered list in question order, "id: answer" lines, or a lone answer
+        found = _answers_from_lines(text or '', questions)
+
+    # Keys may be the id or the question text itself
+    normalized = {key.strip().lower(): answer for key, answer in found.items()}
+    answers = {}
+    for question_id, question in questions:
+        answer = normalized.get(question_id.lower()) or normalized.get(question.strip().lower())
+        if answer:
+            answers[question_id] = answer
+    return answers
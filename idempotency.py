@@ -0,0 +1,168 @@
+"""
+Idempotency keys for retried requests.
+
+Clients that retry after a timeout send the same ``Idempotency-Key`` header
+with every attempt. The first request with a key does the work and its
+response is kept for a TTL; later requests with the key get that response
+replayed, and one that arrives while the work is still running waits for
+it instead of starting it again. Keys are scoped per user and endpoint, and
+reusing a key for a different request is refused.
+
+Responses that failed on the server side (5xx, 429, or a stream ending in an
+"error" event) are not kept, so the retry runs the request again. Entries
+live in memory, like jobs, and do not survive a restart.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# Response headers replayed along with the status and body
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Cache-Control')
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def fingerprint(method, path, query, content_type, body):
+    """
+    Hash of what a request asks for, stable across retries of it
+
+    JSON bodies are compared by value; multipart bodies without their
+    boundary, which clients pick anew for every attempt.
+    """
+    if content_type.startswith('application/json'):
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode('utf-8')
+        except ValueError:
+            pass
+    elif content_type.startswith('multipart/form-data') and 'boundary=' in content_type:
+        boundary = content_type.split('boundary=', 1)[1].split(';', 1)[0].strip('"')
+        body = body.replace(boundary.encode('latin-1'), b'')
+    digest = hashlib.sha256(f"{method} {path}?{query}\n".encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def stream_failed(body):
+    """True if an event stream ended with an "error" event"""
+    last_event = body.rstrip().rsplit(b'\n\n', 1)[-1]
+    return last_event.startswith(b'event: error')
+
+
+class StoredResponse:
+    """The outcome of the first request with a key, once it has one"""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.finished = False
+        self.response = None  # (status, headers, body), unless the request failed
+        self._done = threading.Event()
+        self._waiters = []  # (loop, future) of coroutines waiting for the outcome
+        self._lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        """Block until the first request finished; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """``wait`` for coroutines"""
+        with self._lock:
+            if self.finished:
+                return True
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.finished
+
+    def _finish(self, response):
+        with self._lock:
+            if self.finished:
+                return False
+            self.finished = True
+            self.response = response
+            waiters, self._waiters = self._waiters, []
+        self._done.set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        return True
+
+
+class IdempotencyStore:
+    """Responses by (user, endpoint, key), kept ``ttl`` seconds"""
+
+    def __init__(self, ttl=86400.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, scope, fingerprint):
+        """
+        Claim ``scope`` for a request, or find the request that already did
+
+        Args:
+            scope (tuple): ``(user id, endpoint, idempotency key)``
+            fingerprint (str): Output of ``fingerprint`` for the request
+
+        Returns:
+            tuple: ``(entry, leader)``; the leader runs the request and must
+            ``complete`` or ``abandon`` the entry, others compare fingerprints
+            and wait for it
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(scope)
+            if entry is not None and not (entry.finished and entry.response is None):
+                metrics.increment('idempotency.duplicates')
+                return entry, False
+            entry = StoredResponse(fingerprint)
+            self._entries[scope] = entry
+            self._entries.move_to_end(scope)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry, True
+
+    def complete(self, entry, status, headers, body):
+        """Keep the leader's response for replay, unless it failed on the server side"""
+        failed = status >= 500 or status == 429 or (
+            headers.get('Content-Type', '').startswith('text/event-stream') and stream_failed(body)
+        )
+        if failed:
+            self.abandon(entry)
+        elif entry._finish((status, headers, body)):
+            metrics.increment('idempotency.stored')
+
+    def abandon(self, entry):
+        """
+        Release the key of a request that failed or was cut off
+
+        Waiting duplicates wake up and one of them runs the request again.
+        Does nothing once the entry completed.
+        """
+        entry._finish(None)
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        while self._entries:
+            scope, entry = next(iter(self._entries.items()))
+            if entry.created_at >= cutoff:
+                return
+            del self._entries[scope]
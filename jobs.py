@@ -0,0 +1,267 @@
+"""
+In-process background jobs.
+
+A job runs on a worker thread and appends results as it goes. Clients poll
+its state or follow the results as they arrive, from threads (Flask) or
+coroutines (FastAPI). Jobs live in memory: finished jobs are dropped after
+a TTL and none of them survive a restart.
+
+``run_bounded`` fans a job out over many items with a fixed number of
+worker threads, recording each item's result as soon as it finishes.
+``ByteRateLimiter`` paces the file reads of jobs that walk the whole corpus.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Job:
+    """State and results of one background job"""
+
+    def __init__(self, kind, owner_id, total=None, params=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner_id = owner_id
+        self.total = total
+        self.params = params or {}
+        self.status = QUEUED
+        self.error = None
+        self.results = []
+        self.cancel_requested = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, future) of coroutines waiting for a change
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def add_result(self, result):
+        with self._cond:
+            self.results.append(result)
+            self._notify()
+
+    def cancel(self):
+        """Ask the job to stop; items already running still finish"""
+        self.cancel_requested = True
+
+    def wait_results(self, start=0, timeout=None):
+        """
+        Wait until there are results past ``start`` or the job is finished
+
+        Returns:
+            tuple: ``(new results, finished)``; no results if ``timeout`` expired
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.results) > start or self.done, timeout)
+            return self.results[start:], self.done
+
+    async def wait_results_async(self, start=0, timeout=None):
+        """``wait_results`` for coroutines"""
+        with self._cond:
+            if len(self.results) > start or self.done:
+                return self.results[start:], self.done
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            return self.results[start:], self.done
+
+    def wait(self, timeout=None):
+        """Block until the job is finished; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    async def wait_async(self, timeout=None):
+        """``wait`` for coroutines"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self.done:
+                    return True
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return self.done
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                return self.done
+
+    def to_dict(self, results=True):
+        with self._cond:
+            data = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'error': self.error,
+                'total': self.total,
+                'completed': len(self.results),
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at
+            }
+            if results:
+                data['results'] = list(self.results)
+        return data
+
+    def _set_status(self, status, error=None):
+        with self._cond:
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED:
+                self.error = error
+                self.finished_at = time.time()
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._waiters = []
+
+
+class JobStore:
+    """Runs jobs on a bounded thread pool and keeps them until ``ttl`` seconds after they finish"""
+
+    def __init__(self, workers=2, ttl=3600.0):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def submit(self, job, fn, *args):
+        """Queue ``fn(job, *args)``; it records results on the job and its exceptions fail it"""
+        self._expire()
+        with self._lock:
+            self._jobs[job.id] = job
+        metrics.increment(f'jobs.{job.kind}.submitted')
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        """The job, or None if it is unknown or expired"""
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def snapshot(self):
+        self._expire()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def _run(self, job, fn, args):
+        if job.cancel_requested:
+            job._set_status(CANCELLED)
+            return
+        job._set_status(RUNNING)
+        try:
+            fn(job, *args)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            metrics.increment(f'jobs.{job.kind}.failed')
+            job._set_status(FAILED, str(e))
+            return
+        job._set_status(CANCELLED if job.cancel_requested else DONE)
+        metrics.observe(f'jobs.{job.kind}.run_time', job.finished_at - job.started_at)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+def run_bounded(job, items, handle, concurrency):
+    """
+    Run ``handle(item, worker)`` for every item on ``concurrency`` threads
+
+    Each returned result is added to the job as soon as it is ready; an
+    exception becomes an ``{'item', 'error'}`` result. Items not started yet
+    are skipped once the job is cancelled. ``worker`` is the index of the
+    thread, stable for all the items it handles.
+    """
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+
+    def work(worker):
+        while not job.cancel_requested:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = handle(item, worker)
+            except Exception as e:
+                logger.exception("Job %s failed on %r", job.id, item)
+                result = {'item': item, 'error': str(e)}
+            job.add_result(result)
+
+    threads = [
+        threading.Thread(target=work, args=(worker,), name=f'job-{job.id[:8]}-{worker}', daemon=True)
+        for worker in range(max(1, min(concurrency, len(items))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ByteRateLimiter:
+    """Paces reads shared by several threads to ``rate`` bytes per second on average"""
+
+    def __init__(self, rate):
+        """
+        Args:
+            rate (float): Bytes per second; 0 or None for no limit
+        """
+        self.rate = rate
+        self._available = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """Wait until ``size`` more bytes may be read"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._available, now)
+            self._available = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
@@ -0,0 +1,197 @@
+"""
+Pool of OpenAI-compatible LLM backends (LM Studio instances).
+
+Each request goes to the healthy backend with the lowest expected wait:
+outstanding requests plus one, times an EWMA of the backend's response
+latency, so traffic is balanced by load and steered away from slow nodes.
+A background thread probes every backend's ``/v1/models`` endpoint; a
+backend is removed from rotation when a probe fails (or after repeated
+request failures) and re-added as soon as a probe succeeds again.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Consecutive request failures before a backend is taken out of rotation
+UNHEALTHY_AFTER_FAILURES = 3
+
+# Weight of the newest observation in the latency EWMA
+LATENCY_ALPHA = 0.3
+
+
+class BackendProbeError(Exception):
+    """The backend answered the models probe with an error status or a malformed payload"""
+
+
+def probe_models(base_url, timeout=5, session=None):
+    """
+    List the models served by an OpenAI-compatible backend
+
+    Args:
+        base_url (str): API root, e.g. ``http://127.0.0.1:1234/v1``
+        timeout (float): Request timeout in seconds
+        session (requests.Session): Optional session to reuse
+
+    Returns:
+        list: Model ids (empty if the server runs without a loaded model)
+
+    Raises:
+        requests.exceptions.RequestException: If the backend cannot be reached
+        BackendProbeError: If it answers with an error or an unexpected payload
+    """
+    response = (session or requests).get(f"{base_url.rstrip('/')}/models", timeout=timeout)
+    if response.status_code != 200:
+        raise BackendProbeError(f"status {response.status_code}")
+    try:
+        return [model['id'] for model in response.json().get('data') or []]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise BackendProbeError(f"malformed models response: {e}")
+
+
+def api_root(url):
+    """``http://host:port/v1`` for a ``.../v1/chat/completions`` URL"""
+    suffix = '/chat/completions'
+    return url[:-len(suffix)] if url.endswith(suffix) else url.rstrip('/')
+
+
+class Backend:
+    """One chat completions endpoint and its routing state"""
+
+    def __init__(self, url):
+        self.url = url
+        self.base_url = api_root(url)
+        self.healthy = True
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.last_error = None
+        self.models = []
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'latency': self.latency,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'models': self.models
+        }
+
+
+class BackendPool:
+    """Health-checked, least-loaded selection among LLM backends"""
+
+    def __init__(self, urls, probe_interval=10.0, probe_timeout=5.0, unhealthy_after=UNHEALTHY_AFTER_FAILURES):
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("At least one backend URL is required")
+        self.backends = [Backend(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.unhealthy_after = unhealthy_after
+        self._session = requests.Session()
+        self._prober = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Pick the backend for a request and count it as outstanding; None if none is healthy"""
+        self.start()
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy]
+            if not healthy:
+                return None
+
+            # Backends without measurements yet count as fast as the fastest known one
+            known = [backend.latency for backend in healthy if backend.latency is not None]
+            default_latency = min(known) if known else 1.0
+
+            def expected_wait(backend):
+                latency = backend.latency if backend.latency is not None else default_latency
+                return (backend.outstanding + 1) * latency
+
+            best = min(map(expected_wait, healthy))
+            backend = random.choice([backend for backend in healthy if expected_wait(backend) == best])
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend, latency=None, error=None):
+        """
+        Finish a request on a backend
+
+        Args:
+            backend (Backend): The backend returned by ``acquire``
+            latency (float): Seconds until the backend responded, if it did
+            error (str): Description of a backend failure (connection error, 5xx)
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if latency is not None:
+                backend.latency = latency if backend.latency is None else (
+                    backend.latency + LATENCY_ALPHA * (latency - backend.latency)
+                )
+            if error is None:
+                backend.failures = 0
+                return
+            backend.failures += 1
+            backend.last_error = error
+            if backend.healthy and backend.failures >= self.unhealthy_after:
+                self._mark_unhealthy(backend, error)
+
+    def probe(self, backend):
+        """Check one backend and add it to or remove it from rotation"""
+        try:
+            models = probe_models(backend.base_url, self.probe_timeout, self._session)
+            error = None if models else "no model loaded"
+        except (requests.exceptions.RequestException, BackendProbeError) as e:
+            models, error = [], str(e)
+
+        with self._lock:
+            backend.models = models
+            if error is None:
+                if not backend.healthy:
+                    logger.info("LLM backend %s is healthy again", backend.url)
+                    metrics.increment('llm.backends.recovered')
+                backend.healthy = True
+                backend.failures = 0
+            else:
+                backend.last_error = error
+                if backend.healthy:
+                    self._mark_unhealthy(backend, error)
+
+    def probe_all(self):
+        for backend in self.backends:
+            self.probe(backend)
+
+    def start(self):
+        """Start the background health probes (once)"""
+        if self._prober is not None:
+            return
+        with self._lock:
+            if self._prober is not None:
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name='llm-backend-probe', daemon=True)
+        self._prober.start()
+
+    def snapshot(self):
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _mark_unhealthy(self, backend, error):
+        backend.healthy = False
+        logger.warning("LLM backend %s removed from rotation: %s", backend.url, error)
+        metrics.increment('llm.backends.removed')
+
+    def _probe_loop(self):
+        while True:
+            self.probe_all()
+            time.sleep(self.probe_interval)
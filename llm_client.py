@@ -0,0 +1,574 @@
+"""
+HTTP clients for the OpenAI-compatible LM Studio API.
+
+``LLMClient`` shares one pooled keep-alive ``requests.Session`` between all
+requests; ``AsyncLLMClient`` does the same with an ``httpx.AsyncClient`` for
+the ASGI app. Each attempt goes to a backend picked by the ``BackendPool``,
+so a retry can land on another LM Studio instance. Connect and read timeouts are separate, transient failures are
+retried with jittered exponential backoff, and a circuit breaker rejects
+requests immediately while the backend is down. Every failure surfaces as an
+``LLMError`` subclass, so callers can never mistake an error message for a
+generated answer.
+
+Closing a stream early (or cancelling an async request) closes the HTTP
+connection, which makes LM Studio stop generating. Such cancellations are
+counted with the token budget they freed.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from conversation_memory import estimate_tokens
+from llm_backends import BackendPool
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limited or the backend is (re)starting
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Base class for LLM backend failures"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMUnavailableError(LLMError):
+    """The backend cannot be reached or the circuit breaker is open"""
+
+
+class LLMTimeoutError(LLMError):
+    """The backend accepted the request but did not answer in time"""
+
+
+class LLMResponseError(LLMError):
+    """The backend answered with an error status or a malformed payload"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message, retry_after)
+        self.status_code = status_code
+
+
+class CircuitBreaker:
+    """
+    Classic closed/open/half-open circuit breaker
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests are rejected for ``reset_timeout`` seconds. Then a single trial
+    request is let through (half-open); its outcome closes or re-opens the
+    circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a request may be sent now"""
+        return self.permit()[0]
+
+    def permit(self):
+        """
+        Let a request through if the circuit allows it
+
+        Returns:
+            tuple: ``(allowed, trial)``; a request that is the half-open trial
+            must end in ``record_success``, ``record_failure`` or ``release_trial``
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True, False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True, True
+            return False, False
+
+    def release_trial(self):
+        """Free the half-open trial of a request that proved nothing either way (cancelled, or cut by a deadline)"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def retry_after(self):
+        """Seconds until the next trial request will be allowed"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def is_open(self):
+        with self._lock:
+            return self.state != self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("LLM circuit breaker opened after %d failures", self.failures)
+                    metrics.increment('llm.circuit_opened')
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class _BaseLLMClient:
+    """Configuration, payloads and retry policy shared by the sync and async clients"""
+
+    def __init__(self, backends, model='local-model', connect_timeout=3.05, read_timeout=30.0,
+                 max_retries=2, backoff_base=0.5, backoff_max=4.0, pool_size=20, breaker=None):
+        """
+        Args:
+            backends: A ``BackendPool``, or one or more chat completions URLs
+        """
+        self.backends = backends if isinstance(backends, BackendPool) else BackendPool(backends)
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+
+    def _payload(self, messages, max_tokens, temperature, params):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        payload.update(params)
+        return payload
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, honoring Retry-After when it is short enough"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _start_attempt(self, attempt, backend):
+        """
+        Reject the attempt while the circuit is open, giving ``backend`` back
+
+        Returns:
+            bool: Whether the attempt holds the half-open trial, which it must resolve
+        """
+        allowed, trial = self.breaker.permit()
+        if not allowed:
+            self.backends.release(backend)
+            metrics.increment('llm.rejected_circuit_open')
+            raise LLMUnavailableError(
+                "LM Studio is unavailable (circuit open)",
+                retry_after=self.breaker.retry_after()
+            )
+        if attempt:
+            metrics.increment('llm.retries')
+        return trial
+
+    def _acquire_backend(self):
+        backend = self.backends.acquire()
+        if backend is None:
+            metrics.increment('llm.backends.none_healthy')
+            raise LLMUnavailableError("No healthy LM Studio backend", retry_after=self.backends.probe_interval)
+        return backend
+
+    def _status_error(self, status_code, headers):
+        """Return the error for a non-200 status, raising it right away if it is not retryable"""
+        error = LLMResponseError(
+            f"LM Studio returned status code {status_code}",
+            status_code,
+            _parse_retry_after(headers.get('Retry-After'))
+        )
+        if status_code not in RETRYABLE_STATUS_CODES:
+            # Client errors (e.g. context too long) prove the backend is reachable
+            if status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            metrics.increment('llm.errors.status')
+            raise error
+        self.breaker.record_failure()
+        return error
+
+    def _connection_error(self, message):
+        self.breaker.record_failure()
+        return LLMUnavailableError(message)
+
+    def _release_failed(self, backend, status_code, latency):
+        """Return a non-200 backend to the pool; only 5xx responses count against its health"""
+        error = f"status {status_code}" if status_code >= 500 else None
+        self.backends.release(backend, latency, error)
+
+    def _record_cancelled(self, payload, received):
+        """Count a generation abandoned by its caller and the tokens it will no longer produce"""
+        metrics.increment('llm.cancelled')
+        metrics.increment('llm.cancelled_tokens', max(0, payload['max_tokens'] - estimate_tokens(''.join(received))))
+
+    def _attempt_timeout(self, read_timeout=None, deadline=None):
+        """
+        Read timeout of the next attempt: the override or default, cut to the time left before ``deadline``
+
+        Returns:
+            tuple: ``(timeout, cut)``, ``cut`` when the deadline shortened it
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed
+        """
+        timeout = read_timeout or self.read_timeout
+        if deadline is None:
+            return timeout, False
+        if deadline.expired:
+            raise deadline.exceeded('generation')
+        remaining = deadline.remaining()
+        return min(timeout, remaining), remaining < timeout
+
+    def _deadline_timeout(self, connect, timeout, cut):
+        """Whether a timeout of an attempt only means the request's deadline ran out, not that the backend is slow"""
+        return cut and (not connect or timeout < self.connect_timeout)
+
+    def _timeout_error(self, error, read_timeout=None):
+        # The backend is up but slow; retrying would only add load
+        self.breaker.record_failure()
+        metrics.increment('llm.errors.timeout')
+        return LLMTimeoutError(f"LM Studio did not respond within {read_timeout or self.read_timeout}s: {error}")
+
+
+class LLMClient(_BaseLLMClient):
+    """Pooled, retrying, circuit-broken client for chat completions"""
+
+    def __init__(self, backends, **options):
+        super().__init__(backends, **options)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def complete(self, messages, max_tokens=1000, temperature=0.7, read_timeout=None, deadline=None, **params):
+        """
+        Run a chat completion and return the generated text
+
+        ``read_timeout`` overrides the client's read timeout for this call. With
+        a request ``deadline`` (``deadline.Deadline``), reads time out when it
+        passes and no retry is started that could not finish before it.
+
+        Raises:
+            LLMError: On any backend failure, after retries
+        """
+        payload = self._payload(messages, max_tokens, temperature, params)
+        response, backend, latency = self._post(payload, read_timeout=read_timeout, deadline=deadline)
+        try:
+            return _completion_content(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Malformed LM Studio response: {e}", response.status_code)
+        finally:
+            response.close()
+            self.backends.release(backend, latency)
+
+    def stream(self, messages, max_tokens=1000, temperature=0.7, deadline=None, **params):
+        """
+        Run a streaming chat completion and yield content deltas
+
+        Only the initial request is retried; once content has been yielded a
+        failure is raised to the caller. Closing the generator before the end
+        aborts the generation upstream. ``deadline`` bounds the initial request
+        as for ``complete``.
+
+        Raises:
+            LLMError: On any backend failure
+        """
+        payload = self._payload(messages, max_tokens, temperature, params)
+        payload['stream'] = True
+        response, backend, latency = self._post(payload, stream=True, deadline=deadline)
+        error = None
+        received = []
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                done, content = _stream_content(line)
+                if done:
+                    break
+                if content:
+                    received.append(content)
+                    yield content
+        except GeneratorExit:
+            self._record_cancelled(payload, received)
+            raise
+        except requests.exceptions.Timeout as e:
+            if deadline is not None and deadline.expired:
+                raise deadline.exceeded('generation')
+            error = str(e)
+            self.breaker.record_failure()
+            raise LLMTimeoutError(f"LM Studio stream timed out: {e}")
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"LM Studio stream interrupted: {e}")
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Malformed LM Studio stream chunk: {e}", response.status_code)
+        finally:
+            response.close()
+            self.backends.release(backend, latency, error)
+
+    def _post(self, payload, stream=False, read_timeout=None, deadline=None):
+        """
+        POST with retries on transient errors, none past ``deadline``
+
+        Returns:
+            tuple: ``(response, backend, latency)`` for a 200 response; the
+            caller releases the backend once the body has been read
+
+        Raises:
+            LLMError: After the last failed attempt
+        """
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            # A request that cannot be sent must not take the half-open trial
+            timeout, cut = self._attempt_timeout(read_timeout, deadline)
+            backend = self._acquire_backend()
+            trial = self._start_attempt(attempt, backend)
+            start_time = time.monotonic()
+
+            try:
+                response = self.session.post(
+                    backend.url,
+                    json=payload,
+                    timeout=(min(self.connect_timeout, timeout), timeout),
+                    stream=stream
+                )
+            except requests.exceptions.Timeout as e:
+                connect = isinstance(e, requests.exceptions.ConnectTimeout)
+                if self._deadline_timeout(connect, timeout, cut):
+                    # The client's deadline, not the backend, ran out
+                    self.backends.release(backend)
+                    raise deadline.exceeded('generation')
+                self.backends.release(backend, error=str(e))
+                if not connect:
+                    raise self._timeout_error(e, timeout)
+                last_error = self._connection_error(f"Timed out connecting to LM Studio: {e}")
+            except requests.exceptions.RequestException as e:
+                self.backends.release(backend, error=str(e))
+                last_error = self._connection_error(f"Error connecting to LM Studio: {e}")
+            else:
+                latency = time.monotonic() - start_time
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response, backend, latency
+                response.close()
+                self._release_failed(backend, response.status_code, latency)
+                last_error = self._status_error(response.status_code, response.headers)
+            finally:
+                if trial:
+                    self.breaker.release_trial()
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, last_error.retry_after)
+                if deadline is not None and delay >= deadline.remaining():
+                    break
+                time.sleep(delay)
+
+        metrics.increment('llm.errors.unavailable')
+        raise last_error
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """
+    asyncio counterpart of ``LLMClient`` built on ``httpx.AsyncClient``
+
+    A waiting request costs a coroutine instead of a thread, so one worker
+    can hold many concurrent chats. At most ``pool_size`` requests are sent
+    to LM Studio at once; the rest wait for a free connection, up to the
+    read timeout.
+    """
+
+    def __init__(self, backends, **options):
+        super().__init__(backends, **options)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def complete(self, messages, max_tokens=1000, temperature=0.7, read_timeout=None, deadline=None, **params):
+        """
+        Run a chat completion and return the generated text
+
+        ``read_timeout`` and ``deadline`` bound the call as for ``LLMClient.complete``.
+
+        Raises:
+            LLMError: On any backend failure, after retries
+        """
+        payload = self._payload(messages, max_tokens, temperature, params)
+        try:
+            response, backend, latency = await self._post(payload, read_timeout=read_timeout, deadline=deadline)
+        except asyncio.CancelledError:
+            self._record_cancelled(payload, [])
+            raise
+        try:
+            return _completion_content(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Malformed LM Studio response: {e}", response.status_code)
+        finally:
+            self.backends.release(backend, latency)
+
+    async def stream(self, messages, max_tokens=1000, temperature=0.7, deadline=None, **params):
+        """
+        Run a streaming chat completion and yield content deltas
+
+        Only the initial request is retried; once content has been yielded a
+        failure is raised to the caller. Closing the generator before the end,
+        or cancelling its task, aborts the generation upstream. ``deadline``
+        bounds the initial request as for ``complete``.
+
+        Raises:
+            LLMError: On any backend failure
+        """
+        payload = self._payload(messages, max_tokens, temperature, params)
+        payload['stream'] = True
+        try:
+            response, backend, latency = await self._post(payload, stream=True, deadline=deadline)
+        except asyncio.CancelledError:
+            self._record_cancelled(payload, [])
+            raise
+        error = None
+        received = []
+        try:
+            async for line in response.aiter_lines():
+                done, content = _stream_content(line)
+                if done:
+                    break
+                if content:
+                    received.append(content)
+                    yield content
+        except (GeneratorExit, asyncio.CancelledError):
+            self._record_cancelled(payload, received)
+            raise
+        except httpx.TimeoutException as e:
+            if deadline is not None and deadline.expired:
+                raise deadline.exceeded('generation')
+            error = str(e)
+            self.breaker.record_failure()
+            raise LLMTimeoutError(f"LM Studio stream timed out: {e}")
+        except httpx.HTTPError as e:
+            error = str(e)
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"LM Studio stream interrupted: {e}")
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Malformed LM Studio stream chunk: {e}", response.status_code)
+        finally:
+            self.backends.release(backend, latency, error)
+            await response.aclose()
+
+    async def _post(self, payload, stream=False, read_timeout=None, deadline=None):
+        """Async version of ``LLMClient._post``"""
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            # A request that cannot be sent must not take the half-open trial
+            timeout, cut = self._attempt_timeout(read_timeout, deadline)
+            backend = self._acquire_backend()
+            trial = self._start_attempt(attempt, backend)
+            start_time = time.monotonic()
+
+            try:
+                request = self.client.build_request(
+                    'POST', backend.url, json=payload,
+                    timeout=httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+                )
+                response = await self.client.send(request, stream=stream)
+            except asyncio.CancelledError:
+                # The caller gave up; closing the connection stops the generation
+                self.backends.release(backend)
+                raise
+            except httpx.PoolTimeout as e:
+                # Our own connection limit, not a backend failure
+                self.backends.release(backend)
+                metrics.increment('llm.errors.pool_timeout')
+                raise LLMTimeoutError(f"No free LM Studio connection within {timeout:.1f}s: {e}")
+            except httpx.TimeoutException as e:
+                connect = isinstance(e, httpx.ConnectTimeout)
+                if self._deadline_timeout(connect, timeout, cut):
+                    # The client's deadline, not the backend, ran out
+                    self.backends.release(backend)
+                    raise deadline.exceeded('generation')
+                self.backends.release(backend, error=str(e))
+                if not connect:
+                    raise self._timeout_error(e, timeout)
+                last_error = self._connection_error(f"Timed out connecting to LM Studio: {e}")
+            except httpx.HTTPError as e:
+                self.backends.release(backend, error=str(e))
+                last_error = self._connection_error(f"Error connecting to LM Studio: {e}")
+            else:
+                latency = time.monotonic() - start_time
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response, backend, latency
+                await response.aclose()
+                self._release_failed(backend, response.status_code, latency)
+                last_error = self._status_error(response.status_code, response.headers)
+            finally:
+                # Cancellation and pool timeouts resolve nothing either way
+                if trial:
+                    self.breaker.release_trial()
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, last_error.retry_after)
+                if deadline is not None and delay >= deadline.remaining():
+                    break
+                await asyncio.sleep(delay)
+
+        metrics.increment('llm.errors.unavailable')
+        raise last_error
+
+
+def _completion_content(data):
+    return data['choices'][0]['message']['content']
+
+
+def _stream_content(line):
+    """Parse one SSE line of a streamed completion into ``(done, content)``"""
+    if not line or not line.startswith('data: '):
+        return False, None
+    data = line[len('data: '):]
+    if data == '[DONE]':
+        return True, None
+    return False, json.loads(data)['choices'][0].get('delta', {}).get('content')
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,65 @@
+"""
+In-process metrics: counters and timing distributions.
+
+Timings keep a bounded window of recent observations so percentiles reflect
+current behavior. Exposed to admins through ``/admin/metrics``.
+"""
+
+import threading
+from collections import Counter, deque
+
+# Number of recent observations kept per timing
+TIMING_WINDOW = 1000
+
+
+class Metrics:
+    """Thread-safe registry of counters and timings"""
+
+    def __init__(self, window=TIMING_WINDOW):
+        self.window = window
+        self._counters = Counter()
+        self._timings = {}
+        self._totals = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value):
+        """Record one observation (seconds for timings)"""
+        with self._lock:
+            if name not in self._timings:
+                self._timings[name] = deque(maxlen=self.window)
+            self._timings[name].append(value)
+            self._totals[name] += 1
+
+    def percentile(self, name, q):
+        """Return the q-th percentile (0-100) of recent observations, or None"""
+        with self._lock:
+            values = sorted(self._timings.get(name, ()))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+    def snapshot(self):
+        """Return all counters and a summary of every timing"""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: (sorted(values), self._totals[name]) for name, values in self._timings.items()}
+
+        summary = {}
+        for name, (values, total) in timings.items():
+            if not values:
+                continue
+            summary[name] = {
+                'count': total,
+                'avg': sum(values) / len(values),
+                'p50': values[len(values) // 2],
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'max': values[-1]
+            }
+        return {'counters': counters, 'timings': summary}
+
+
+metrics = Metrics()
@@ -0,0 +1,184 @@
+"""
+Near-duplicate documents by MinHash and locality-sensitive hashing.
+
+Re-exported PDFs of the same thesis, revised versions and copies differ in
+bytes but share most of their word sequences. Each document gets a MinHash
+signature of its 5-word shingles at ingest, computed with one-permutation
+hashing (one hash per shingle, split into bins, empty bins densified by
+rotation), so it costs one pass over the text. The fraction of equal
+signature entries estimates the Jaccard similarity of two shingle sets.
+
+The LSH index splits signatures into bands; documents sharing any band
+bucket are candidates, and only candidates are compared. With 32 bands of 4
+rows, a pair at 0.8 Jaccard becomes a candidate with probability above
+0.9999 and a pair at 0.2 with 0.05, and a lookup costs 32 bucket reads
+whatever the size of the corpus.
+"""
+
+import hashlib
+import threading
+
+from text_analyzer import tokenize
+
+SHINGLE_WORDS = 5
+NUM_HASHES = 128
+LSH_BANDS = 32
+# Estimated Jaccard similarity from which documents count as near-duplicates
+DUPLICATE_THRESHOLD = 0.8
+
+_HASH_BITS = 64
+# Offset added per bin skipped when an empty bin borrows a neighbour's value
+_ROTATION_OFFSET = (1 << _HASH_BITS) // NUM_HASHES + 1
+
+
+def shingle_hashes(text, size=SHINGLE_WORDS):
+    """64-bit hashes of the runs of ``size`` consecutive words of a text"""
+    words = tokenize(text or '')
+    if not words:
+        return set()
+    windows = (words[i:i + size] for i in range(max(1, len(words) - size + 1)))
+    return {
+        int.from_bytes(hashlib.blake2b(' '.join(window).encode('utf-8'), digest_size=8).digest(), 'big')
+        for window in windows
+    }
+
+
+def minhash(text, num_hashes=NUM_HASHES):
+    """
+    One-permutation MinHash signature of a text's shingles
+
+    Returns:
+        tuple: ``num_hashes`` integers, or None for a text without words
+    """
+    bins = [None] * num_hashes
+    for value in shingle_hashes(text):
+        index, rest = value % num_hashes, value // num_hashes
+        if bins[index] is None or rest < bins[index]:
+            bins[index] = rest
+    if all(value is None for value in bins):
+        return None
+
+    # An empty bin takes the value of the next non-empty one to its right,
+    # offset by the distance so borrowed values stay distinct from native ones
+    signature = []
+    for index in range(num_hashes):
+        distance = 0
+        while bins[(index + distance) % num_hashes] is None:
+            distance += 1
+        signature.append(bins[(index + distance) % num_hashes] + distance * _ROTATION_OFFSET)
+    return tuple(signature)
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def encode_signature(signature):
+    return ','.join(format(value, 'x') for value in signature)
+
+
+def decode_signature(text):
+    return tuple(int(value, 16) for value in text.split(','))
+
+
+class DuplicateIndex:
+    """LSH index over the MinHash signatures of every document"""
+
+    def __init__(self, loader, bands=LSH_BANDS, threshold=DUPLICATE_THRESHOLD):
+        """
+        Args:
+            loader (callable): ``loader()`` returning ``(document_id, owner_id, signature)`` for every document
+            bands (int): LSH bands; the signature length must be a multiple of it
+            threshold (float): Default similarity from which documents are reported
+        """
+        self.loader = loader
+        self.bands = bands
+        self.threshold = threshold
+        self._built = False
+        self._signatures = {}  # document_id -> signature
+        self._owners = {}      # document_id -> owner id
+        self._buckets = {}     # (band, rows) -> {document_id}
+        self._lock = threading.RLock()
+
+    def find(self, signature, threshold=None, exclude=None):
+        """
+        Documents whose signatures are similar to ``signature``
+
+        Args:
+            signature (tuple): Output of ``minhash``
+            threshold (float): Minimum estimated similarity, default the index's
+            exclude (int): Document left out, usually the one the signature belongs to
+
+        Returns:
+            list: ``(document_id, owner_id, similarity)``, most similar first
+        """
+        if signature is None:
+            return []
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            self._ensure_built()
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            candidates.discard(exclude)
+            matches = [
+                (document_id, self._owners[document_id], similarity(signature, self._signatures[document_id]))
+                for document_id in candidates
+            ]
+        matches = [match for match in matches if match[2] >= threshold]
+        matches.sort(key=lambda match: (-match[2], match[0]))
+        return matches
+
+    def duplicates_of(self, document_id, threshold=None):
+        """``find`` for an indexed document"""
+        with self._lock:
+            self._ensure_built()
+            signature = self._signatures.get(document_id)
+        return self.find(signature, threshold, exclude=document_id)
+
+    def add_document(self, document_id, owner_id, signature):
+        """Index a new document's signature if the index has already been built"""
+        with self._lock:
+            if self._built:
+                self._add(document_id, owner_id, signature)
+
+    def remove_document(self, document_id):
+        with self._lock:
+            self._remove(document_id)
+
+    def remove_owner(self, owner_id):
+        """Drop every document of a deleted user"""
+        with self._lock:
+            for document_id in [document_id for document_id, owner in self._owners.items() if owner == owner_id]:
+                self._remove(document_id)
+
+    def _ensure_built(self):
+        if not self._built:
+            for document_id, owner_id, signature in self.loader():
+                self._add(document_id, owner_id, signature)
+            self._built = True
+
+    def _band_keys(self, signature):
+        rows = len(signature) // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def _add(self, document_id, owner_id, signature):
+        self._remove(document_id)
+        if signature is None:
+            return
+        self._signatures[document_id] = signature
+        self._owners[document_id] = owner_id
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(document_id)
+
+    def _remove(self, document_id):
+        signature = self._signatures.pop(document_id, None)
+        if signature is None:
+            return
+        del self._owners[document_id]
+        for key in self._band_keys(signature):
+            bucket = self._buckets[key]
+            bucket.discard(document_id)
+            if not bucket:
+                del self._buckets[key]
@@ -0,0 +1,93 @@
+"""
+Prompt assembly for LM Studio requests.
+
+LM Studio (llama.cpp) reuses its KV cache for the longest prompt prefix it has
+already processed. To make that prefix as long and as stable as possible every
+prompt is laid out as:
+
+    system prompt -> document context (sorted by document id)
+        -> conversation summary -> history -> question
+
+Anything that changes between turns (history, the question) comes last.
+"""
+
+SYSTEM_PROMPT = """Anda adalah asisten AI yang membantu menganalisis dokumen akademik, khususnya paper penelitian dan informasi tentang Universitas Negeri Semarang (UNNES).
+
+Tugas Anda:
+1. Berikan jawaban yang akurat dan informatif berdasarkan dokumen yang diberikan
+2. Fokus pada aspek akademik dan penelitian
+3. Jika ditanya tentang UNNES, berikan informasi yang relevan
+4. Berikan jawaban dalam bahasa Indonesia yang jelas dan mudah dipahami
+
+Konteks dokumen:"""
+
+# Number of characters of each document that is sent as context
+DOCUMENT_CONTEXT_CHARS = 2000
+
+# User message sent when priming the cache; only the prefix before it matters
+WARMUP_MESSAGE = "."
+
+# The running summary of older turns is replayed as a user/assistant pair so
+# chat templates that require alternating roles keep working
+SUMMARY_HEADER = "Ringkasan percakapan sebelumnya:"
+SUMMARY_ACK = "Baik, saya akan memperhatikan ringkasan percakapan tersebut."
+
+
+def format_document_context(documents, compress=None):
+    """
+    Render documents as prompt context in a deterministic order
+
+    Args:
+        documents (iterable): Objects with ``id``, ``original_filename`` and ``content``
+        compress (callable): Optional ``compress(passage) -> str`` applied to each passage
+
+    Returns:
+        str: Document context, ordered by document id
+    """
+    ordered = sorted(documents, key=lambda doc: doc.id)
+    passages = [(doc.content or '')[:DOCUMENT_CONTEXT_CHARS] for doc in ordered]
+    if compress is not None:
+        passages = [compress(passage) for passage in passages]
+    return "\n\n".join([
+        f"Document: {doc.original_filename}\nContent: {passage}..."
+        for doc, passage in zip(ordered, passages)
+    ])
+
+
+def build_system_prompt(documents_content=""):
+    """Build the stable prefix: system prompt followed by document context"""
+    if documents_content:
+        return f"{SYSTEM_PROMPT}\n\n{documents_content}"
+    return SYSTEM_PROMPT
+
+
+def build_messages(documents_content, question, history=(), summary=""):
+    """
+    Build the chat messages for a question
+
+    Args:
+        documents_content (str): Output of ``format_document_context``
+        question (str): The user's question
+        history (iterable): ``(message, response)`` pairs, oldest first
+        summary (str): Running summary of turns older than ``history``
+
+    Returns:
+        list: OpenAI-compatible chat messages
+    """
+    messages = [{"role": "system", "content": build_system_prompt(documents_content)}]
+
+    if summary:
+        messages.append({"role": "user", "content": f"{SUMMARY_HEADER}\n{summary}"})
+        messages.append({"role": "assistant", "content": SUMMARY_ACK})
+
+    for message, response in history:
+        messages.append({"role": "user", "content": message})
+        messages.append({"role": "assistant", "content": response})
+
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def build_warmup_messages(documents_content):
+    """Build a minimal request whose prompt shares the stable prefix of ``build_messages``"""
+    return build_messages(documents_content, WARMUP_MESSAGE)
@@ -0,0 +1,118 @@
+"""
+Extractive prompt compression.
+
+Passages are split into sentences, each sentence is scored by the TF-IDF
+weight of the question terms it contains, and the lowest-scoring sentences
+are dropped until the passage is down to the requested ratio of its
+original length. Kept sentences stay in their original order.
+
+Compressed context depends on the question, so it does not share a cacheable
+prefix with other questions; it is meant for long passages where the saved
+prompt tokens outweigh the lost prompt cache reuse.
+"""
+
+import math
+import re
+from collections import Counter
+
+from conversation_memory import estimate_tokens
+from text_analyzer import analyze
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+
+
+class CompressionStats:
+    """Token accounting for one or more compressed passages"""
+
+    def __init__(self, ratio):
+        self.ratio = ratio
+        self.original_tokens = 0
+        self.compressed_tokens = 0
+
+    @property
+    def tokens_saved(self):
+        return self.original_tokens - self.compressed_tokens
+
+    def to_dict(self):
+        return {
+            'ratio': self.ratio,
+            'original_tokens': self.original_tokens,
+            'compressed_tokens': self.compressed_tokens,
+            'tokens_saved': self.tokens_saved
+        }
+
+
+def split_sentences(text):
+    """Split text into non-empty sentences"""
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+
+def score_sentences(sentences, question):
+    """
+    Score sentences by their TF-IDF overlap with the question
+
+    IDF is computed over the sentences of the passage, so question terms that
+    appear everywhere (e.g. the paper's main topic) count less than terms that
+    single out a few sentences.
+
+    Args:
+        sentences (list): Sentences of one passage
+        question (str): The user's question
+
+    Returns:
+        list: One score per sentence
+    """
+    question_terms = set(analyze(question))
+    sentence_terms = [Counter(analyze(sentence)) for sentence in sentences]
+    if not question_terms:
+        return [0.0] * len(sentences)
+
+    count = len(sentences)
+    document_frequency = Counter()
+    for terms in sentence_terms:
+        document_frequency.update(question_terms.intersection(terms))
+    idf = {term: math.log((1 + count) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+
+    scores = []
+    for terms in sentence_terms:
+        length = sum(terms.values()) or 1
+        scores.append(sum(terms[term] / length * weight for term, weight in idf.items()))
+    return scores
+
+
+def compress_passage(text, question, ratio, stats=None):
+    """
+    Drop the least relevant sentences of a passage
+
+    Args:
+        text (str): Passage to compress
+        question (str): The user's question
+        ratio (float): Target length as a fraction of the original (0 < ratio <= 1)
+        stats (CompressionStats): Optional accumulator for token counts
+
+    Returns:
+        str: The compressed passage
+    """
+    compressed = text
+    if ratio < 1:
+        sentences = split_sentences(text)
+        if len(sentences) > 1:
+            scores = score_sentences(sentences, question)
+            budget = len(text) * ratio
+
+            # Best sentences first; ties keep the earlier sentence
+            ranked = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))
+            kept = []
+            used = 0
+            for i in ranked:
+                if used + len(sentences[i]) > budget and kept:
+                    continue
+                kept.append(i)
+                used += len(sentences[i]) + 1
+
+            compressed = " ".join(sentences[i] for i in sorted(kept))
+
+    if stats is not None:
+        stats.original_tokens += estimate_tokens(text)
+        stats.compressed_tokens += estimate_tokens(compressed)
+    return compressed
@@ -0,0 +1,186 @@
+"""
+Routing of questions to model tiers.
+
+A question is classified by its predefined-question id when it has one,
+otherwise by keywords and length. Short factual questions ("who is the
+author?") go to the fast tier: a small model, a low token cap and
+temperature 0. Analytical ones ("critique the methodology") go to the large
+model with the full budget.
+
+Each tier's token cap adapts to what answers actually need: once enough
+outcomes are recorded, max_tokens follows the 95th percentile of observed
+answer lengths plus headroom, within the tier's bounds. Outcomes are also
+kept per tier for tuning the rules, and give each tier's generation rate,
+which request deadlines use to size max_tokens to the time left.
+"""
+
+import math
+import threading
+from collections import deque
+
+from conversation_memory import estimate_tokens
+from metrics import metrics
+from text_analyzer import tokenize
+
+FAST = 'fast'
+ANALYTICAL = 'analytical'
+
+# Predefined questions: id -> (question, tier)
+PREDEFINED_QUESTIONS = {
+    'method': ("Metode apa yang digunakan pada paper tersebut?", FAST),
+    'author_date': ("Siapa penulis dan kapan paper tersebut dibuat?", FAST),
+    'results': ("Apa hasil dari paper tersebut?", ANALYTICAL),
+    'conclusion': ("Apa kesimpulan dari penelitian ini?", ANALYTICAL),
+    'objective': ("Apa tujuan dari penelitian ini?", FAST),
+    'contribution': ("Apa kontribusi utama dari paper ini?", ANALYTICAL),
+    'limitations': ("Apa keterbatasan dari penelitian ini?", ANALYTICAL),
+    'methodology': ("Bagaimana metodologi penelitian yang digunakan?", ANALYTICAL)
+}
+
+PREDEFINED_IDS_BY_QUESTION = {question: question_id for question_id, (question, _) in PREDEFINED_QUESTIONS.items()}
+
+# Words that ask for explanation, comparison or judgement
+ANALYTICAL_KEYWORDS = frozenset("""
+bagaimana mengapa kenapa jelaskan uraikan analisis analisa analisislah evaluasi kritik kritisi bandingkan perbandingan
+bedanya perbedaan kelebihan kekurangan keterbatasan kelemahan implikasi dampak pengaruh hubungan metodologi diskusikan
+how why explain describe analyze analyse evaluate critique criticize compare comparison difference advantages
+disadvantages strengths weaknesses limitations implications impact relationship methodology discuss
+""".split())
+
+# Words that ask for a single fact
+FACTUAL_KEYWORDS = frozenset("""
+siapa kapan tahun penulis pengarang judul berapa dimana mana nama jurnal penerbit tanggal
+who when year author authors title many much where name journal publisher date
+""".split())
+
+# Questions up to this many words without analytical keywords count as factual
+FACTUAL_MAX_WORDS = 8
+# Questions longer than this are analytical whatever their keywords
+ANALYTICAL_MIN_WORDS = 25
+
+# Outcomes needed before a tier's token cap adapts, and headroom above the p95 answer length
+ADAPTIVE_MIN_SAMPLES = 20
+ADAPTIVE_HEADROOM = 1.25
+OUTCOME_WINDOW = 500
+
+# Generation rate assumed until a tier has enough outcomes, and the recent
+# outcomes its observed rate is computed from
+DEFAULT_TOKENS_PER_SECOND = 20.0
+THROUGHPUT_MIN_SAMPLES = 5
+THROUGHPUT_WINDOW = 50
+
+
+class ModelTier:
+    """Model and generation parameters for one class of questions"""
+
+    def __init__(self, name, model, max_tokens, temperature, min_tokens=64):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.min_tokens = min_tokens
+
+
+def predefined_question_id(question):
+    """Id of a predefined question asked verbatim, or None"""
+    return PREDEFINED_IDS_BY_QUESTION.get(question.strip())
+
+
+def classify_question(question, question_id=None):
+    """
+    Pick the tier for a question
+
+    Args:
+        question (str): The user's question
+        question_id (str): Predefined-question id sent by the client, if any
+
+    Returns:
+        tuple: ``(tier name, reason)``
+    """
+    if question_id in PREDEFINED_QUESTIONS:
+        return PREDEFINED_QUESTIONS[question_id][1], f"predefined:{question_id}"
+
+    words = tokenize(question)
+    if len(words) > ANALYTICAL_MIN_WORDS:
+        return ANALYTICAL, 'length'
+    if ANALYTICAL_KEYWORDS.intersection(words):
+        return ANALYTICAL, 'keyword'
+    if FACTUAL_KEYWORDS.intersection(words):
+        return FAST, 'keyword'
+    if len(words) <= FACTUAL_MAX_WORDS:
+        return FAST, 'length'
+    return ANALYTICAL, 'default'
+
+
+class QuestionRouter:
+    """Chooses a model tier per question and learns each tier's token needs"""
+
+    def __init__(self, tiers, tokens_per_second=DEFAULT_TOKENS_PER_SECOND):
+        """
+        Args:
+            tiers (list): ``ModelTier`` objects, one per tier name
+            tokens_per_second (float): Generation rate assumed before any is observed
+        """
+        self.tiers = {tier.name: tier for tier in tiers}
+        self.default_tokens_per_second = tokens_per_second
+        self._answer_tokens = {tier.name: deque(maxlen=OUTCOME_WINDOW) for tier in tiers}
+        self._throughput = {tier.name: deque(maxlen=THROUGHPUT_WINDOW) for tier in tiers}
+        self._lock = threading.Lock()
+
+    def route(self, question, question_id=None):
+        """
+        Return the routing decision for a question
+
+        Returns:
+            dict: ``question_id``, ``tier``, ``reason``, ``model``, ``max_tokens`` and ``temperature``
+        """
+        question_id = question_id or predefined_question_id(question)
+        tier_name, reason = classify_question(question, question_id)
+        tier = self.tiers[tier_name]
+        metrics.increment(f'router.{tier_name}')
+        return {
+            'question_id': question_id,
+            'tier': tier_name,
+            'reason': reason,
+            'model': tier.model,
+            'max_tokens': self.max_tokens(tier_name),
+            'temperature': tier.temperature
+        }
+
+    def max_tokens(self, tier_name):
+        """The tier's token cap, adapted to observed answer lengths once there are enough"""
+        tier = self.tiers[tier_name]
+        with self._lock:
+            observed = sorted(self._answer_tokens[tier_name])
+        if len(observed) < ADAPTIVE_MIN_SAMPLES:
+            return tier.max_tokens
+        p95 = observed[min(len(observed) - 1, int(len(observed) * 0.95))]
+        return max(tier.min_tokens, min(tier.max_tokens, math.ceil(p95 * ADAPTIVE_HEADROOM)))
+
+    def tokens_per_second(self, tier_name):
+        """
+        Recent generation rate of a tier, prompt processing included
+
+        Counting the whole generation time makes it an underestimate for long
+        prompts, which is the safe side when fitting an answer into a deadline.
+        """
+        with self._lock:
+            samples = list(self._throughput[tier_name])
+        seconds = sum(generation_time for _, generation_time in samples)
+        if len(samples) < THROUGHPUT_MIN_SAMPLES or seconds <= 0:
+            return self.default_tokens_per_second
+        return sum(answer_tokens for answer_tokens, _ in samples) / seconds
+
+    def min_generation_time(self, tier_name):
+        """Seconds the tier needs for its shortest useful answer at the current rate"""
+        return self.tiers[tier_name].min_tokens / self.tokens_per_second(tier_name)
+
+    def record(self, decision, generation_time, answer):
+        """Record the outcome of a generation made with ``decision``"""
+        answer_tokens = estimate_tokens(answer)
+        with self._lock:
+            self._answer_tokens[decision['tier']].append(answer_tokens)
+            self._throughput[decision['tier']].append((answer_tokens, generation_time))
+        metrics.observe(f"router.{decision['tier']}.generation_time", generation_time)
+        metrics.observe(f"router.{decision['tier']}.answer_tokens", answer_tokens)
+        return answer_tokens
@@ -0,0 +1,214 @@
+"""
+Related papers: nearest neighbours by TF-IDF cosine similarity.
+
+Every document is a sparse TF-IDF vector (sublinear term frequency, smoothed
+IDF, L2-normalized, pruned to its heaviest terms) held in an inverted index,
+so the similarities of one document to all others are one sparse dot product
+over the postings of its terms. The top neighbours of every document are
+precomputed, among all documents and among its owner's, and serving them is
+a lookup.
+
+The table is built from the database on first use and kept up to date
+incrementally: an upload computes the new document's row and inserts it into
+the neighbour lists it makes the cut for; a deletion drops it and recomputes
+only the lists it was in. IDF weights drift as the corpus changes, so the
+whole table is rebuilt once it has grown or shrunk by a quarter.
+"""
+
+import heapq
+import math
+import threading
+from collections import Counter
+
+from metrics import metrics
+from text_analyzer import analyze
+
+# Neighbours precomputed per document
+RELATED_TOP_N = 20
+# Heaviest terms kept per document vector
+RELATED_MAX_TERMS = 300
+# Relative change in the number of documents that triggers a rebuild
+REBUILD_DRIFT = 0.25
+
+
+class RelatedPapers:
+    """Precomputed TF-IDF neighbours of every document"""
+
+    def __init__(self, loader, top_n=RELATED_TOP_N, max_terms=RELATED_MAX_TERMS):
+        """
+        Args:
+            loader (callable): ``loader()`` returning ``(document_id, owner_id, content)`` for every document
+            top_n (int): Neighbours kept per document, in each scope
+            max_terms (int): Heaviest terms kept per document vector
+        """
+        self.loader = loader
+        self.top_n = top_n
+        self.max_terms = max_terms
+        self._built = False
+        self._built_size = 0
+        self._counts = {}     # document_id -> Counter of analyzed terms
+        self._owners = {}     # document_id -> owner id
+        self._df = Counter()  # term -> documents containing it
+        self._vectors = {}    # document_id -> {term: weight}
+        self._postings = {}   # term -> {document_id: weight}
+        self._neighbours = {}  # document_id -> {'all': [(score, id)], 'owner': [(score, id)]}
+        self._stale = set()   # documents whose lists lost an entry
+        self._lock = threading.RLock()
+
+    def related(self, document_id, limit=10, same_owner=True):
+        """
+        The documents most similar to one
+
+        Args:
+            document_id (int): The document
+            limit (int): Maximum number of results, at most ``top_n``
+            same_owner (bool): Only documents of the same owner, else all documents
+
+        Returns:
+            list: ``(document_id, similarity)`` pairs, best first; None if the document is not indexed
+        """
+        with self._lock:
+            self._ensure_built()
+            if document_id not in self._vectors:
+                return None
+            if document_id in self._stale:
+                self._neighbours[document_id] = self._rank(document_id)
+                self._stale.discard(document_id)
+            ranked = self._neighbours[document_id]['owner' if same_owner else 'all']
+            return [(other, round(score, 4)) for score, other in ranked[:min(limit, self.top_n)]]
+
+    def add_document(self, document_id, owner_id, content, counts=None):
+        """Add (or re-add) a document if the table has already been built; ``counts`` are its analyzed terms if known"""
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(document_id)
+            self._insert(document_id, owner_id, counts if counts is not None else Counter(analyze(content or '')))
+            if self._drifted():
+                self._rebuild()
+                return
+            self._vectorize(document_id)
+            scores = self._similarities(document_id)
+            self._neighbours[document_id] = self._rank(document_id, scores)
+            # Similarity is symmetric: the row is also the new document's column
+            for other, score in scores.items():
+                self._offer(other, document_id, score)
+        metrics.increment('related.added')
+
+    def remove_document(self, document_id):
+        with self._lock:
+            if self._built and document_id in self._vectors:
+                self._remove(document_id)
+                if self._drifted():
+                    self._rebuild()
+
+    def remove_owner(self, owner_id):
+        """Drop every document of a deleted user"""
+        with self._lock:
+            if not self._built:
+                return
+            for document_id in [document_id for document_id, owner in self._owners.items() if owner == owner_id]:
+                self._remove(document_id)
+            if self._drifted():
+                self._rebuild()
+
+    def _ensure_built(self):
+        if not self._built:
+            for document_id, owner_id, content in self.loader():
+                self._insert(document_id, owner_id, Counter(analyze(content or '')))
+            self._rebuild()
+            self._built = True
+
+    def _insert(self, document_id, owner_id, counts):
+        self._counts[document_id] = counts
+        self._owners[document_id] = owner_id
+        self._df.update(counts.keys())
+
+    def _drifted(self):
+        size = len(self._counts)
+        return abs(size - self._built_size) > REBUILD_DRIFT * max(self._built_size, 1)
+
+    def _rebuild(self):
+        """Recompute every vector with the current IDF, then every neighbour list"""
+        self._vectors = {}
+        self._postings = {}
+        for document_id in self._counts:
+            self._vectorize(document_id)
+        self._neighbours = {document_id: self._rank(document_id) for document_id in self._vectors}
+        self._stale = set()
+        self._built_size = len(self._counts)
+        metrics.increment('related.rebuilds')
+
+    def _vectorize(self, document_id):
+        count = len(self._counts)
+        weights = {
+            term: (1 + math.log(frequency)) * (math.log((1 + count) / (1 + self._df[term])) + 1)
+            for term, frequency in self._counts[document_id].items()
+        }
+        if len(weights) > self.max_terms:
+            weights = dict(heapq.nlargest(self.max_terms, weights.items(), key=lambda item: item[1]))
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        vector = {term: weight / norm for term, weight in weights.items()}
+        self._vectors[document_id] = vector
+        for term, weight in vector.items():
+            self._postings.setdefault(term, {})[document_id] = weight
+
+    def _similarities(self, document_id):
+        """Cosine similarity to every document sharing a term: one row of the similarity matrix"""
+        scores = Counter()
+        for term, weight in self._vectors[document_id].items():
+            for other, other_weight in self._postings[term].items():
+                scores[other] += weight * other_weight
+        scores.pop(document_id, None)
+        return scores
+
+    def _rank(self, document_id, scores=None):
+        if scores is None:
+            scores = self._similarities(document_id)
+        owner = self._owners[document_id]
+        return {
+            'all': heapq.nlargest(self.top_n, ((score, other) for other, score in scores.items())),
+            'owner': heapq.nlargest(self.top_n, (
+                (score, other) for other, score in scores.items() if self._owners[other] == owner
+            ))
+        }
+
+    def _offer(self, document_id, candidate, score):
+        """Put a new document into another's neighbour lists where it makes the cut"""
+        neighbours = self._neighbours.get(document_id)
+        if neighbours is None:
+            return
+        scopes = ('all', 'owner') if self._owners[document_id] == self._owners[candidate] else ('all',)
+        for scope in scopes:
+            ranked = neighbours[scope]
+            if (score, candidate) in ranked:
+                continue
+            if len(ranked) < self.top_n or score > ranked[-1][0]:
+                ranked.append((score, candidate))
+                ranked.sort(reverse=True)
+                del ranked[self.top_n:]
+
+    def _remove(self, document_id):
+        counts = self._counts.pop(document_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            self._df[term] -= 1
+            if self._df[term] <= 0:
+                del self._df[term]
+        self._owners.pop(document_id)
+        self._neighbours.pop(document_id, None)
+        self._stale.discard(document_id)
+        vector = self._vectors.pop(document_id, None) or {}
+        # Only documents sharing one of its terms can list it as a neighbour
+        candidates = set()
+        for term in vector:
+            postings = self._postings[term]
+            del postings[document_id]
+            candidates.update(postings)
+            if not postings:
+                del self._postings[term]
+        for other in candidates:
+            neighbours = self._neighbours.get(other)
+            if neighbours and any(neighbour == document_id for _, neighbour in neighbours['all'] + neighbours['owner']):
+                self._stale.add(other)
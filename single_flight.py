@@ -0,0 +1,184 @@
+"""
+Single-flight coalescing of identical LLM requests.
+
+Requests are keyed by a hash of the full prompt and generation parameters.
+The prompt includes the conversation, so only requests with the same
+conversation coalesce: every first question about the same documents does,
+but a follow-up, whose answer depends on its session's history and summary,
+only shares a generation with an identical conversation.
+The first request for a key (the leader) runs the generation and publishes
+its content into a ``Flight``; identical requests arriving while it is in
+flight (followers) read the same content instead of reaching LM Studio.
+Followers can replay the chunks as they arrive (streaming) or wait for the
+whole text. Each caller still persists its own answer.
+
+Flights can be followed from threads (Flask) or coroutines (FastAPI).
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+from llm_client import LLMTimeoutError, LLMUnavailableError
+from metrics import metrics
+
+
+def request_key(model, messages, **params):
+    """Hash of everything that determines a generation"""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Flight:
+    """The content of one in-flight generation, shared by every identical request"""
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, future) of coroutines waiting for the next chunk
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error=None):
+        """Complete the flight, successfully or with the leader's error; later calls are ignored"""
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._notify()
+        self.registry.forget(self)
+
+    def abandon(self):
+        """Fail the flight if the leader went away without finishing it"""
+        self.finish(LLMUnavailableError("The identical request this answer was shared with was cancelled"))
+
+    def relay(self, contents):
+        """Pass a leader's content deltas through, publishing each one to the followers"""
+        try:
+            for content in contents:
+                self.publish(content)
+                yield content
+        except Exception as e:
+            self.finish(e)
+            raise
+        self.finish()
+
+    async def arelay(self, contents):
+        """``relay`` for an async iterator of content deltas"""
+        try:
+            async for content in contents:
+                self.publish(content)
+                yield content
+        except Exception as e:
+            self.finish(e)
+            raise
+        self.finish()
+
+    def follow(self, timeout=None):
+        """
+        Yield the flight's chunks as they arrive
+
+        Raises:
+            LLMError: The leader's error, or LLMTimeoutError if no chunk arrives within ``timeout``
+        """
+        index = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: index < len(self.chunks) or self.done, timeout):
+                    raise LLMTimeoutError(f"Shared answer made no progress within {timeout}s")
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield chunk
+
+    async def afollow(self, timeout=None):
+        """``follow`` for coroutines"""
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            with self._cond:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    future = None
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    future = loop.create_future()
+                    self._waiters.append((loop, future))
+            if future is None:
+                index += 1
+                yield chunk
+                continue
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise LLMTimeoutError(f"Shared answer made no progress within {timeout}s")
+
+    def result(self, timeout=None):
+        """Wait for the whole text"""
+        return ''.join(self.follow(timeout))
+
+    async def result_async(self, timeout=None):
+        return ''.join([chunk async for chunk in self.afollow(timeout)])
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._waiters = []
+
+
+class SingleFlight:
+    """Registry of in-flight generations by request key"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Return ``(flight, leader)`` for a request
+
+        ``leader`` is True if the caller must run the generation and finish
+        the flight; otherwise the caller follows the existing flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight(self, key)
+                metrics.increment('single_flight.leaders')
+                return flight, True
+            flight.followers += 1
+        metrics.increment('single_flight.coalesced')
+        return flight, False
+
+    def forget(self, flight):
+        """Stop handing out a finished flight; later identical requests generate afresh"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
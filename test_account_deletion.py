@@ -0,0 +1,109 @@
+"""
+Deleting users and chat sessions: every table, then the in-memory state, only once committed
+"""
+
+import pytest
+
+import app as tess
+
+TEXT = "Penelitian tentang {} di sekolah dasar memakai survei terhadap guru dan siswa kelas lima."
+
+
+@pytest.fixture
+def users(admin):
+    """Ids of two users with a document, a catalog entry, a cached answer and a chat session each, indexed"""
+    ids = {}
+    for name in ('budi', 'siti'):
+        user = tess.User(username=name, email=f"{name}@example.com")
+        user.set_password('rahasia')
+        tess.db.session.add(user)
+        tess.db.session.flush()
+        document = tess.Document(
+            filename=f"{name}.txt", original_filename=f"{name}.txt", file_path=f"{name}.txt",
+            content=TEXT.format(name), user_id=user.id
+        )
+        tess.db.session.add(document)
+        tess.db.session.flush()
+        tess.save_catalog(document.id, user.id, {'title': name, 'authors': [name.title()], 'year': 2021, 'doi': None})
+        tess.db.session.add(tess.CachedAnswer(key=f"key-{name}", document_id=document.id, question='Metode?', response='Survei'))
+        chat_session = tess.ChatSession(user_id=user.id, title='Metode')
+        tess.db.session.add(chat_session)
+        tess.db.session.flush()
+        tess.db.session.add(tess.ChatHistory(user_id=user.id, session_id=chat_session.id, message='Metode?', response='Survei'))
+        ids[name] = (user.id, document.id, chat_session.id)
+    tess.db.session.commit()
+
+    # Build the in-memory state the deletions must clear
+    for user_id, document_id, session_id in ids.values():
+        tess.conversation_memories.load((user_id, session_id), [('Metode?', 'Survei')])
+        assert tess.user_document_indexes.search(user_id, 'survei guru')
+    assert tess.related_papers.related(ids['budi'][1], same_owner=False)
+    assert tess.duplicate_index.duplicates_of(ids['budi'][1], 0)
+    return ids
+
+
+def rows_of(user_id, document_id):
+    """Number of rows left in every table that refers to the user or the document"""
+    return {
+        model.__name__: model.query.filter_by(**{column: value}).count()
+        for model, column, value in [
+            (tess.User, 'id', user_id), (tess.Document, 'id', document_id),
+            (tess.ChatHistory, 'user_id', user_id), (tess.ChatSession, 'user_id', user_id),
+            (tess.DocumentCatalog, 'document_id', document_id), (tess.DocumentAuthor, 'document_id', document_id),
+            (tess.DocumentSignature, 'document_id', document_id), (tess.CachedAnswer, 'document_id', document_id),
+        ]
+    }
+
+
+def indexed(user_id, document_id, session_id):
+    return {
+        'memory': tess.conversation_memories.get((user_id, session_id)) is not None,
+        'search': bool(tess.user_document_indexes._indexes.get(user_id)),
+        'related': tess.related_papers.related(document_id) is not None,
+        'duplicates': any(match[0] == document_id for match in tess.duplicate_index.find(
+            tess.minhash(TEXT.format('budi')), threshold=0
+        )),
+    }
+
+
+def test_delete_user_clears_the_database_then_the_indexes(users):
+    user_id, document_id, session_id = users['budi']
+    tess.delete_user_data(tess.db.session.get(tess.User, user_id))
+
+    assert set(rows_of(user_id, document_id).values()) == {0}
+    assert not any(indexed(user_id, document_id, session_id).values())
+    # The other user keeps everything
+    other = users['siti']
+    assert set(rows_of(other[0], other[1]).values()) == {1}
+    assert tess.conversation_memories.get((other[0], other[2])) is not None
+    assert tess.related_papers.related(other[1]) is not None
+
+
+def failing_commit():
+    raise RuntimeError('database is locked')
+
+
+def test_failed_commit_leaves_the_indexes(users, monkeypatch):
+    user_id, document_id, session_id = users['budi']
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(tess.db.session, 'commit', failing_commit)
+        tess.delete_user_data(tess.db.session.get(tess.User, user_id))
+    tess.db.session.rollback()
+
+    assert set(rows_of(user_id, document_id).values()) == {1}
+    assert all(indexed(user_id, document_id, session_id).values())
+
+
+def test_delete_chat_session(users, monkeypatch):
+    user_id, _, session_id = users['budi']
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(tess.db.session, 'commit', failing_commit)
+        tess.delete_chat_session_data(tess.db.session.get(tess.ChatSession, session_id))
+    tess.db.session.rollback()
+    assert tess.conversation_memories.get((user_id, session_id)) is not None
+
+    tess.delete_chat_session_data(tess.db.session.get(tess.ChatSession, session_id))
+    assert tess.ChatSession.query.filter_by(user_id=user_id).count() == 0
+    assert tess.ChatHistory.query.filter_by(user_id=user_id).count() == 0
+    assert tess.conversation_memories.get((user_id, session_id)) is None
+    assert tess.ChatHistory.query.count() == 1
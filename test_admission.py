@@ -0,0 +1,91 @@
+"""
+Fairness, priorities and caps of LLM admission control
+"""
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def admitted_order(controller, tickets):
+    """User ids of ``tickets`` in the order they get a slot, releasing each one as soon as it is admitted"""
+    order = []
+    while len(order) < len(tickets):
+        ticket = next(ticket for ticket in tickets if ticket.admitted and not ticket.released)
+        order.append(ticket.user_id)
+        controller.release(ticket)
+    return order
+
+
+def test_round_robin_across_users():
+    controller = AdmissionController(max_concurrent=1, user_max_queued=5)
+    blocker = controller.enqueue('blocker')
+    # User a queues a burst before b and c ask anything
+    tickets = [controller.enqueue(user) for user in ('a', 'a', 'a', 'b', 'c')]
+    controller.release(blocker)
+    assert admitted_order(controller, tickets) == ['a', 'b', 'c', 'a', 'a']
+
+
+def test_higher_priority_class_goes_first():
+    controller = AdmissionController(max_concurrent=1)
+    blocker = controller.enqueue('blocker')
+    background = controller.enqueue(None, 'background')
+    user = controller.enqueue('student')
+    dosen = controller.enqueue('lecturer', 'dosen')
+    assert controller.position(dosen) == 1
+    assert controller.position(background) == 3
+    controller.release(blocker)
+    assert admitted_order(controller, [background, user, dosen]) == ['lecturer', 'student', None]
+
+
+def test_user_in_flight_cap_lets_others_pass():
+    controller = AdmissionController(max_concurrent=2, user_max_in_flight=1)
+    first = controller.enqueue('a')
+    second = controller.enqueue('a')
+    other = controller.enqueue('b')
+    # The free slot goes to b, not to a's second request
+    assert first.admitted and other.admitted
+    assert not second.admitted
+    controller.release(first)
+    assert second.admitted
+
+
+def test_user_queue_cap_is_rejected_with_429():
+    controller = AdmissionController(max_concurrent=1, user_max_queued=2)
+    controller.enqueue('blocker')
+    controller.enqueue('a')
+    controller.enqueue('a')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue('a')
+    assert rejected.value.status_code == 429
+    # Other users are not affected by a's cap
+    assert not controller.enqueue('b').admitted
+
+
+def test_full_queue_is_shed_with_503():
+    controller = AdmissionController(max_concurrent=1, max_queue=2)
+    for user in ('blocker', 'a', 'b'):
+        controller.enqueue(user)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue('c')
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after >= 1
+
+
+def test_released_waiting_ticket_leaves_queue():
+    controller = AdmissionController(max_concurrent=1)
+    blocker = controller.enqueue('blocker')
+    waiting = controller.enqueue('a')
+    controller.release(waiting)
+    assert controller.queued == 0
+    controller.release(blocker)
+    assert controller.in_flight == 0
+
+
+def test_admit_times_out():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=0.05)
+    controller.enqueue('blocker')
+    with pytest.raises(AdmissionRejected, match='No LM Studio slot'):
+        with controller.admit('a'):
+            pass
+    assert controller.queued == 0
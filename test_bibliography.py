@@ -0,0 +1,133 @@
+"""
+Catalog metadata read off first pages and /Info, and the questions it answers
+"""
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from bibliography import (
+    catalog_fields, format_catalog_answer, read_bibliography, split_authors, title_from_lines, year_from_text
+)
+
+FIRST_PAGE = """Jurnal Pendidikan Indonesia Vol. 5 No. 2 (2021) ISSN 2301-1234
+PENGARUH MEDIA PEMBELAJARAN INTERAKTIF
+TERHADAP HASIL BELAJAR SISWA
+Budi Santoso1, Siti Aminah2*
+1Universitas Negeri Semarang, Indonesia
+Diterima 3 Januari 2021, diterbitkan 20 Maret 2021
+Abstrak
+Penelitian ini dilakukan pada tahun 2019 dan 2020. DOI: 10.1234/jpi.v5i2.5678.
+"""
+
+
+@pytest.mark.parametrize('line, names', [
+    ('Budi Santoso, Siti Aminah', ['Budi Santoso', 'Siti Aminah']),
+    ('Budi Santoso1*, Siti Aminah2 dan Andi Wijaya3', ['Budi Santoso', 'Siti Aminah', 'Andi Wijaya']),
+    ('BUDI SANTOSO & SITI AMINAH', ['Budi Santoso', 'Siti Aminah']),
+    ('J. R. Smith and A. B. Jones', ['J. R. Smith', 'A. B. Jones']),
+    ('Universitas Negeri Semarang', None),
+    ('budi@mail.unnes.ac.id', None),
+    ('Abstract', None),
+    ('Penelitian ini membahas hasil belajar siswa', None),
+])
+def test_split_authors(line, names):
+    assert split_authors(line) == names
+
+
+@pytest.mark.parametrize('text, fallback, year', [
+    # A marked line wins over more frequent unmarked years
+    ('Data 2018\nData 2018\nPublished 2020', None, 2020),
+    ('Diterima 2020, diterbitkan 2021', None, 2021),
+    ('Data dari 2015, 2016 dan 2016', None, 2016),
+    ('Universitas Negeri Semarang 2017\nSurvei 2019\nSurvei 2019', None, 2019),
+    ('Tanpa tahun', 2022, 2022),
+    ('Tahun 1850 dan 2999', None, None),
+])
+def test_year_from_text(text, fallback, year):
+    assert year_from_text(text, fallback) == year
+
+
+@pytest.mark.parametrize('question, fields', [
+    ('Siapa penulis paper ini?', ('authors',)),
+    ('siapa penulisnya?', ('authors',)),
+    ('Siapa yang menulis paper ini?', ('authors',)),
+    ('Kapan paper ini ditulis?', ('year',)),
+    ('Siapa penulis dan kapan paper ini diterbitkan?', ('authors', 'year')),
+    ('What is the DOI of this paper?', ('doi',)),
+    ('Apa judul dokumen ini?', ('title',)),
+    ('Apa metode yang dipakai penulis?', None),
+    ('Jelaskan hasil penelitian ini', None),
+])
+def test_catalog_fields(question, fields):
+    assert catalog_fields(question) == fields
+
+
+def test_predefined_question_fields():
+    assert catalog_fields("anything", 'author_date') == ('authors', 'year')
+
+
+def test_year_answer_without_authors():
+    entry = {'filename': 'paper.pdf', 'title': 'Judul', 'authors': [], 'year': 2021, 'doi': None}
+    assert format_catalog_answer([entry], catalog_fields('Kapan paper ini ditulis?')) == \
+        'Paper "Judul" dibuat pada tahun 2021.'
+    assert format_catalog_answer([entry], ('authors',)) is None
+
+
+def test_title_spans_capitalized_lines():
+    lines = [line for line in FIRST_PAGE.splitlines() if line]
+    assert title_from_lines(lines) == ('Pengaruh media pembelajaran interaktif terhadap hasil belajar siswa', 3)
+
+
+def test_single_line_text_title_stops_at_first_sentence():
+    sentence = "Pengaruh media pembelajaran terhadap hasil belajar siswa."
+    title, _ = title_from_lines([f"{sentence} {sentence} {sentence}"])
+    assert title == "Pengaruh media pembelajaran terhadap hasil belajar siswa"
+
+
+def test_body_sentence_is_skipped():
+    lines = [
+        "Penelitian ini bertujuan untuk mengetahui pengaruh media pembelajaran terhadap hasil belajar siswa kelas X.",
+        "SISTEM INFORMASI AKADEMIK BERBASIS WEB"
+    ]
+    assert title_from_lines(lines) == ('Sistem informasi akademik berbasis web', 2)
+
+
+def write_pdf(path, **info):
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    writer.add_metadata(info)
+    with open(path, 'wb') as file:
+        writer.write(file)
+    return str(path)
+
+
+def test_first_page_fields(tmp_path):
+    path = write_pdf(tmp_path / 'paper.pdf')
+    entry = read_bibliography(path, 'paper.pdf', FIRST_PAGE)
+    assert entry == {
+        'title': 'Pengaruh media pembelajaran interaktif terhadap hasil belajar siswa',
+        'authors': ['Budi Santoso', 'Siti Aminah'],
+        'year': 2021,
+        'doi': '10.1234/jpi.v5i2.5678'
+    }
+
+
+@pytest.mark.parametrize('title, author', [
+    ('Microsoft Word - draft_final.docx', 'User'),
+    ('Untitled', 'ASUS'),
+    ('skripsi.pdf', 'Windows User'),
+])
+def test_placeholder_info_is_ignored(tmp_path, title, author):
+    path = write_pdf(tmp_path / 'paper.pdf', **{'/Title': title, '/Author': author})
+    entry = read_bibliography(path, 'paper.pdf', FIRST_PAGE)
+    assert entry['title'] == 'Pengaruh media pembelajaran interaktif terhadap hasil belajar siswa'
+    assert entry['authors'] == ['Budi Santoso', 'Siti Aminah']
+
+
+def test_real_info_wins(tmp_path):
+    path = write_pdf(tmp_path / 'paper.pdf', **{
+        '/Title': 'Media Interaktif dan Hasil Belajar', '/Author': 'Andi Wijaya; Rina Putri'
+    })
+    entry = read_bibliography(path, 'paper.pdf', FIRST_PAGE)
+    assert entry['title'] == 'Media Interaktif dan Hasil Belajar'
+    assert entry['authors'] == ['Andi Wijaya', 'Rina Putri']
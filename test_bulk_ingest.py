@@ -0,0 +1,122 @@
+"""
+Bulk ingestion: skipping known files, duplicates in one archive and failures that leave nothing behind
+"""
+
+import os
+import zipfile
+
+import pytest
+
+import app as tess
+import bulk_ingest
+from bulk_ingest import ingest
+
+
+@pytest.fixture
+def uploads(database, tmp_path, monkeypatch):
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    monkeypatch.setitem(tess.app.config, 'UPLOAD_FOLDER', str(folder))
+    return folder
+
+
+def archive(path, files):
+    with zipfile.ZipFile(path, 'w') as zipped:
+        for name, text in files.items():
+            zipped.writestr(name, text)
+    return str(path)
+
+
+def paper(index):
+    return f"Penelitian nomor {index} tentang hasil belajar siswa sekolah dasar."
+
+
+def ingested():
+    """``(original_filename, source)`` of the ingested documents, by id"""
+    rows = tess.db.session.query(tess.Document.original_filename, tess.IngestedFile.source).join(
+        tess.IngestedFile, tess.IngestedFile.document_id == tess.Document.id
+    ).order_by(tess.Document.id).all()
+    return [tuple(row) for row in rows]
+
+
+def stats_of(stats):
+    return stats.ingested, stats.skipped, stats.failed
+
+
+def test_second_run_skips_files_by_content(admin, uploads, tmp_path):
+    source = tmp_path / 'papers'
+    (source / 'bab').mkdir(parents=True)
+    for index in range(3):
+        (source / 'bab' / f"paper{index}.txt").write_text(paper(index), encoding='utf-8')
+    (source / '.hidden.txt').write_text(paper(9), encoding='utf-8')
+    (source / 'gambar.png').write_bytes(b'png')
+
+    assert stats_of(ingest(str(source), admin, workers=2, batch_size=2)) == (3, 0, 0)
+    assert ingested() == [(f"paper{index}.txt", f"bab/paper{index}.txt") for index in range(3)]
+    assert len(os.listdir(uploads)) == 3
+    assert tess.Document.query.filter_by(original_filename='paper0.txt').one().content == paper(0)
+    # Search terms were analyzed by the workers and stored with the documents
+    assert tess.DocumentTerms.query.count() == 3
+
+    # Renamed or not, a file with the same content is not ingested twice
+    (source / 'bab' / 'paper0.txt').rename(source / 'salinan.txt')
+    (source / 'baru.txt').write_text(paper(3), encoding='utf-8')
+    assert stats_of(ingest(str(source), admin, workers=2, batch_size=2)) == (1, 3, 0)
+    assert [source for _, source in ingested()][-1] == 'baru.txt'
+    assert len(os.listdir(uploads)) == 4
+
+
+def test_duplicate_in_the_archive_is_removed(admin, uploads, tmp_path):
+    source = archive(tmp_path / 'papers.zip', {
+        'a/paper.txt': paper(1),
+        'b/paper-salinan.txt': paper(1),
+        'c/lain.txt': paper(2),
+        '__MACOSX/a/._paper.txt': 'resource fork',
+    })
+    assert stats_of(ingest(source, admin, workers=1, batch_size=10)) == (2, 1, 0)
+    assert ingested() == [('paper.txt', 'a/paper.txt'), ('lain.txt', 'c/lain.txt')]
+    # The copy of the duplicate was written by its worker, then removed
+    assert sorted(name.split('_', 3)[-1] for name in os.listdir(uploads)) == ['lain.txt', 'paper.txt']
+
+
+def failing_extraction(file_path, filename):
+    if 'rusak' in filename:
+        raise ValueError('cannot read the file')
+    return tess.extract_document(file_path, filename)
+
+
+def test_failed_extraction_leaves_no_file(admin, uploads, tmp_path, monkeypatch):
+    # Workers are forked after the patch, so they extract with it
+    monkeypatch.setattr(bulk_ingest, 'extract_document', failing_extraction)
+    source = archive(tmp_path / 'papers.zip', {'baik.txt': paper(1), 'rusak.txt': paper(2)})
+    assert stats_of(ingest(source, admin, workers=1, batch_size=10)) == (1, 0, 1)
+    assert ingested() == [('baik.txt', 'baik.txt')]
+    assert len(os.listdir(uploads)) == 1
+
+    # Nothing was recorded for the failed file, so a rerun tries it again
+    monkeypatch.setattr(bulk_ingest, 'extract_document', tess.extract_document)
+    assert stats_of(ingest(source, admin, workers=1, batch_size=10)) == (1, 1, 0)
+
+
+def test_failed_batch_is_rolled_back_and_later_batches_run(admin, uploads, tmp_path, monkeypatch):
+    add_document_rows = bulk_ingest.add_document_rows
+
+    def failing_rows(user_id, original_filename, *args):
+        if original_filename == 'paper3.txt':
+            raise RuntimeError('database is locked')
+        return add_document_rows(user_id, original_filename, *args)
+
+    monkeypatch.setattr(bulk_ingest, 'add_document_rows', failing_rows)
+    source = tmp_path / 'papers'
+    source.mkdir()
+    for index in range(6):
+        (source / f"paper{index}.txt").write_text(paper(index), encoding='utf-8')
+
+    # One worker keeps the files in order: batches {0, 1}, {2, 3} (fails) and {4, 5}
+    assert stats_of(ingest(str(source), admin, workers=1, batch_size=2)) == (4, 0, 2)
+    assert [filename for filename, _ in ingested()] == ['paper0.txt', 'paper1.txt', 'paper4.txt', 'paper5.txt']
+    assert tess.Document.query.count() == 4
+    # The files of the rolled back batch were removed with it
+    assert sorted(name.split('_', 3)[-1] for name in os.listdir(uploads)) == [
+        'paper0.txt', 'paper1.txt', 'paper4.txt', 'paper5.txt'
+    ]
@@ -0,0 +1,83 @@
+"""
+Content-defined chunks, chunk diffs and the chunk term cache
+"""
+
+import random
+from collections import Counter
+
+from chunking import CHUNK_MAX_CHARS, CHUNK_MIN_CHARS, ChunkTerms, chunk_hash, content_chunks, diff_chunks
+from text_analyzer import analyze
+
+
+def document(seed=1, words=6000):
+    rng = random.Random(seed)
+    vocabulary = [f"kata{index}" for index in range(3000)]
+    return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+
+def keys(text):
+    return [chunk_hash(chunk) for chunk in content_chunks(text)]
+
+
+def test_chunks_join_to_the_text():
+    text = document()
+    chunks = content_chunks(text)
+    assert ''.join(chunks) == text
+    assert len(chunks) > 5
+    assert all(len(chunk) >= CHUNK_MIN_CHARS for chunk in chunks[:-1])
+    assert all(len(chunk) <= CHUNK_MAX_CHARS + 100 for chunk in chunks)
+
+
+def test_short_and_empty_texts():
+    assert content_chunks('') == []
+    assert content_chunks(None) == []
+    assert content_chunks('satu dua tiga') == ['satu dua tiga']
+
+
+def test_unbroken_text_is_cut_at_max_size():
+    text = 'a ' * 10000
+    chunks = content_chunks(text)
+    assert ''.join(chunks) == text
+    assert all(len(chunk) <= CHUNK_MAX_CHARS + 2 for chunk in chunks)
+
+
+def test_edit_only_moves_nearby_boundaries():
+    text = document()
+    middle = len(text) // 2
+    edited = text[:middle] + ' sisipan kalimat baru ' + text[middle:]
+    before, after = keys(text), keys(edited)
+
+    diff = diff_chunks(before, after)
+    assert diff['unchanged'] >= len(before) - 3
+    assert diff['added'] <= 3 and diff['removed'] <= 3
+    # The chunks before the edit and after the next boundary keep their hashes
+    assert before[:2] == after[:2] and before[-2:] == after[-2:]
+
+
+def test_diff_chunks_counts_duplicates():
+    assert diff_chunks(['a', 'b', 'b'], ['b', 'c', 'a']) == {'unchanged': 2, 'added': 1, 'removed': 1}
+    assert diff_chunks([], ['a']) == {'unchanged': 0, 'added': 1, 'removed': 0}
+
+
+def test_chunk_terms_are_reused():
+    text = document(words=3000)
+    chunks = [(chunk_hash(chunk), chunk) for chunk in content_chunks(text)]
+    terms = ChunkTerms()
+
+    counts, reused = terms.counts(chunks)
+    assert reused == 0
+    assert counts == Counter(analyze(text))
+
+    edited = chunks[:-1] + [(chunk_hash('bab baru'), 'bab baru')]
+    counts, reused = terms.counts(edited)
+    assert reused == len(chunks) - 1
+    assert counts == Counter(analyze(''.join(chunk for _, chunk in edited)))
+
+
+def test_chunk_terms_cache_is_bounded():
+    terms = ChunkTerms(cache_size=2)
+    chunks = [(str(index), f"dokumen nomor {index}") for index in range(3)]
+    terms.counts(chunks)
+    # The oldest chunk was evicted
+    assert terms.counts(chunks[:1])[1] == 0
+    assert terms.counts(chunks[2:])[1] == 1
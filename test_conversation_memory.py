@@ -0,0 +1,106 @@
+"""
+Token-bounded conversation windows, their running summary and the session LRU cache
+"""
+
+import pytest
+
+from conversation_memory import (
+    CHARS_PER_TOKEN, ConversationMemory, MemoryStore, clip_to_tokens, estimate_tokens, first_sentence
+)
+
+
+def words(count, word='kata'):
+    return ' '.join([word] * count)
+
+
+@pytest.mark.parametrize('text, tokens', [('', 0), ('abc', 1), ('a' * 40, 11)])
+def test_estimate_tokens(text, tokens):
+    assert estimate_tokens(text) == tokens
+
+
+def test_clip_to_tokens_cuts_on_a_word():
+    assert clip_to_tokens('pendek', 10) == 'pendek'
+    clipped = clip_to_tokens(words(100), 10)
+    assert clipped == words(8) + '...'
+    assert len(clipped) <= 10 * CHARS_PER_TOKEN + 3
+
+
+@pytest.mark.parametrize('text, sentence', [
+    ('Metodenya kualitatif. Datanya wawancara.', 'Metodenya kualitatif.'),
+    ('  Apa hasilnya?  Nilai naik. ', 'Apa hasilnya?'),
+    (words(100) + '.', words(40) + '...'),
+])
+def test_first_sentence(text, sentence):
+    assert first_sentence(text) == sentence
+
+
+def test_window_stays_within_budget():
+    memory = ConversationMemory(window_tokens=100, answer_tokens=300, summary_tokens=1000)
+    for index in range(10):
+        memory.add_turn(f"Pertanyaan {index}?", f"Jawaban {index}. {words(40)}")
+
+    history = memory.history()
+    assert sum(estimate_tokens(message) + estimate_tokens(response) for message, response in history) <= 100
+    assert history[-1][0] == 'Pertanyaan 9?'
+    # Every turn is either in the window or summarized, oldest first
+    summarized = len(memory.summary.splitlines())
+    assert summarized + len(history) == 10
+    assert memory.summary.splitlines()[0] == '- Pertanyaan: Pertanyaan 0? Jawaban: Jawaban 0.'
+
+
+def test_latest_turn_is_kept_even_if_too_long():
+    memory = ConversationMemory(window_tokens=10, answer_tokens=300)
+    memory.add_turn('Ringkas?', 'Ya.')
+    memory.add_turn('Jelaskan semuanya', words(200))
+    assert [message for message, _ in memory.history()] == ['Jelaskan semuanya']
+    assert memory.summary == '- Pertanyaan: Ringkas? Jawaban: Ya.'
+
+
+def test_answers_are_clipped():
+    memory = ConversationMemory(answer_tokens=20)
+    memory.add_turn('Apa isinya?', words(500))
+    _, response = memory.history()[0]
+    assert response.endswith('...')
+    assert estimate_tokens(response) <= 22
+
+
+def test_summary_forgets_its_oldest_lines():
+    memory = ConversationMemory(window_tokens=1, answer_tokens=300, summary_tokens=40)
+    for index in range(20):
+        memory.add_turn(f"Pertanyaan {index}?", f"Jawaban {index}.")
+
+    lines = memory.summary.splitlines()
+    assert sum(estimate_tokens(line) for line in lines) <= 40
+    assert len(lines) < 19
+    assert lines[-1] == '- Pertanyaan: Pertanyaan 18? Jawaban: Jawaban 18.'
+
+
+def test_store_evicts_least_recently_used():
+    store = MemoryStore(max_sessions=2)
+    first = store.load((1, 'a'), [('Halo?', 'Halo.')])
+    store.load((1, 'b'), [])
+    assert store.get((1, 'a')) is first  # (1, 'b') is now the least recently used
+    store.load((2, 'a'), [])
+
+    assert store.get((1, 'b')) is None
+    assert store.get((1, 'a')) is first
+    assert store.get((2, 'a')) is not None
+    assert first.history() == [('Halo?', 'Halo.')]
+
+
+def test_store_keeps_a_memory_loaded_meanwhile():
+    store = MemoryStore(window_tokens=50)
+    loaded = store.load((1, 'a'), [('Satu?', 'Satu.')])
+    assert store.load((1, 'a'), [('Lain?', 'Lain.')]) is loaded
+    assert loaded.window_tokens == 50
+
+
+def test_store_evicts_sessions_and_users():
+    store = MemoryStore()
+    for key in [(1, 'a'), (1, 'b'), (2, 'a')]:
+        store.load(key, [])
+    store.evict((1, 'a'))
+    assert store.get((1, 'a')) is None
+    store.evict_user(1)
+    assert store.get((1, 'b')) is None
+    assert store.get((2, 'a')) is not None
@@ -0,0 +1,100 @@
+"""
+Request deadlines: parsing X-Request-Timeout and spending the budget stage by stage
+"""
+
+import math
+
+import pytest
+
+import deadline
+from deadline import Deadline, DeadlineExceeded, parse_deadline
+from llm_client import LLMTimeoutError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(deadline.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.mark.parametrize('value, budget', [
+    (None, 90),
+    ('', 90),
+    ('  ', 90),
+    ('30', 30),
+    ('2.5', 2.5),
+    ('600', 300),  # Capped at the maximum
+    ('inf', 300),
+])
+def test_parse_deadline(value, budget):
+    assert parse_deadline(value, 90, 300).budget == budget
+
+
+@pytest.mark.parametrize('value', ['0', '-5', 'abc', 'nan', '10s'])
+def test_parse_deadline_rejects(value):
+    with pytest.raises(ValueError, match='X-Request-Timeout'):
+        parse_deadline(value, 90, 300)
+
+
+def test_remaining_and_expired(clock):
+    budget = Deadline(10)
+    clock.now += 4
+    assert budget.remaining() == 6
+    assert not budget.expired
+    clock.now += 7
+    assert budget.remaining() == 0.0
+    assert budget.expired
+
+
+def test_check_keeps_the_reserve(clock):
+    budget = Deadline(10)
+    clock.now += 3
+    budget.check('retrieval', reserve=5)
+    clock.now += 2
+    with pytest.raises(DeadlineExceeded) as raised:
+        budget.check('packing', reserve=5)
+    assert raised.value.stage == 'packing'
+    assert str(raised.value) == 'Request deadline of 10s exceeded during packing'
+    # Callers that handle LLM timeouts handle deadlines too
+    assert isinstance(raised.value, LLMTimeoutError)
+
+
+@pytest.mark.parametrize('elapsed, limit, reserve, wait', [
+    (0, 60, 0, 10),
+    (0, 4, 0, 4),
+    (3, 60, 2, 5),
+    (9, 60, 2, -1),
+])
+def test_wait_limit(clock, elapsed, limit, reserve, wait):
+    budget = Deadline(10)
+    clock.now += elapsed
+    assert budget.wait_limit(limit, reserve) == wait
+
+
+@pytest.mark.parametrize('elapsed, max_tokens, tokens', [
+    (0, 1000, 200),  # 10s at 20 tokens/s
+    (0, 150, 150),
+    (6, 1000, 80),
+    (7.99, 1000, math.floor(2.01 * 20)),
+])
+def test_fit_tokens(clock, elapsed, max_tokens, tokens):
+    budget = Deadline(10)
+    clock.now += elapsed
+    assert budget.fit_tokens(max_tokens, 20, min_tokens=32) == tokens
+
+
+def test_fit_tokens_fails_below_the_minimum(clock):
+    budget = Deadline(10)
+    clock.now += 8.5
+    with pytest.raises(DeadlineExceeded) as raised:
+        budget.fit_tokens(1000, 20, min_tokens=32)
+    assert raised.value.stage == 'generation'
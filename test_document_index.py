@@ -0,0 +1,107 @@
+"""
+Per-user BM25 indexes, loaded from the term counts stored with each document
+"""
+
+import os
+from collections import Counter
+
+import pytest
+
+import app as tess
+from document_index import DocumentIndex, UserIndexStore, decode_terms, encode_terms
+from near_duplicates import minhash
+from text_analyzer import analyze
+
+
+def test_terms_round_trip():
+    counts = Counter(analyze("Penelitian kualitatif tentang pembelajaran daring tahun 2021, éte"))
+    assert decode_terms(encode_terms(counts)) == counts
+    assert decode_terms('') == Counter()
+
+
+def test_search_ranks_by_bm25():
+    index = DocumentIndex()
+    index.add(1, "Metode survei terhadap guru sekolah dasar")
+    index.add(2, "Hasil panen padi petani di sawah")
+    index.add(3, "Survei kepuasan pasien rumah sakit dan survei dokter")
+    assert [document_id for document_id, _ in index.search("survei guru")] == [1, 3]
+    index.remove(1)
+    assert [document_id for document_id, _ in index.search("survei guru")] == [3]
+    assert index.search("kata yang tidak ada") == []
+
+
+def test_store_loads_counts_once_per_user():
+    loads = []
+
+    def loader(user_id):
+        loads.append(user_id)
+        return [(user_id * 10, Counter(analyze("survei guru sekolah")))]
+
+    store = UserIndexStore(loader)
+    assert [document_id for document_id, _ in store.search(1, "guru")] == [10]
+    store.add_document(1, 11, "survei petani", Counter(analyze("survei petani")))
+    store.add_document(2, 21, "tidak dimuat")  # Not loaded yet: left to the loader
+    assert {document_id for document_id, _ in store.search(1, "survei")} == {10, 11}
+    assert [document_id for document_id, _ in store.search(2, "survei")] == [20]
+    assert loads == [1, 2]
+
+
+def upload(user_id, filename, content):
+    file_path = os.path.join(tess.app.config['UPLOAD_FOLDER'], filename)
+    document, _ = tess.store_document(
+        user_id, 'user', filename, filename, file_path, tess.text_chunks(content), None,
+        {'title': None, 'authors': [], 'year': None, 'doi': None}, minhash(content)
+    )
+    return document.id
+
+
+def test_upload_stores_the_index_terms(admin):
+    content = "Penelitian ini memakai survei terhadap guru sekolah dasar."
+    document_id = upload(admin, 'survei_guru.txt', content)
+    stored = decode_terms(tess.db.session.get(tess.DocumentTerms, document_id).counts)
+    assert stored == Counter(analyze(content)) + Counter(analyze('survei_guru.txt'))
+
+
+def test_index_loads_without_analyzing_content(admin, monkeypatch):
+    document_id = upload(admin, 'paper.txt', "Penelitian ini memakai survei terhadap guru sekolah dasar.")
+    analyzed = []
+    monkeypatch.setattr(tess, 'analyze', lambda text: analyzed.append(text) or analyze(text))
+
+    assert tess.load_user_documents_for_index(admin) == [
+        (document_id, decode_terms(tess.db.session.get(tess.DocumentTerms, document_id).counts))
+    ]
+    assert analyzed == []
+    assert [match for match, _ in tess.user_document_indexes.search(admin, "survei guru")] == [document_id]
+
+
+def test_documents_stored_before_term_counts_are_backfilled_once(admin, monkeypatch):
+    document = tess.Document(
+        filename='lama.txt', original_filename='lama.txt', file_path='lama.txt',
+        content="Hasil panen padi petani di sawah irigasi.", user_id=admin
+    )
+    tess.db.session.add(document)
+    tess.db.session.commit()
+    analyzed = []
+    monkeypatch.setattr(tess, 'analyze', lambda text: analyzed.append(text) or analyze(text))
+
+    [(document_id, counts)] = tess.load_user_documents_for_index(admin)
+    assert document_id == document.id
+    assert counts == Counter(analyze(document.content)) + Counter(analyze('lama.txt'))
+    assert len(analyzed) == 2
+    tess.load_user_documents_for_index(admin)
+    assert len(analyzed) == 2
+
+
+@pytest.mark.parametrize('delete', ['document', 'user'])
+def test_deletion_removes_the_terms(admin, delete):
+    user = tess.User(username='budi', email='budi@example.com')
+    user.set_password('rahasia')
+    tess.db.session.add(user)
+    tess.db.session.commit()
+    document_id = upload(user.id, 'paper.txt', "Survei guru sekolah dasar.")
+
+    if delete == 'document':
+        tess.delete_document_data(tess.db.session.get(tess.Document, document_id))
+    else:
+        tess.delete_user_data(user)
+    assert tess.db.session.get(tess.DocumentTerms, document_id) is None
@@ -0,0 +1,113 @@
+"""
+Fan-out jobs: one question over many documents, when some of the documents fail
+"""
+
+import csv
+import io
+
+import pytest
+
+import app as tess
+from admission import AdmissionRejected
+from jobs import Job
+from llm_client import LLMError
+
+QUESTION = "Metode apa yang digunakan pada paper tersebut?"
+
+
+@pytest.fixture
+def documents(admin):
+    """Ids of four papers, by how LM Studio treats them"""
+    ids = {}
+    for name in ('berhasil', 'gagal', 'penuh', 'antre'):
+        document = tess.Document(
+            filename=f"{name}.txt", original_filename=f"{name}.txt", file_path=f"{name}.txt",
+            content=f"Paper {name}. Metode penelitian {name} memakai survei.", user_id=admin
+        )
+        tess.db.session.add(document)
+        tess.db.session.flush()
+        ids[name] = document.id
+    tess.db.session.commit()
+    return ids
+
+
+@pytest.fixture
+def lm_studio(monkeypatch):
+    """
+    Generations by document: "gagal" fails, "penuh" is always shed by admission
+    control and "antre" only on its first attempt. Returns the documents asked, in order.
+    """
+    asked = []
+
+    def query(messages, **params):
+        prompt = '\n'.join(message['content'] for message in messages)
+        name = next(name for name in ('berhasil', 'gagal', 'penuh', 'antre') if f"Paper {name}." in prompt)
+        asked.append(name)
+        if name == 'gagal':
+            raise LLMError('LM Studio unavailable')
+        if name == 'penuh' or (name == 'antre' and asked.count('antre') == 1):
+            raise AdmissionRejected('Server busy', retry_after=0.01)
+        return f"Survei ({name})"
+
+    monkeypatch.setattr(tess, 'query_lm_studio', query)
+    return asked
+
+
+def run_job(document_ids):
+    params, error = tess.prepare_fanout({'question': QUESTION, 'document_ids': document_ids})
+    assert error is None
+    job = Job('fanout', 1, total=len(params['document_ids']), params=params)
+    tess.run_fanout(job)
+    return job, {result['document_id']: result for result in job.results}
+
+
+def test_failed_documents_do_not_stop_the_job(documents, lm_studio):
+    job, results = run_job(list(documents.values()))
+
+    assert results[documents['berhasil']]['answer'] == 'Survei (berhasil)'
+    assert results[documents['antre']]['answer'] == 'Survei (antre)'
+    assert results[documents['gagal']]['error'] == 'LM Studio unavailable'
+    assert results[documents['penuh']]['error'] == 'Server busy'
+    assert 'answer' not in results[documents['gagal']]
+    # Shed requests are retried up to FANOUT_MAX_ATTEMPTS times; other LLM errors are not
+    assert lm_studio.count('penuh') == tess.FANOUT_MAX_ATTEMPTS
+    assert lm_studio.count('antre') == 2
+    assert lm_studio.count('gagal') == 1
+
+    summary = tess.fanout_summary(job)
+    assert (summary['completed'], summary['failed'], summary['cached']) == (4, 2, 0)
+
+    rows = list(csv.DictReader(io.StringIO(tess.fanout_csv(job))))
+    assert [int(row['document_id']) for row in rows] == sorted(documents.values())
+    assert [row['error'] for row in rows] == ['', 'LM Studio unavailable', 'Server busy', '']
+
+
+def test_only_failed_documents_are_asked_again(documents, lm_studio):
+    run_job(list(documents.values()))
+    asked = len(lm_studio)
+
+    job, results = run_job(list(documents.values()))
+    # Answers were cached; failures were not, so those documents are asked again
+    assert sorted(lm_studio[asked:]) == ['gagal'] + ['penuh'] * tess.FANOUT_MAX_ATTEMPTS
+    assert results[documents['berhasil']] == dict(results[documents['berhasil']], answer='Survei (berhasil)', cached=True)
+    assert results[documents['antre']]['cached']
+    assert tess.fanout_summary(job)['cached'] == 2
+
+
+def test_deleted_document_is_reported(documents, lm_studio):
+    params, _ = tess.prepare_fanout({'question': QUESTION, 'document_ids': [documents['berhasil']]})
+    job = Job('fanout', 1, params=dict(params, document_ids=[documents['berhasil'], 999]))
+    tess.run_fanout(job)
+    assert {result['document_id']: result.get('error') for result in job.results} == {
+        documents['berhasil']: None, 999: 'Document not found'
+    }
+
+
+def test_unexpected_error_is_reported_against_its_document(documents, monkeypatch):
+    def broken(messages, **params):
+        raise RuntimeError('disk I/O error')
+
+    monkeypatch.setattr(tess, 'query_lm_studio', broken)
+    job, results = run_job([documents['berhasil']])
+    assert results == {documents['berhasil']: {'document_id': documents['berhasil'], 'error': 'disk I/O error'}}
+    assert tess.fanout_csv(job).splitlines()[1] == f"{documents['berhasil']},,,,,disk I/O error"
@@ -0,0 +1,64 @@
+"""
+Tolerant parsing of batched /full-analysis replies
+"""
+
+import pytest
+
+from full_analysis import parse_answers, response_format
+
+QUESTIONS = [
+    ('method', "Metode apa yang digunakan pada paper tersebut?"),
+    ('results', "Apa hasil dari paper tersebut?"),
+    ('conclusion', "Apa kesimpulan dari penelitian ini?"),
+]
+
+ALL = {'method': 'Kualitatif', 'results': 'Nilai naik', 'conclusion': 'Efektif'}
+
+
+@pytest.mark.parametrize('reply, answers', [
+    # Clean and fenced JSON
+    ('{"method": "Kualitatif", "results": "Nilai naik", "conclusion": "Efektif"}', ALL),
+    ('```json\n{"method": "Kualitatif", "results": "Nilai naik", "conclusion": "Efektif"}\n```', ALL),
+    ('Berikut jawabannya:\n{"method": "Kualitatif", "results": "Nilai naik", "conclusion": "Efektif",}\nSemoga membantu',
+     ALL),
+    # Other shapes of valid JSON
+    ('{"answers": {"method": "Kualitatif", "results": "Nilai naik", "conclusion": "Efektif"}}', ALL),
+    ('[{"id": "method", "answer": "Kualitatif"}, {"question_id": "results", "jawaban": "Nilai naik"}]',
+     {'method': 'Kualitatif', 'results': 'Nilai naik'}),
+    ('{"Metode apa yang digunakan pada paper tersebut?": "Kualitatif"}', {'method': 'Kualitatif'}),
+    ('{"method": ["Survei", "Wawancara"], "results": ""}', {'method': '- Survei\n- Wawancara'}),
+    # Cut off at the token limit: every complete pair is kept
+    ('{"method": "Kualitatif", "results": "Nilai na', {'method': 'Kualitatif'}),
+    ('```json\n{"method": "Kuali\\"tatif\\"", "results": "Nilai naik", "conclusion": "Efek',
+     {'method': 'Kuali"tatif"', 'results': 'Nilai naik'}),
+])
+def test_json_replies(reply, answers):
+    assert parse_answers(reply, QUESTIONS) == answers
+
+
+@pytest.mark.parametrize('reply, answers', [
+    ('1. Kualitatif\n2. Nilai naik\n3. Efektif', ALL),
+    ('1) Metode apa yang digunakan pada paper tersebut? Kualitatif\n\n2) Apa hasil dari paper tersebut?\nNilai naik\n'
+     '3) conclusion: Efektif', ALL),
+    # Numbers beyond the questions asked are ignored; an answer may span lines
+    ('1. Kualitatif\ndengan wawancara\n4. Lainnya', {'method': 'Kualitatif\ndengan wawancara'}),
+    ('method: Kualitatif\nresults: Nilai naik\nconclusion: Efektif', ALL),
+    ('- **method**: Kualitatif\n- **conclusion**: Efektif', {'method': 'Kualitatif', 'conclusion': 'Efektif'}),
+])
+def test_plain_text_replies(reply, answers):
+    assert parse_answers(reply, QUESTIONS) == answers
+
+
+def test_lone_question_takes_the_whole_reply():
+    assert parse_answers(' Metode kualitatif dengan wawancara. ', QUESTIONS[:1]) == {'method': 'Metode kualitatif dengan wawancara.'}
+
+
+@pytest.mark.parametrize('reply', ['', 'Maaf, saya tidak dapat menjawab.', '{"other": "x"}', None])
+def test_unusable_replies(reply):
+    assert parse_answers(reply, QUESTIONS) == {}
+
+
+def test_response_format_requires_every_question():
+    schema = response_format(['method', 'results'])['json_schema']['schema']
+    assert schema['required'] == ['method', 'results']
+    assert schema['properties'] == {'method': {'type': 'string'}, 'results': {'type': 'string'}}
@@ -0,0 +1,183 @@
+"""
+Idempotency keys: request fingerprints, the response store and the ``idempotent`` route decorator
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+from flask import Flask, jsonify, request
+
+import app as tess
+from idempotency import IdempotencyStore, fingerprint, IDEMPOTENCY_HEADER, REPLAYED_HEADER
+
+
+def multipart(boundary, filename='paper.txt', data='isi dokumen'):
+    return (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: text/plain\r\n\r\n{data}\r\n--{boundary}--\r\n'
+    ).encode('latin-1')
+
+
+def test_json_fingerprint_compares_by_value():
+    first = fingerprint('POST', '/ask', '', 'application/json', b'{"question": "x", "stream": false}')
+    second = fingerprint('POST', '/ask', '', 'application/json', b'{"stream":false,"question":"x"}')
+    other = fingerprint('POST', '/ask', '', 'application/json', b'{"question": "y", "stream": false}')
+    assert first == second
+    assert first != other
+
+
+def test_multipart_fingerprint_ignores_boundary():
+    def upload(boundary, **fields):
+        content_type = f'multipart/form-data; boundary={boundary}'
+        return fingerprint('POST', '/upload', '', content_type, multipart(boundary, **fields))
+
+    assert upload('----a1b2') == upload('----z9y8')
+    assert upload('----a1b2') != upload('----z9y8', data='dokumen lain')
+
+
+def test_completed_response_is_replayed():
+    store = IdempotencyStore()
+    entry, leader = store.begin(('u', '/ask', 'k'), 'f')
+    assert leader
+    store.complete(entry, 200, {'Content-Type': 'application/json'}, b'{}')
+    again, leader = store.begin(('u', '/ask', 'k'), 'f')
+    assert not leader
+    assert again.response == (200, {'Content-Type': 'application/json'}, b'{}')
+
+
+@pytest.mark.parametrize('status, headers, body', [
+    (500, {}, b''),
+    (503, {}, b''),
+    (429, {}, b''),
+    (200, {'Content-Type': 'text/event-stream'}, b'event: delta\ndata: {}\n\nevent: error\ndata: {}\n\n'),
+])
+def test_failed_response_is_not_stored(status, headers, body):
+    store = IdempotencyStore()
+    entry, _ = store.begin(('u', '/ask', 'k'), 'f')
+    store.complete(entry, status, headers, body)
+    assert entry.finished and entry.response is None
+    # The retry runs the request again
+    _, leader = store.begin(('u', '/ask', 'k'), 'f')
+    assert leader
+
+
+def test_duplicate_waits_for_the_first_request():
+    store = IdempotencyStore()
+    entry, _ = store.begin(('u', '/ask', 'k'), 'f')
+    duplicate, leader = store.begin(('u', '/ask', 'k'), 'f')
+    assert not leader and not duplicate.wait(0.01)
+
+    threading.Timer(0.05, store.complete, (entry, 200, {}, b'ok')).start()
+    assert duplicate.wait(5)
+    assert duplicate.response == (200, {}, b'ok')
+
+
+def test_async_duplicate_waits_for_the_first_request():
+    store = IdempotencyStore()
+    entry, _ = store.begin(('u', '/ask', 'k'), 'f')
+    duplicate, _ = store.begin(('u', '/ask', 'k'), 'f')
+
+    async def wait():
+        threading.Timer(0.05, store.complete, (entry, 200, {}, b'ok')).start()
+        return await duplicate.wait_async(5)
+
+    assert asyncio.run(wait())
+    assert duplicate.response == (200, {}, b'ok')
+
+
+def test_entries_expire_after_ttl():
+    store = IdempotencyStore(ttl=0.05)
+    entry, _ = store.begin(('u', '/ask', 'k'), 'f')
+    store.complete(entry, 200, {}, b'ok')
+    time.sleep(0.1)
+    _, leader = store.begin(('u', '/ask', 'k'), 'f')
+    assert leader
+
+
+def logged_in(harness):
+    test_client = harness.test_client()
+    with test_client.session_transaction() as session:
+        session['user_id'] = 1
+    return test_client
+
+
+@pytest.fixture
+def client():
+    """A test app whose route uses the ``idempotent`` decorator of the API, logged in as user 1"""
+    harness = Flask(__name__)
+    harness.secret_key = 'test'
+    harness.calls = []
+    harness.release = threading.Event()
+
+    @harness.route('/echo', methods=['POST'])
+    @tess.idempotent
+    def echo():
+        harness.calls.append(request.get_json())
+        if request.args.get('slow'):
+            harness.release.wait(5)
+        return jsonify({'call': len(harness.calls)}), request.get_json().get('status', 200)
+
+    return logged_in(harness)
+
+
+def key_header():
+    return {IDEMPOTENCY_HEADER: uuid.uuid4().hex}
+
+
+def test_same_key_and_body_is_replayed(client):
+    headers = key_header()
+    first = client.post('/echo', json={'question': 'x'}, headers=headers)
+    second = client.post('/echo', json={'question': 'x'}, headers=headers)
+    assert second.get_json() == first.get_json() == {'call': 1}
+    assert second.headers[REPLAYED_HEADER] == 'true'
+    assert REPLAYED_HEADER not in first.headers
+    assert len(client.application.calls) == 1
+
+
+def test_same_key_with_different_body_is_refused(client):
+    headers = key_header()
+    client.post('/echo', json={'question': 'x'}, headers=headers)
+    response = client.post('/echo', json={'question': 'y'}, headers=headers)
+    assert response.status_code == 422
+    assert len(client.application.calls) == 1
+
+
+def test_server_error_is_run_again(client):
+    headers = key_header()
+    assert client.post('/echo', json={'status': 503}, headers=headers).status_code == 503
+    retry = client.post('/echo', json={'status': 503}, headers=headers)
+    assert REPLAYED_HEADER not in retry.headers
+    assert len(client.application.calls) == 2
+
+
+def test_concurrent_duplicate_waits_for_the_first_request(client):
+    harness = client.application
+    headers = key_header()
+    responses = {}
+
+    def post(name):
+        responses[name] = logged_in(harness).post('/echo?slow=1', json={'question': 'x'}, headers=headers)
+
+    first = threading.Thread(target=post, args=('first',))
+    first.start()
+    while not harness.calls:
+        time.sleep(0.01)
+    duplicate = threading.Thread(target=post, args=('duplicate',))
+    duplicate.start()
+    time.sleep(0.1)
+    harness.release.set()
+    first.join(5)
+    duplicate.join(5)
+
+    assert len(harness.calls) == 1
+    assert responses['duplicate'].get_json() == responses['first'].get_json()
+    assert responses['duplicate'].headers[REPLAYED_HEADER] == 'true'
+
+
+def test_invalid_key_is_rejected(client):
+    response = client.post('/echo', json={}, headers={IDEMPOTENCY_HEADER: 'k' * 256})
+    assert response.status_code == 400
+    assert not client.application.calls
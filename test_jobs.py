@@ -0,0 +1,211 @@
+"""
+Background jobs: the job store, bounded fan-out and the byte rate limiter
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import ByteRateLimiter, Job, JobStore, run_bounded
+
+
+def finished(store, job, fn, *args):
+    store.submit(job, fn, *args)
+    assert job.wait(5)
+    return job
+
+
+def test_job_runs_and_is_kept():
+    store = JobStore(workers=1)
+    job = finished(store, Job('test', 1), lambda job, value: job.add_result(value), 'satu')
+    assert job.status == 'done'
+    assert job.results == ['satu']
+    assert job.started_at <= job.finished_at
+    assert store.get(job.id) is job
+    assert store.get('unknown') is None
+    assert store.snapshot() == {'done': 1}
+
+
+def test_exception_fails_the_job():
+    def broken(job):
+        job.add_result('setengah')
+        raise RuntimeError('model crashed')
+
+    job = finished(JobStore(), Job('test', 1), broken)
+    assert (job.status, job.error, job.results) == ('failed', 'model crashed', ['setengah'])
+
+
+def test_cancel_before_and_during_the_run():
+    store = JobStore(workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(job):
+        started.set()
+        release.wait(5)
+
+    running = store.submit(Job('test', 1), blocking)
+    queued = store.submit(Job('test', 1), lambda job: job.add_result('never'))
+    assert started.wait(5)
+    queued.cancel()
+    running.cancel()
+    release.set()
+
+    assert running.wait(5) and queued.wait(5)
+    # A running job finishes its current work, then counts as cancelled
+    assert running.status == 'cancelled'
+    assert queued.status == 'cancelled' and queued.started_at is None and queued.results == []
+
+
+def test_workers_bound_the_running_jobs():
+    store = JobStore(workers=2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def counting(job):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    submitted = [store.submit(Job('test', 1), counting) for _ in range(6)]
+    assert all(job.wait(5) for job in submitted)
+    assert peak[0] == 2
+
+
+def test_finished_jobs_expire_after_the_ttl(monkeypatch):
+    store = JobStore(ttl=60)
+    job = finished(store, Job('test', 1), lambda job: None)
+    slow = store.submit(Job('test', 1), lambda job: time.sleep(0.2))
+
+    later = job.finished_at + 61
+    monkeypatch.setattr(jobs.time, 'time', lambda: later)
+    assert store.get(job.id) is None
+    # Unfinished jobs never expire
+    assert store.get(slow.id) is slow
+    monkeypatch.undo()
+    assert slow.wait(5)
+
+
+def test_wait_results_returns_new_results_or_times_out():
+    job = Job('ask', 1)
+    assert job.wait_results(0, timeout=0.01) == ([], False)
+
+    threading.Timer(0.05, job.add_result, args=('jawaban',)).start()
+    assert job.wait_results(0, timeout=5) == (['jawaban'], False)
+    # Long polling from an index only returns what came after it
+    assert job.wait_results(1, timeout=0.01) == ([], False)
+
+    job._set_status('done')
+    assert job.wait_results(1, timeout=5) == ([], True)
+    assert job.wait_results(0) == (['jawaban'], True)
+
+
+def test_async_waits_wake_on_results_and_completion():
+    store = JobStore(workers=1)
+    release = threading.Event()
+
+    def answering(job):
+        job.add_result('jawaban')
+        release.wait(5)
+
+    async def poll(job):
+        results, finished = await job.wait_results_async(0, timeout=5)
+        timed_out = await job.wait_async(timeout=0.01)
+        release.set()
+        return results, finished, timed_out, await job.wait_async(timeout=5)
+
+    job = store.submit(Job('ask', 1), answering)
+    assert asyncio.run(poll(job)) == (['jawaban'], False, False, True)
+    assert job.status == 'done'
+    assert job.to_dict()['results'] == ['jawaban']
+    assert 'results' not in job.to_dict(results=False)
+
+
+@pytest.mark.parametrize('concurrency, threads', [(3, 3), (10, 5), (0, 1)])
+def test_run_bounded_results_and_workers(concurrency, threads):
+    job = Job('fanout', 1)
+    workers = set()
+
+    def handle(item, worker):
+        workers.add(worker)
+        time.sleep(0.01)
+        return {'item': item}
+
+    run_bounded(job, list(range(5)), handle, concurrency)
+    assert sorted(result['item'] for result in job.results) == list(range(5))
+    # Never more threads than items, and at least one
+    assert workers <= set(range(threads))
+
+
+def test_run_bounded_records_failures():
+    job = Job('fanout', 1)
+
+    def handle(item, worker):
+        if item % 2:
+            raise ValueError(f'item {item} failed')
+        return {'item': item, 'answer': 'ok'}
+
+    run_bounded(job, [1, 2, 3, 4], handle, 2)
+    results = {result['item']: result for result in job.results}
+    assert results[1] == {'item': 1, 'error': 'item 1 failed'}
+    assert results[2] == {'item': 2, 'answer': 'ok'}
+    assert len(job.results) == 4
+
+
+def test_run_bounded_stops_starting_items_after_cancel():
+    job = Job('fanout', 1)
+
+    def handle(item, worker):
+        if item == 2:
+            job.cancel()
+        return item
+
+    run_bounded(job, list(range(10)), handle, 1)
+    assert job.results == [0, 1, 2]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time that only moves when the limiter sleeps; the sleeps are recorded"""
+    now = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(jobs.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(jobs.time, 'sleep', sleep)
+    return sleeps
+
+
+def test_rate_limiter_paces_reads(clock):
+    limiter = ByteRateLimiter(1000)
+    for size in (500, 500, 2000, 0):
+        limiter.acquire(size)
+    # The first read starts at once; each later one waits for the bytes before it
+    assert clock == pytest.approx([0.5, 0.5, 2.0])
+
+
+@pytest.mark.parametrize('rate', [0, None])
+def test_rate_limiter_without_limit(clock, rate):
+    limiter = ByteRateLimiter(rate)
+    limiter.acquire(10 ** 9)
+    limiter.acquire(10 ** 9)
+    assert clock == []
+
+
+def test_rate_limiter_is_shared_by_threads():
+    limiter = ByteRateLimiter(20_000)
+    started = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire, args=(1000,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 5000 bytes at 20 kB/s: the last of the five reads starts after 0.2s
+    assert time.monotonic() - started >= 0.19
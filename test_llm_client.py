@@ -0,0 +1,134 @@
+"""
+Circuit breaker state transitions of the LLM client, against fake LM Studio servers
+"""
+
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from fake_lm_studio import FakeLMStudioHandler
+from llm_client import LLMClient, AsyncLLMClient, CircuitBreaker, LLMResponseError, LLMUnavailableError
+
+MESSAGES = [{'role': 'user', 'content': 'Apa metode penelitian?'}]
+
+
+class HealthyProbeHandler(FakeLMStudioHandler):
+    """Answers health probes even while completions fail, so only requests decide the outcome"""
+
+    def do_GET(self):
+        self.send_json(200, {'data': [{'id': self.model, 'object': 'model'}]})
+
+
+@pytest.fixture
+def fake_server():
+    """``fake_server(**settings)`` starts a fake LM Studio and returns its completions URL"""
+    servers = []
+
+    def start(**settings):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), type('Handler', (HealthyProbeHandler,), settings))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def half_open_breaker():
+    """An open breaker whose reset timeout has passed: the next request is the half-open trial"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(fake_server):
+    client = LLMClient(fake_server(status=503), breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+                       max_retries=1, backoff_base=0.01)
+    with pytest.raises(LLMResponseError):
+        client.complete(MESSAGES)
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(LLMUnavailableError, match='circuit open'):
+        client.complete(MESSAGES)
+
+
+def test_successful_trial_closes_breaker(fake_server):
+    client = LLMClient(fake_server(), breaker=half_open_breaker(), max_retries=0)
+    assert client.complete(MESSAGES).startswith('Jawaban')
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_server_error_during_trial_reopens_breaker(fake_server):
+    client = LLMClient(fake_server(status=500), breaker=half_open_breaker(), max_retries=0)
+    with pytest.raises(LLMResponseError):
+        client.complete(MESSAGES)
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+
+def test_client_error_during_trial_closes_breaker(fake_server):
+    client = LLMClient(fake_server(status=400), breaker=half_open_breaker(), max_retries=0)
+    with pytest.raises(LLMResponseError):
+        client.complete(MESSAGES)
+    # A 4xx proves the backend is reachable
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.breaker.allow_request()
+
+
+def test_released_trial_can_be_taken_again():
+    breaker = half_open_breaker()
+    assert breaker.permit() == (True, True)
+    assert breaker.permit() == (False, False)
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.permit() == (True, True)
+
+
+def test_no_healthy_backend_leaves_trial_free():
+    client = LLMClient('http://127.0.0.1:9/v1/chat/completions', breaker=half_open_breaker(), max_retries=0)
+    client.backends.backends[0].healthy = False
+    with pytest.raises(LLMUnavailableError, match='No healthy'):
+        client.complete(MESSAGES)
+    # Once the backend recovers, the trial is still available
+    assert client.breaker.allow_request()
+
+
+def test_deadline_cut_is_not_a_backend_failure(fake_server):
+    client = LLMClient(fake_server(latency=1.0), breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60),
+                       max_retries=0)
+    with pytest.raises(DeadlineExceeded):
+        client.complete(MESSAGES, deadline=Deadline(0.3))
+    # The caller ran out of time; the backend and the breaker are untouched
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.backends.backends[0].healthy
+    assert client.backends.backends[0].failures == 0
+
+
+def test_expired_deadline_leaves_trial_free(fake_server):
+    client = LLMClient(fake_server(), breaker=half_open_breaker(), max_retries=0)
+    with pytest.raises(DeadlineExceeded):
+        client.complete(MESSAGES, deadline=Deadline(0.0))
+    assert client.breaker.allow_request()
+
+
+def test_cancelled_async_trial_is_released(fake_server):
+    url = fake_server(latency=1.0)
+
+    async def cancel_trial():
+        client = AsyncLLMClient(url, breaker=half_open_breaker(), max_retries=0)
+        task = asyncio.create_task(client.complete(MESSAGES))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await client.aclose()
+        return client.breaker
+
+    # A cancelled trial proves nothing: the breaker stays half-open with the trial free
+    breaker = asyncio.run(cancel_trial())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
@@ -1,5 +1,6 @@
 import requests
-import json
+
+from llm_backends import probe_models, BackendProbeError
 
 def test_lm_studio_connection():
     """Test connection to LM Studio and model functionality"""
@@ -11,12 +12,8 @@ def test_lm_studio_connection():
     # Test 1: Check if LM Studio is running
     print("1. Testing LM Studio connection...")
     try:
-        response = requests.get(f"{base_url}/models", timeout=5)
-        if response.status_code == 200:
-            print("✅ LM Studio is running!")
-        else:
-            print(f"❌ LM Studio responded with status {response.status_code}")
-            return False
+        models = probe_models(base_url, timeout=5)
+        print("✅ LM Studio is running!")
     except requests.exceptions.ConnectionError:
         print("❌ Cannot connect to LM Studio!")
         print("Please make sure:")
@@ -24,23 +21,21 @@ def test_lm_studio_connection():
         print("- Server is started (click 'Start Server' in LM Studio)")
         print("- Server URL is http://127.0.0.1:1234")
         return False
+    except BackendProbeError as e:
+        print(f"❌ LM Studio responded with {e}")
+        return False
     except Exception as e:
         print(f"❌ Connection error: {e}")
         return False
     
     # Test 2: Check available models
     print("\n2. Checking available models...")
-    try:
-        models = response.json()
-        if models.get('data') and len(models['data']) > 0:
-            model_name = models['data'][0]['id']
-            print(f"✅ Model loaded: {model_name}")
-        else:
-            print("❌ No model loaded!")
-            print("Please load a model in LM Studio (recommended: mistral-nemo-instruct-2407)")
-            return False
-    except Exception as e:
-        print(f"❌ Error parsing models response: {e}")
+    if models:
+        model_name = models[0]
+        print(f"✅ Model loaded: {model_name}")
+    else:
+        print("❌ No model loaded!")
+        print("Please load a model in LM Studio (recommended: mistral-nemo-instruct-2407)")
         return False
     
     # Test 3: Test chat completion with short context
@@ -0,0 +1,112 @@
+"""
+MinHash signatures and the LSH duplicate index
+"""
+
+import random
+
+import pytest
+
+from near_duplicates import (
+    NUM_HASHES, DuplicateIndex, decode_signature, encode_signature, minhash, shingle_hashes, similarity
+)
+
+VOCABULARY = [f"kata{index}" for index in range(2000)]
+
+
+def text(seed, words=1000):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def edited(original, every):
+    """``original`` with one word in every ``every`` replaced"""
+    words = original.split()
+    for index in range(0, len(words), every):
+        words[index] = f"ganti{index}"
+    return ' '.join(words)
+
+
+def jaccard(first, second):
+    first, second = shingle_hashes(first), shingle_hashes(second)
+    return len(first & second) / len(first | second)
+
+
+def test_empty_text_has_no_signature():
+    assert minhash('') is None
+    assert minhash('!!! ---') is None
+
+
+def test_densification_fills_every_bin():
+    # Fewer words than a shingle: one hash, so all bins but one borrow it
+    signature = minhash('satu dua tiga')
+    assert len(signature) == NUM_HASHES
+    assert len(set(signature)) == NUM_HASHES
+    assert minhash('satu dua tiga') == signature
+    # Borrowed values stay distinct from native ones: unrelated tiny texts rarely agree
+    assert similarity(signature, minhash('empat lima enam')) < 0.1
+
+
+def test_estimate_follows_jaccard():
+    original = text(1)
+    copy = edited(original, 30)
+    assert similarity(minhash(original), minhash(copy)) == pytest.approx(jaccard(original, copy), abs=0.1)
+
+
+def test_near_copy_versus_unrelated():
+    original = text(1)
+    assert similarity(minhash(original), minhash(edited(original, 200))) >= 0.8
+    assert similarity(minhash(original), minhash(text(2))) < 0.2
+
+
+def test_signature_round_trip():
+    signature = minhash(text(3))
+    assert decode_signature(encode_signature(signature)) == signature
+
+
+def corpus_index(extra=()):
+    """A built index of 50 unrelated documents and ``extra``"""
+    documents = [(index, 1 + index % 3, minhash(text(100 + index))) for index in range(50)] + list(extra)
+    index = DuplicateIndex(lambda: documents)
+    index.duplicates_of(0)
+    return index
+
+
+def test_lsh_finds_a_similar_pair():
+    original = text(1)
+    copy = edited(original, 100)
+    assert jaccard(original, copy) == pytest.approx(0.9, abs=0.03)
+
+    index = corpus_index([(500, 7, minhash(original))])
+    # With no threshold, find returns every LSH candidate: the pair, and no unrelated document
+    assert [document_id for document_id, _, _ in index.find(minhash(copy), threshold=0)] == [500]
+    matches = index.find(minhash(copy), threshold=0.7)
+    assert [document_id for document_id, _, _ in matches] == [500]
+    assert matches[0][1] == 7
+    assert index.find(minhash(text(2))) == []
+
+
+def test_duplicates_of_excludes_the_document():
+    signature = minhash(text(1))
+    index = corpus_index([(500, 7, signature), (501, 8, signature)])
+    assert index.duplicates_of(500) == [(501, 8, 1.0)]
+    assert index.duplicates_of(999) == []
+
+
+def test_remove_document_and_owner():
+    signature = minhash(text(1))
+    index = corpus_index([(500, 7, signature), (501, 7, signature), (502, 8, signature)])
+    index.remove_document(502)
+    assert [match[0] for match in index.find(signature)] == [500, 501]
+    index.remove_owner(7)
+    assert index.find(signature) == []
+    assert not any(500 in bucket or 501 in bucket for bucket in index._buckets.values())
+
+
+def test_add_after_build():
+    index = corpus_index()
+    signature = minhash(text(1))
+    index.add_document(500, 7, signature)
+    assert index.find(signature) == [(500, 7, 1.0)]
+    # Re-adding replaces the old signature
+    index.add_document(500, 7, minhash(text(2)))
+    assert index.find(signature) == []
@@ -0,0 +1,79 @@
+"""
+Extractive compression of passages against a question, and its token accounting
+"""
+
+import pytest
+
+from conversation_memory import estimate_tokens
+from prompt_compression import CompressionStats, compress_passage, score_sentences, split_sentences
+
+PASSAGE = (
+    "Penelitian ini membahas pembelajaran daring di sekolah dasar. "
+    "Metode yang digunakan adalah survei terhadap guru. "
+    "Data dikumpulkan dari dua ratus responden di Semarang. "
+    "Hasil penelitian menunjukkan nilai siswa meningkat. "
+    "Kendala utama adalah koneksi internet yang lambat. "
+    "Penelitian selanjutnya disarankan memakai wawancara."
+)
+
+
+def test_split_sentences():
+    assert split_sentences("Satu. Dua?  Tiga!\n\nEmpat\n\n") == ['Satu.', 'Dua?', 'Tiga!', 'Empat']
+
+
+def test_scores_follow_question_terms():
+    sentences = split_sentences(PASSAGE)
+    scores = score_sentences(sentences, "Metode apa yang digunakan?")
+    assert max(range(len(sentences)), key=scores.__getitem__) == 1
+    assert scores.count(0.0) == len(sentences) - 1
+
+
+def test_common_terms_weigh_less():
+    sentences = ["Siswa belajar daring.", "Siswa belajar di kelas.", "Siswa memakai modul cetak."]
+    scores = score_sentences(sentences, "Apakah siswa belajar memakai modul?")
+    # "siswa" is in every sentence and "belajar" in two, so the rarer "modul" decides
+    assert scores[2] > scores[0]
+    assert scores[0] == pytest.approx(scores[1])
+
+
+def test_question_without_terms_scores_nothing():
+    assert score_sentences(['Satu.', 'Dua.'], "apa yang itu?") == [0.0, 0.0]
+
+
+@pytest.mark.parametrize('ratio', [0.2, 0.4, 0.6, 0.8])
+def test_ratio_bounds_the_length(ratio):
+    compressed = compress_passage(PASSAGE, "Apa hasil penelitian dan kendalanya?", ratio)
+    assert len(compressed) <= len(PASSAGE) * ratio
+    kept = split_sentences(compressed)
+    # Kept sentences are the passage's own, in their original order
+    sentences = split_sentences(PASSAGE)
+    assert kept == [sentence for sentence in sentences if sentence in kept]
+
+
+def test_higher_ratio_keeps_more():
+    question = "Apa hasil penelitian dan kendalanya?"
+    lengths = [len(compress_passage(PASSAGE, question, ratio)) for ratio in (0.2, 0.5, 0.8, 1)]
+    assert lengths == sorted(lengths)
+    assert compress_passage(PASSAGE, question, 1) == PASSAGE
+    assert "Hasil penelitian menunjukkan nilai siswa meningkat." in compress_passage(PASSAGE, question, 0.2)
+
+
+def test_best_sentence_is_kept_even_over_budget():
+    assert compress_passage(PASSAGE, "Metode apa yang digunakan?", 0.01) == \
+        "Metode yang digunakan adalah survei terhadap guru."
+    assert compress_passage("Satu kalimat saja tanpa titik", "kalimat", 0.1) == "Satu kalimat saja tanpa titik"
+
+
+def test_stats_accumulate_over_passages():
+    stats = CompressionStats(0.5)
+    first = compress_passage(PASSAGE, "Apa kendalanya?", 0.5, stats)
+    second = compress_passage("Pendek.", "Apa kendalanya?", 0.5, stats)
+    assert stats.original_tokens == estimate_tokens(PASSAGE) + estimate_tokens("Pendek.")
+    assert stats.compressed_tokens == estimate_tokens(first) + estimate_tokens(second)
+    assert stats.to_dict() == {
+        'ratio': 0.5,
+        'original_tokens': stats.original_tokens,
+        'compressed_tokens': stats.compressed_tokens,
+        'tokens_saved': stats.original_tokens - stats.compressed_tokens
+    }
+    assert stats.tokens_saved > 0
@@ -0,0 +1,151 @@
+"""
+Re-extraction runs stopped part way and resumed from their ExtractionRun checkpoint
+"""
+
+from collections import Counter
+
+import pytest
+
+import app as tess
+from document_index import decode_terms
+from jobs import Job
+from text_analyzer import analyze
+
+
+@pytest.fixture
+def corpus(admin, tmp_path, monkeypatch):
+    """Five outdated documents whose files now read differently from their stored text, in batches of two"""
+    monkeypatch.setattr(tess, 'REEXTRACT_BATCH_SIZE', 2)
+    for index in range(5):
+        path = tmp_path / f"paper{index}.txt"
+        path.write_text(f"Teks baru dokumen {index} hasil ekstraksi ulang.", encoding='utf-8')
+        tess.db.session.add(tess.Document(
+            filename=path.name, original_filename=path.name, file_path=str(path),
+            content=f"Teks lama dokumen {index}", user_id=admin
+        ))
+    tess.db.session.commit()
+    return admin, [document.id for document in tess.Document.query.order_by(tess.Document.id)]
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Ids of the documents whose files were read, in order"""
+    reads = []
+    reextract_file = tess.reextract_file
+
+    def recording(document, limiter):
+        reads.append(document[0])
+        return reextract_file(document, limiter)
+
+    monkeypatch.setattr(tess, 'reextract_file', recording)
+    return reads
+
+
+class StopAfterFirstBatch(Job):
+    def add_result(self, result):
+        super().add_result(result)
+        self.cancel()
+
+
+def new_run():
+    with tess.app.app_context():
+        run = tess.ExtractionRun(version=tess.EXTRACTOR_VERSION, status='running')
+        tess.db.session.add(run)
+        tess.db.session.commit()
+        return run.id
+
+
+def run_state(run_id):
+    with tess.app.app_context():
+        run = tess.db.session.get(tess.ExtractionRun, run_id)
+        return {
+            'status': run.status, 'cursor': run.cursor,
+            'processed': run.processed, 'changed': run.changed, 'failed': run.failed
+        }
+
+
+def contents():
+    with tess.app.app_context():
+        return [document.content for document in tess.Document.query.order_by(tess.Document.id)]
+
+
+def resume(user_id):
+    with tess.app.app_context():
+        run, job = tess.start_reextraction(user_id)
+        run_id = run.id
+    assert job is not None
+    assert job.wait(30)
+    assert job.error is None
+    return run_id, job
+
+
+def assert_resumed(user_id, run_id, ids, extracted):
+    resumed_id, job = resume(user_id)
+    assert resumed_id == run_id
+    # The resumed run starts after the checkpoint and reads every file once overall
+    assert [result['cursor'] for result in job.results] == [ids[3], ids[4]]
+    assert extracted == ids
+    assert run_state(run_id) == {'status': 'done', 'cursor': ids[4], 'processed': 5, 'changed': 5, 'failed': 0}
+    assert all(content.startswith('Teks baru') for content in contents())
+    with tess.app.app_context():
+        # The stored search terms follow the new text
+        for document in tess.Document.query:
+            terms = decode_terms(tess.db.session.get(tess.DocumentTerms, document.id).counts)
+            assert terms == Counter(analyze(document.content)) + Counter(analyze(document.original_filename))
+        assert tess.outdated_documents().count() == 0
+        # A finished run is not resumed: the next request starts a new one
+        assert tess.reextraction_overview()['run']['status'] == 'done'
+
+
+def test_paused_run_resumes_from_its_checkpoint(corpus, extracted):
+    user_id, ids = corpus
+    run_id = new_run()
+    tess.run_reextraction(StopAfterFirstBatch('reextract', user_id), run_id)
+
+    assert run_state(run_id) == {'status': 'paused', 'cursor': ids[1], 'processed': 2, 'changed': 2, 'failed': 0}
+    assert [content.startswith('Teks baru') for content in contents()] == [True, True, False, False, False]
+    with tess.app.app_context():
+        assert tess.outdated_documents().count() == 3
+    assert_resumed(user_id, run_id, ids, extracted)
+
+
+def test_failed_batch_is_redone_on_resume(corpus, extracted, monkeypatch):
+    user_id, ids = corpus
+    save_reextracted = tess.save_reextracted
+    saves = []
+
+    def failing_second_batch(run, batch, results):
+        saves.append(batch)
+        if len(saves) == 2:
+            raise RuntimeError('database is locked')
+        return save_reextracted(run, batch, results)
+
+    monkeypatch.setattr(tess, 'save_reextracted', failing_second_batch)
+    run_id = new_run()
+    with pytest.raises(RuntimeError):
+        tess.run_reextraction(Job('reextract', user_id), run_id)
+    # The failed batch was rolled back; the checkpoint stays after the first one
+    assert run_state(run_id) == {'status': 'failed', 'cursor': ids[1], 'processed': 2, 'changed': 2, 'failed': 0}
+    assert [content.startswith('Teks baru') for content in contents()] == [True, True, False, False, False]
+
+    monkeypatch.setattr(tess, 'save_reextracted', save_reextracted)
+    resumed_id, job = resume(user_id)
+    assert resumed_id == run_id
+    assert [result['cursor'] for result in job.results] == [ids[3], ids[4]]
+    # Only the batch that failed to save is read again
+    assert extracted == ids[:4] + ids[2:]
+    assert run_state(run_id)['status'] == 'done'
+    assert all(content.startswith('Teks baru') for content in contents())
+
+
+def test_interrupted_run_resumes_after_a_restart(corpus, extracted):
+    user_id, ids = corpus
+    run_id = new_run()
+    tess.run_reextraction(StopAfterFirstBatch('reextract', user_id), run_id)
+    # The server stopped during the run: its job is gone and the row still says running
+    with tess.app.app_context():
+        run = tess.db.session.get(tess.ExtractionRun, run_id)
+        run.status, run.job_id = 'running', 'lost-with-the-old-process'
+        tess.db.session.commit()
+        assert tess.reextraction_overview()['run']['status'] == 'interrupted'
+    assert_resumed(user_id, run_id, ids, extracted)
@@ -0,0 +1,137 @@
+"""
+Related papers: the incrementally maintained neighbour table against full rebuilds
+"""
+
+import pytest
+
+from related_papers import RelatedPapers
+
+TOPICS = {
+    'pendidikan': 'siswa guru sekolah kurikulum kelas belajar pembelajaran nilai ujian',
+    'kesehatan': 'pasien dokter rumah sakit obat penyakit perawat klinik gizi vaksin',
+    'ekonomi': 'pasar harga inflasi bank investasi saham modal pajak ekspor',
+    'pertanian': 'padi petani sawah pupuk panen irigasi tanah benih hama',
+}
+
+
+def paper(topic, variant):
+    """A document mostly about ``topic``, weighted differently for every ``variant``"""
+    words = TOPICS[topic].split()
+    return ' '.join(' '.join([word] * (1 + (index * (variant + 2)) % 4)) for index, word in enumerate(words))
+
+
+def corpus():
+    """``(document_id, owner_id, content)``: three papers per topic, owners 1 and 2 alternating"""
+    documents = []
+    for topic in TOPICS:
+        for variant in range(3):
+            document_id = len(documents) + 1
+            documents.append((document_id, 1 + document_id % 2, f"{paper(topic, variant)} dokumen{document_id}"))
+    return documents
+
+
+def built(documents, **kwargs):
+    table = RelatedPapers(lambda: list(documents), **kwargs)
+    table.related(documents[0][0])
+    return table
+
+
+def ids(related):
+    return [document_id for document_id, _ in related]
+
+
+def assert_matches_rebuild(table, documents, limit=5):
+    """
+    Incremental updates leave the other vectors on the old IDF weights, so
+    scores may differ slightly from a rebuild, but not which neighbours are listed
+    """
+    fresh = built(documents, top_n=table.top_n)
+    for document_id, _, _ in documents:
+        for same_owner in (True, False):
+            incremental = dict(table.related(document_id, limit, same_owner))
+            rebuilt = dict(fresh.related(document_id, limit, same_owner))
+            assert incremental.keys() == rebuilt.keys(), (document_id, same_owner)
+            assert incremental == pytest.approx(rebuilt, abs=0.1), (document_id, same_owner)
+
+
+def test_neighbours_share_the_topic():
+    table = built(corpus())
+    # Documents 1-3 are about education
+    assert set(ids(table.related(1, 2, same_owner=False))) == {2, 3}
+    assert table.related(99) is None
+
+
+def test_owner_scope():
+    documents = corpus()
+    owners = {document_id: owner for document_id, owner, _ in documents}
+    table = built(documents)
+    for document_id, owner, _ in documents:
+        assert all(owners[other] == owner for other in ids(table.related(document_id, 10, same_owner=True)))
+    assert len(table.related(1, 10, same_owner=False)) > len(table.related(1, 10, same_owner=True))
+
+
+def test_added_document_is_offered_to_its_neighbours():
+    documents = corpus()
+    table = built(documents, top_n=2)
+    # Nearly a copy of document 1
+    added = (13, 1, f"{paper('pendidikan', 0)} siswa dokumen13")
+    table.add_document(*added)
+
+    # The new education paper now ranks among the other education papers' neighbours
+    assert ids(table.related(1, 2, same_owner=False))[0] == 13
+    # ...but only in the owner scope of papers of the same owner
+    for document_id, owner, _ in documents:
+        if owner != 1:
+            assert 13 not in ids(table.related(document_id, 2, same_owner=True))
+    assert_matches_rebuild(table, documents + [added], limit=2)
+
+
+def test_add_before_build_is_left_to_the_loader():
+    documents = corpus()
+    table = RelatedPapers(lambda: list(documents))
+    table.add_document(99, 1, paper('ekonomi', 7))
+    assert table.related(1) is not None
+    assert table.related(99) is None
+
+
+def test_removal_marks_neighbours_stale():
+    documents = corpus()
+    table = built(documents, top_n=2)
+    listing = [document_id for document_id, _, _ in documents if 1 in ids(table.related(document_id, 2, False))]
+    assert listing
+
+    table.remove_document(1)
+    assert table._stale >= set(listing)
+    assert table.related(1) is None
+    for document_id in listing:
+        assert 1 not in ids(table.related(document_id, 2, same_owner=False))
+    assert not table._stale & set(listing)
+    assert_matches_rebuild(table, documents[1:], limit=2)
+
+
+def test_remove_owner():
+    documents = corpus()
+    table = built(documents)
+    table.remove_owner(2)
+    remaining = [document for document in documents if document[1] != 2]
+    for document_id, owner, _ in documents:
+        related = table.related(document_id, 10, same_owner=False)
+        if owner == 2:
+            assert related is None
+        else:
+            assert set(ids(related)) <= {document_id for document_id, _, _ in remaining}
+
+
+@pytest.mark.parametrize('added, rebuilt', [(3, False), (4, True)])
+def test_rebuild_after_a_quarter_drift(added, rebuilt):
+    documents = corpus()
+    table = built(documents)
+    new = [(100 + index, 1, f"{paper('kesehatan', index)} dokumen{100 + index}") for index in range(added)]
+    for document in new:
+        table.add_document(*document)
+    # 12 documents: three more stay within the 25% drift, a fourth triggers the rebuild
+    assert table._built_size == (12 + added if rebuilt else 12)
+    assert_matches_rebuild(table, documents + new)
+    if rebuilt:
+        fresh = built(documents + new)
+        assert table.related(1, 5, False) == fresh.related(1, 5, False)
@@ -0,0 +1,160 @@
+"""
+Single-flight coalescing: leaders relay a generation, followers read it from threads or coroutines
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from llm_client import LLMResponseError, LLMTimeoutError, LLMUnavailableError
+from prompt_builder import build_messages
+from single_flight import SingleFlight, request_key
+
+
+def follow_in_thread(flight, timeout=5):
+    """Start following ``flight``; returns the thread and the dict its chunks or error end up in"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['chunks'] = list(flight.follow(timeout))
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_follower_reads_the_leader_relay():
+    flights = SingleFlight()
+    flight, leader = flights.join('k')
+    follower, joined = flights.join('k')
+    assert leader and not joined and follower is flight
+    assert flight.followers == 1
+
+    thread, outcome = follow_in_thread(follower)
+    assert list(flight.relay(iter(['Jawa', 'ban']))) == ['Jawa', 'ban']
+    thread.join(5)
+    assert outcome == {'chunks': ['Jawa', 'ban']}
+    assert flights.in_flight() == 0
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+    follower, _ = flights.join('k')
+    thread, outcome = follow_in_thread(follower)
+
+    def failing():
+        yield 'Jawa'
+        raise LLMResponseError("LM Studio returned status 500")
+
+    with pytest.raises(LLMResponseError):
+        list(flight.relay(failing()))
+    thread.join(5)
+    assert isinstance(outcome['error'], LLMResponseError)
+
+
+def test_abandoned_flight_fails_followers():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+    follower, _ = flights.join('k')
+    thread, outcome = follow_in_thread(follower)
+    flight.publish('Jawa')
+    flight.abandon()
+    thread.join(5)
+    assert isinstance(outcome['error'], LLMUnavailableError)
+    # The error comes after the chunks that were already published
+    replay = flight.follow()
+    assert next(replay) == 'Jawa'
+    with pytest.raises(LLMUnavailableError):
+        next(replay)
+
+
+def test_late_joiner_after_finish_leads_a_new_flight():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+    list(flight.relay(iter(['Jawaban'])))
+    # A finished flight still answers the followers that joined it
+    assert flight.result() == 'Jawaban'
+
+    later, leader = flights.join('k')
+    assert leader and later is not flight
+
+
+def test_finish_is_idempotent():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+    flight.finish()
+    flight.abandon()
+    assert flight.error is None
+
+
+def test_follower_times_out_without_progress():
+    flights = SingleFlight()
+    flights.join('k')
+    follower, _ = flights.join('k')
+    with pytest.raises(LLMTimeoutError):
+        follower.result(timeout=0.05)
+
+
+def test_async_relay_and_follow():
+    flights = SingleFlight()
+
+    async def generate():
+        for content in ('Jawa', 'ban'):
+            await asyncio.sleep(0.01)
+            yield content
+
+    async def run():
+        flight, _ = flights.join('k')
+        follower, _ = flights.join('k')
+        waiting = asyncio.create_task(follower.result_async(5))
+        relayed = [content async for content in flight.arelay(generate())]
+        return relayed, await waiting
+
+    assert asyncio.run(run()) == (['Jawa', 'ban'], 'Jawaban')
+
+
+def test_async_follower_gets_leader_error():
+    flights = SingleFlight()
+
+    async def run():
+        flight, _ = flights.join('k')
+        follower, _ = flights.join('k')
+        waiting = asyncio.create_task(follower.result_async(5))
+        await asyncio.sleep(0.01)
+        flight.abandon()
+        return await waiting
+
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(run())
+
+
+def test_async_follower_of_thread_leader():
+    flights = SingleFlight()
+    flight, _ = flights.join('k')
+    follower, _ = flights.join('k')
+
+    def lead():
+        list(flight.relay(iter(['Jawa', 'ban'])))
+
+    async def follow():
+        threading.Timer(0.05, lead).start()
+        return await follower.result_async(5)
+
+    assert asyncio.run(follow()) == 'Jawaban'
+
+
+def test_key_covers_the_conversation():
+    context = "Document: paper.pdf\nContent: ..."
+    question = "Apa metode penelitian?"
+    first = request_key('local-model', build_messages(context, question), temperature=0.7)
+    # Another user's first question on the same paper shares the generation
+    assert first == request_key('local-model', build_messages(context, question), temperature=0.7)
+    # A follow-up depends on its own history, so it does not
+    history = [("Siapa penulisnya?", "Budi")]
+    assert first != request_key('local-model', build_messages(context, question, history), temperature=0.7)
+    assert first != request_key('local-model', build_messages(context, question), temperature=0.2)
@@ -0,0 +1,77 @@
+"""
+Stemming, stopwords and language detection of the text analyzer
+"""
+
+import pytest
+
+from text_analyzer import analyze, detect_language, stem_english, stem_indonesian, tokenize
+
+
+@pytest.mark.parametrize('words, root', [
+    (['penelitian', 'meneliti', 'diteliti', 'peneliti', 'teliti', 'penelitiannya'], 'teliti'),
+    (['pendidikan', 'mendidik', 'didikan', 'pendidik', 'didik'], 'didik'),
+    (['pengetahuan', 'mengetahui', 'diketahui', 'tahu'], 'tahu'),
+    (['pemerintahan', 'pemerintah', 'memerintah', 'perintah'], 'perintah'),
+    (['pembelajaran', 'mempelajari', 'pelajaran', 'belajar'], 'ajar'),
+    (['memperbaiki', 'perbaikan', 'diperbaiki'], 'baik'),
+    (['keberhasilan', 'berhasil', 'hasilnya'], 'hasil'),
+    (['pengembangan', 'mengembangkan', 'berkembang', 'perkembangan'], 'kembang'),
+    (['pertanyaan', 'bertanya', 'menanyakan', 'ditanyakan'], 'tanya'),
+    (['pekerjaan', 'bekerja', 'pekerja', 'dikerjakan'], 'kerja'),
+    (['menyimpulkan', 'kesimpulan', 'disimpulkan'], 'simpul'),
+    (['penggunaan', 'menggunakan', 'digunakan', 'kegunaan'], 'guna'),
+])
+def test_indonesian_word_family_shares_a_stem(words, root):
+    assert {word: stem_indonesian(word) for word in words} == {word: root for word in words}
+
+
+@pytest.mark.parametrize('word', ['kapan', 'jalan', 'makan', 'hari', 'sistem'])
+def test_roots_that_look_affixed_are_kept(word):
+    assert stem_indonesian(word) == word
+
+
+@pytest.mark.parametrize('words, stem', [
+    # Outside the lexicon, the rules alone still agree
+    (['pengobatan', 'mengobati', 'obat'], 'obat'),
+    (['penyelidikan', 'menyelidiki', 'diselidiki'], 'selidik'),
+])
+def test_rule_stems_without_lexicon(words, stem):
+    assert {stem_indonesian(word) for word in words} == {stem}
+
+
+@pytest.mark.parametrize('word, stem', [
+    ('studies', 'study'),
+    ('classes', 'class'),
+    ('methods', 'method'),
+    ('analysis', 'analysis'),
+    ('learning', 'learn'),
+    ('proposed', 'propos'),
+])
+def test_english_stems(word, stem):
+    assert stem_english(word) == stem
+
+
+@pytest.mark.parametrize('text, language', [
+    ('Penelitian ini adalah studi tentang pendidikan yang dilakukan di sekolah', 'id'),
+    ('This study is about the education of students in the schools', 'en'),
+    ('', 'id'),
+])
+def test_detect_language(text, language):
+    assert detect_language(tokenize(text)) == language
+
+
+@pytest.mark.parametrize('text, terms', [
+    ('Kapan penelitian ini dilakukan?', ['teliti', 'laku']),
+    ('Siapa penulis dan apa metode yang digunakan?', ['tulis', 'metode', 'guna']),
+    ('What are the methods of this study?', ['method', 'study']),
+])
+def test_analyze_drops_stopwords_and_stems(text, terms):
+    assert analyze(text) == terms
+
+
+def test_analyze_detects_language_per_chunk():
+    indonesian = 'penelitian ini adalah tentang pendidikan dan ' * 10
+    english = 'the studies of the methods and the classes ' * 10
+    terms = analyze(indonesian + english, chunk_tokens=60)
+    assert 'teliti' in terms and 'study' in terms
+    assert 'studies' not in terms